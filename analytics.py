@@ -1,83 +1,121 @@
-from models import db, RecyclingRecord, User, RecyclingItem
+from models import (db, User, RecyclingItem, UserTotals, UserItemCount, ItemTotals,
+                    UserCategoryCount, CategoryCount, UserDailyCount, RegionItemTotals, RegionCategoryCount)
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, select
+from leaderboard import leaderboards, with_usernames
+from db_routing import reads_from_replica
+
+# Statement builders shared by RecyclingAnalytics and the async handlers in asgi.py
+
+
+def most_recycled_query(user_id):
+    return select(RecyclingItem.name, UserItemCount.count) \
+        .join(RecyclingItem, RecyclingItem.id == UserItemCount.item_id) \
+        .where(UserItemCount.user_id == user_id) \
+        .order_by(desc(UserItemCount.count), UserItemCount.item_id).limit(1)
+
+
+def weekly_items_query(user_id):
+    week_ago = (datetime.utcnow() - timedelta(days=7)).date()
+    return select(func.sum(UserDailyCount.items)) \
+        .where(UserDailyCount.user_id == user_id, UserDailyCount.day >= week_ago)
+
+
+def user_stats_result(totals, most_recycled, weekly_items):
+    return {
+        'total_points': totals.total_points if totals else 0,
+        'total_items': totals.total_items if totals else 0,
+        'most_recycled_item': most_recycled[0] if most_recycled else None,
+        'most_recycled_count': most_recycled[1] if most_recycled else 0,
+        'weekly_activity': weekly_items or 0
+    }
+
+
+def _item_totals(region_id):
+    if region_id is None:
+        return ItemTotals, []
+    return RegionItemTotals, [RegionItemTotals.region_id == region_id]
+
+
+def total_users_query(region_id=None):
+    query = select(func.count(User.id))
+    return query if region_id is None else query.where(User.region_id == region_id)
+
+
+def recycled_totals_query(region_id=None):
+    totals_model, where = _item_totals(region_id)
+    return select(func.sum(totals_model.count), func.sum(totals_model.points)).where(*where)
+
+
+def top_recyclers_query(region_id=None, limit=5):
+    """Top users by points, ties broken by id as the leaderboard orders them"""
+    query = select(User.username, User.points).where(User.points > 0)
+    if region_id is not None:
+        query = query.where(User.region_id == region_id)
+    return query.order_by(desc(User.points), User.id).limit(limit)
+
+
+def popular_items_query(region_id=None, limit=5):
+    totals_model, where = _item_totals(region_id)
+    return select(RecyclingItem.name, totals_model.count) \
+        .join(RecyclingItem, RecyclingItem.id == totals_model.item_id) \
+        .where(*where) \
+        .order_by(desc(totals_model.count), totals_model.item_id).limit(limit)
+
+
+def community_stats_result(total_users, recycled_totals, top_recyclers, popular_items):
+    total_recycled_items, total_points_earned = recycled_totals
+    return {
+        'total_users': total_users or 0,
+        'total_recycled_items': total_recycled_items or 0,
+        'total_points_earned': total_points_earned or 0,
+        'top_recyclers': [{'username': u[0], 'points': u[1]} for u in top_recyclers],
+        'popular_items': [{'item': i[0], 'count': i[1]} for i in popular_items]
+    }
 
 
 class RecyclingAnalytics:
+    """Dashboard statistics served from the rollup tables and the leaderboard"""
+
     @staticmethod
+    @reads_from_replica
     def get_user_stats(user_id):
         """Get comprehensive statistics for a user"""
-        total_points = db.session.query(func.sum(RecyclingRecord.points_earned)) \
-                           .filter(RecyclingRecord.user_id == user_id).scalar() or 0
-
-        total_items = RecyclingRecord.query.filter_by(user_id=user_id).count()
-
-        # Most recycled item
-        most_recycled = db.session.query(
-            RecyclingRecord.item_name,
-            func.count(RecyclingRecord.id).label('count')
-        ).filter(RecyclingRecord.user_id == user_id) \
-            .group_by(RecyclingRecord.item_name) \
-            .order_by(desc('count')).first()
-
-        # Weekly activity
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        weekly_items = RecyclingRecord.query.filter(
-            RecyclingRecord.user_id == user_id,
-            RecyclingRecord.recycled_at >= week_ago
-        ).count()
-
-        return {
-            'total_points': total_points,
-            'total_items': total_items,
-            'most_recycled_item': most_recycled[0] if most_recycled else None,
-            'most_recycled_count': most_recycled[1] if most_recycled else 0,
-            'weekly_activity': weekly_items
-        }
+        return user_stats_result(
+            db.session.get(UserTotals, user_id),
+            db.session.execute(most_recycled_query(user_id)).first(),
+            db.session.scalar(weekly_items_query(user_id))
+        )
 
     @staticmethod
-    def get_community_stats():
-        """Get community-wide statistics"""
-        total_users = User.query.count()
-        total_recycled_items = RecyclingRecord.query.count()
-        total_points_earned = db.session.query(func.sum(RecyclingRecord.points_earned)).scalar() or 0
-
-        # Top recyclers
-        top_recyclers = db.session.query(
-            User.username,
-            func.sum(RecyclingRecord.points_earned).label('total_points')
-        ).join(RecyclingRecord) \
-            .group_by(User.id) \
-            .order_by(desc('total_points')) \
-            .limit(5).all()
-
-        # Most popular items
-        popular_items = db.session.query(
-            RecyclingRecord.item_name,
-            func.count(RecyclingRecord.id).label('recycle_count')
-        ).group_by(RecyclingRecord.item_name) \
-            .order_by(desc('recycle_count')) \
-            .limit(5).all()
-
-        return {
-            'total_users': total_users or 0,
-            'total_recycled_items': total_recycled_items or 0,
-            'total_points_earned': total_points_earned or 0,
-            'top_recyclers': [{'username': u[0], 'points': u[1]} for u in top_recyclers] if top_recyclers else [],
-            'popular_items': [{'item': i[0], 'count': i[1]} for i in popular_items] if popular_items else []
-        }
+    @reads_from_replica
+    def get_community_stats(region_id=None):
+        """Get community-wide statistics, or one region's when ``region_id`` is given"""
+        if region_id is None:
+            # The warm leaderboard instead of a query on users.points
+            top_recyclers = [(entry['username'], entry['points'])
+                             for entry in with_usernames(leaderboards.get('all').top(5)) if entry['points']]
+        else:
+            top_recyclers = db.session.execute(top_recyclers_query(region_id)).all()
 
-    @staticmethod
-    def get_category_distribution(user_id=None):
-        """Get recycling distribution by category"""
-        query = db.session.query(
-            RecyclingItem.category,
-            func.count(RecyclingRecord.id).label('count')
-        ).join(RecyclingRecord, RecyclingRecord.item_name == RecyclingItem.name)
+        return community_stats_result(
+            db.session.scalar(total_users_query(region_id)),
+            db.session.execute(recycled_totals_query(region_id)).one(),
+            top_recyclers,
+            db.session.execute(popular_items_query(region_id)).all()
+        )
 
+    @staticmethod
+    @reads_from_replica
+    def get_category_distribution(user_id=None, region_id=None):
+        """Get recycling distribution by category for a user, a region or everyone"""
         if user_id:
-            query = query.filter(RecyclingRecord.user_id == user_id)
-
-        distribution = query.group_by(RecyclingItem.category).all()
+            distribution = db.session.query(UserCategoryCount.category, UserCategoryCount.count) \
+                .filter(UserCategoryCount.user_id == user_id).all()
+        elif region_id is not None:
+            distribution = db.session.query(RegionCategoryCount.category, RegionCategoryCount.count) \
+                .filter(RegionCategoryCount.region_id == region_id).all()
+        else:
+            distribution = db.session.query(CategoryCount.category, CategoryCount.count).all()
 
-        return {cat: count for cat, count in distribution} if distribution else {}
\ No newline at end of file
+        return {cat: count for cat, count in distribution if count} if distribution else {}
@@ -0,0 +1,253 @@
+"""ASGI serving mode with async handlers for the read-only JSON API.
+
+    uvicorn asgi:app --workers 4
+
+``/api/search``, ``/api/user/stats``, ``/api/community/stats`` and
+``/api/recycling/records`` run as coroutines on an async SQLAlchemy engine
+(aiosqlite for SQLite, asyncpg for PostgreSQL), so a slow analytics query
+parks only its own request instead of a whole sync worker. They build their
+statements with the same helpers as RecyclingAnalytics, and the stats
+routes go through the same response cache (ETag/304) as the sync ones.
+Reads use the primary, not the replica bind: cached statistics must not
+be stored from lagging data, and a user's records must include their own
+latest writes. ``/api/community/stream`` serves the
+live stats events from a coroutine per client, so one process can hold
+thousands of open dashboards. Every other route, including all writes, is
+forwarded to the Flask app, which runs in a thread pool.
+
+Needs the packages in requirements-asgi.txt (starlette, uvicorn, greenlet
+for SQLAlchemy's asyncio layer and the aiosqlite driver), which the sync
+deployment does not install.
+"""
+import asyncio
+import contextlib
+import functools
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import live_stats
+import rate_limit
+import response_cache
+from analytics import (community_stats_result, most_recycled_query, popular_items_query, recycled_totals_query,
+                       top_recyclers_query, total_users_query, user_stats_result, weekly_items_query)
+from catalog_index import DEFAULT_LIMIT, catalog_index
+from database_init import DEFAULT_USER_ID
+from ecocycle_app import app as flask_app, serialize_record
+from models import db, RecyclingRecord, Region, UserTotals
+from pagination import MAX_PER_PAGE, keyset_filter, split_page
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(url):
+    """The async driver equivalent of a sync database URL"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver configured for {backend} databases')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def int_param(request, name, default):
+    """Integer query parameter, ``default`` when missing or malformed"""
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+async def run_inline(func, *args):
+    return func(*args)
+
+
+def cached(private=False):
+    """Async counterpart of response_cache.cached_response, sharing its backend and ETags
+
+    Private responses belong to the default user, as in the async handlers.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            backend = response_cache.get_backend(request.app.state.wsgi_app)
+            # The SQLite backend reads a file and may wait on its lock
+            call = run_in_threadpool if isinstance(backend, response_cache.SQLiteBackend) else run_inline
+            version, updated_at = await call(backend.version)
+            key = response_cache.cache_key(handler.__name__, DEFAULT_USER_ID if private else '', request.url.query)
+            etag = response_cache.make_etag(key, version)
+            headers = response_cache.cache_headers(etag, updated_at, private)
+
+            if response_cache.is_not_modified(request.headers, etag, updated_at):
+                return Response(status_code=304, headers=headers)
+
+            entry = await call(backend.get, key)
+            if entry is not None and entry.version == version:
+                return Response(entry.body, media_type=entry.mimetype, headers=headers)
+
+            response = await handler(request)
+            if response.status_code != 200:
+                return response
+            await call(backend.set, key, response_cache.CachedResponse(version, response.body, response.media_type))
+            response.headers.update(headers)
+            return response
+        return wrapper
+    return decorator
+
+
+def refresh_catalog_index(wsgi_app):
+    with wsgi_app.app_context():
+        catalog_index.refresh()
+
+
+async def api_search(request):
+    # Same limit and in-memory index as the sync route.
+    # The SQLite backend can wait on a file lock, so the check runs off the event loop
+    decision = await run_in_threadpool(rate_limit.check, request.app.state.wsgi_app, 'search',
+                                       request.client.host if request.client else None)
+    if decision is not None and not decision.allowed:
+        return JSONResponse(rate_limit.limited_body(decision), status_code=429,
+                            headers=rate_limit.limit_headers(decision))
+
+    if catalog_index.needs_rebuild():
+        # A rebuild queries the database; concurrent requests share the sync path's single reload
+        await run_in_threadpool(refresh_catalog_index, request.app.state.wsgi_app)
+
+    limit = int_param(request, 'limit', DEFAULT_LIMIT)
+    return JSONResponse(catalog_index.search(request.query_params.get('q', ''), limit=limit),
+                        headers=rate_limit.limit_headers(decision) if decision is not None else None)
+
+
+@cached(private=True)
+async def api_user_stats(request):
+    """Async counterpart of RecyclingAnalytics.get_user_stats"""
+    user_id = DEFAULT_USER_ID
+    async with request.app.state.sessions() as session:
+        return JSONResponse(user_stats_result(
+            await session.get(UserTotals, user_id),
+            (await session.execute(most_recycled_query(user_id))).first(),
+            await session.scalar(weekly_items_query(user_id))
+        ))
+
+
+@cached()
+async def api_community_stats(request):
+    """Async counterpart of RecyclingAnalytics.get_community_stats
+
+    Top recyclers come straight from the ``users.points`` index rather than
+    the per-process leaderboard, which only the sync app keeps warm.
+    """
+    async with request.app.state.sessions() as session:
+        region_id = None
+        if request.query_params.get('region'):
+            region_id = await session.scalar(select(Region.id).where(Region.code == request.query_params['region']))
+            if region_id is None:
+                return JSONResponse({'error': 'Unknown region'}, status_code=404)
+
+        return JSONResponse(community_stats_result(
+            await session.scalar(total_users_query(region_id)),
+            (await session.execute(recycled_totals_query(region_id))).one(),
+            (await session.execute(top_recyclers_query(region_id))).all(),
+            (await session.execute(popular_items_query(region_id))).all()
+        ))
+
+
+async def api_recycling_records(request):
+    """Async counterpart of the records endpoint, page and cursor modes alike"""
+    per_page = max(1, min(int_param(request, 'per_page', 10), MAX_PER_PAGE))
+    user_filter = RecyclingRecord.user_id == DEFAULT_USER_ID
+    query = select(RecyclingRecord.id, RecyclingRecord.item_name, RecyclingRecord.points_earned,
+                   RecyclingRecord.recycled_at).where(user_filter)
+    count_query = select(func.count(RecyclingRecord.id)).where(user_filter)
+
+    async with request.app.state.sessions() as session:
+        if 'cursor' in request.query_params:
+            try:
+                query = keyset_filter(query, RecyclingRecord, request.query_params['cursor'], per_page)
+            except ValueError:
+                return JSONResponse({'error': 'Invalid cursor'}, status_code=400)
+
+            rows, next_cursor = split_page((await session.execute(query)).all(), per_page)
+            result = {
+                'records': [serialize_record(row) for row in rows],
+                'next_cursor': next_cursor
+            }
+            if int_param(request, 'include_total', 0):
+                result['total'] = await session.scalar(count_query)
+            return JSONResponse(result)
+
+        page = max(1, int_param(request, 'page', 1))
+        total = await session.scalar(count_query)
+        rows = (await session.execute(
+            query.order_by(RecyclingRecord.recycled_at.desc()).offset((page - 1) * per_page).limit(per_page)
+        )).all()
+
+    return JSONResponse({
+        'records': [serialize_record(row) for row in rows],
+        'total': total,
+        'pages': -(-total // per_page),
+        'current_page': page
+    })
+
+
+async def api_community_stream(request):
+    """Async counterpart of the Flask live stats stream"""
+    wsgi_app = request.app.state.wsgi_app
+    hub = live_stats.get_hub(wsgi_app)
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    # Awards are fanned out from worker threads, so wake the loop thread-safely
+    subscriber = await run_in_threadpool(live_stats.subscribe, wsgi_app,
+                                         lambda: loop.call_soon_threadsafe(wakeup.set))
+    keepalive = wsgi_app.config.get('LIVE_STATS_KEEPALIVE', live_stats.DEFAULT_KEEPALIVE)
+
+    async def events():
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                wakeup.clear()
+                yield ''.join(subscriber.drain())
+        finally:
+            hub.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers=live_stats.STREAM_HEADERS)
+
+
+def create_asgi_app(wsgi_app=flask_app):
+    """Wrap ``wsgi_app`` with the async API routes in front of it"""
+    with wsgi_app.app_context():
+        url = db.engine.url
+    engine = create_async_engine(async_database_url(url),
+                                 **wsgi_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+
+    @contextlib.asynccontextmanager
+    async def lifespan(asgi_app):
+        yield
+        await engine.dispose()
+
+    asgi_app = Starlette(routes=[
+        Route('/api/search', api_search),
+        Route('/api/user/stats', api_user_stats),
+        Route('/api/community/stats', api_community_stats),
+        Route('/api/recycling/records', api_recycling_records),
+        Route('/api/community/stream', api_community_stream),
+        Mount('/', WSGIMiddleware(wsgi_app)),
+    ], lifespan=lifespan)
+    asgi_app.state.sessions = async_sessionmaker(engine, expire_on_commit=False)
+    asgi_app.state.wsgi_app = wsgi_app
+    return asgi_app
+
+
+app = create_asgi_app()
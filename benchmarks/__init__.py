@@ -0,0 +1,4 @@
+"""Benchmarks and load generators for EcoCycle.
+
+Run the individual modules with ``python -m benchmarks.<name> --help``.
+"""
@@ -0,0 +1,132 @@
+"""Sync (gunicorn) versus async (uvicorn + asgi.py) serving at high concurrency.
+
+Spawns each server in turn on the same database and opens ``--connections``
+concurrent connections from a single asyncio client, first per read API
+scenario and then as a mix where search requests compete with analytics.
+
+    DATABASE_URL=sqlite:////tmp/ecocycle_bench.db python -m benchmarks.asgi_bench \\
+        --connections 1000 --workers 4 --output asgi.json
+
+Run ``python -m benchmarks.seed`` against the same DATABASE_URL first. The
+async mode needs ``pip install -r requirements-asgi.txt``. Set
+``ECOCYCLE_RATE_LIMIT=0``: every connection comes from one address.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks import report, scenarios
+from benchmarks.http_bench import send as send_sync
+from benchmarks.stats import summarize
+
+READ_SCENARIOS = ('search', 'user_stats', 'community_stats', 'records')
+MIXED = ('search', 'community_stats')
+
+SERVERS = {
+    'sync': lambda bind, workers: ['gunicorn', '-w', str(workers), '-b', bind, 'ecocycle_app:app'],
+    'async': lambda bind, workers: ['uvicorn', '--workers', str(workers), '--log-level', 'warning',
+                                    '--host', bind.split(':')[0], '--port', bind.split(':')[1], 'asgi:app'],
+}
+
+
+async def send(host, port, path, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, mix, connections, requests, timeout, seed):
+    """Drive ``connections`` concurrent clients, client ``i`` using ``mix[i % len(mix)]``"""
+    outcomes = {scenario.name: ([], [0]) for scenario in mix}
+
+    async def client(client_id):
+        scenario = mix[client_id % len(mix)]
+        latencies, errors = outcomes[scenario.name]
+        rng = scenarios.make_rng(seed + client_id)
+        for _ in range(max(1, requests // connections)):
+            _, path, _ = scenario.make_request(rng)
+            started = time.perf_counter()
+            try:
+                status = await send(host, port, path, timeout)
+            except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                status = 599
+            latencies.append(time.perf_counter() - started)
+            errors[0] += status >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(client_id) for client_id in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name, (latencies, errors) in outcomes.items():
+        results[name] = summarize(latencies, elapsed)
+        results[name]['errors'] = errors[0]
+    return results
+
+
+def spawn(mode, bind, workers):
+    process = subprocess.Popen([sys.executable, '-m'] + SERVERS[mode](bind, workers), env=dict(os.environ))
+    host, port = bind.split(':')
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            send_sync(host, int(port), 'GET', '/api/search?q=pl', None, 1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{mode} server did not start within 30 seconds')
+
+
+def raise_fd_limit():
+    # Every connection is a socket on both ends of the benchmark
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bind', default='127.0.0.1:8001')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=5000, help='Requests per scenario')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--mode', action='append', choices=sorted(SERVERS),
+                        help='Server to benchmark (repeatable, default: both)')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    raise_fd_limit()
+    host, port = args.bind.split(':')
+    results = {}
+    for mode in args.mode or sorted(SERVERS, reverse=True):
+        process = spawn(mode, args.bind, args.workers)
+        try:
+            for scenario in scenarios.select(READ_SCENARIOS):
+                outcome = asyncio.run(run_load(host, int(port), [scenario], args.connections,
+                                               args.requests, args.timeout, seed=42))
+                results[f'{mode}:{scenario.name}'] = outcome[scenario.name]
+            mixed = asyncio.run(run_load(host, int(port), scenarios.select(MIXED), args.connections,
+                                         args.requests, args.timeout, seed=42))
+            for name, summary in mixed.items():
+                results[f'{mode}:mixed:{name}'] = summary
+        finally:
+            process.terminate()
+            process.wait()
+
+    report.write(report.build('asgi', vars(args), results), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Import time of a large municipal catalog through catalog_loader.
+
+Generates a JSON Lines catalog, loads it into a scratch SQLite database,
+then reloads a copy with a share of the items changed to time the diff path.
+
+    python -m benchmarks.catalog_bench --items 100000 --changed 0.1
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+CATEGORIES = ('Plastic', 'Paper', 'Glass', 'Metal', 'E-Waste', 'Hazardous', 'Organic')
+
+
+def write_catalog(path, items, rng, changed=0.0):
+    with open(path, 'w', encoding='utf-8') as handle:
+        for number in range(items):
+            points = number % 20
+            if rng.random() < changed:
+                points += 1
+            handle.write(json.dumps({
+                'name': f'item {number:06d}',
+                'instruction': f'Sort item {number} into the {CATEGORIES[number % 7]} stream.',
+                'points': points,
+                'category': CATEGORIES[number % 7],
+                'tips': ['Rinse first', 'Check local rules'],
+                'aliases': [f'alias {number:06d}'],
+            }) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--changed', type=float, default=0.1, help='Share of items changed on reload')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'catalog_bench.db')}"
+    from catalog_loader import load_catalog
+    from ecocycle_app import app
+    from models import db
+
+    rng = random.Random(1)
+    first, second = os.path.join(directory, 'first.jsonl'), os.path.join(directory, 'second.jsonl')
+    write_catalog(first, args.items, rng)
+    write_catalog(second, args.items, rng, args.changed)
+
+    with app.app_context():
+        db.create_all()
+        for label, path in (('initial load', first), ('reload with changes', second)):
+            started = time.perf_counter()
+            stats = load_catalog(path)
+            print(f'{label}: {time.perf_counter() - started:.2f} s {stats}')
+
+
+if __name__ == '__main__':
+    main()
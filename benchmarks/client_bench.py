@@ -0,0 +1,68 @@
+"""In-process benchmark of the EcoCycle routes through the Flask test client.
+
+Seeds a fresh database (set DATABASE_URL to choose where), then issues
+``--requests`` sequential requests per scenario and reports latency
+percentiles, throughput and SQL statements per request as JSON.
+
+    DATABASE_URL=sqlite:////tmp/ecocycle_bench.db python -m benchmarks.client_bench \\
+        --users 1000 --records 100000 --output before.json
+"""
+import argparse
+import time
+
+from benchmarks import report, scenarios
+from benchmarks.seed import seed
+from benchmarks.stats import QueryCounter, summarize
+
+
+def run_scenario(client, engine, scenario, requests, rng):
+    latencies = []
+    errors = 0
+    with QueryCounter(engine) as counter:
+        started = time.perf_counter()
+        for _ in range(requests):
+            method, path, data = scenario.make_request(rng)
+            request_started = time.perf_counter()
+            response = client.open(path, method=method, data=data)
+            latencies.append(time.perf_counter() - request_started)
+            if response.status_code >= 400:
+                errors += 1
+        elapsed = time.perf_counter() - started
+
+    result = summarize(latencies, elapsed, counter.count)
+    result['errors'] = errors
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark EcoCycle routes in-process.')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--scenario', action='append', choices=sorted(scenarios.SCENARIOS),
+                        help='Scenario to run (repeatable, default: all)')
+    parser.add_argument('--no-seed', action='store_true', help='Reuse the data already in the database')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    from ecocycle_app import app
+    from models import db
+
+    with app.app_context():
+        if not args.no_seed:
+            seed(args.users, args.records)
+        engine = db.engine
+
+    client = app.test_client()
+    rng = scenarios.make_rng(42)
+    results = {}
+    for scenario in scenarios.select(args.scenario):
+        run_scenario(client, engine, scenario, args.warmup, rng)
+        results[scenario.name] = run_scenario(client, engine, scenario, args.requests, rng)
+
+    report.write(report.build('flask_test_client', vars(args), results), args.output)
+
+
+if __name__ == '__main__':
+    main()
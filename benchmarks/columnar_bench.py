@@ -0,0 +1,90 @@
+"""Query time of the columnar analytics over a large synthetic snapshot.
+
+Writes ``--rows`` random records for ``--users`` users straight through
+columnar.SnapshotWriter (no database involved), then times each report
+query against the memory-mapped snapshot.
+
+    python -m benchmarks.columnar_bench --rows 100000000 --users 1000000
+"""
+import argparse
+import json
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.seed import ITEM_WEIGHTS
+from columnar import ColumnarSnapshot, SnapshotWriter
+from database_init import RECYCLING_ITEMS
+
+WRITE_CHUNK = 1 << 22
+REGIONS = 8
+DAYS = 365
+
+
+def write_snapshot(root, rows, users, seed=1234):
+    rng = np.random.default_rng(seed)
+    items = [{'id': code + 1, 'name': item['name'], 'category': item['category']}
+             for code, item in enumerate(RECYCLING_ITEMS)]
+    weights = np.array([ITEM_WEIGHTS.get(item['name'], 1) for item in items], float)
+    item_points = np.array([item['points'] for item in RECYCLING_ITEMS], np.int32)
+    start = np.datetime64('2026-01-01T00:00:00', 's')
+
+    writer = SnapshotWriter(root, rows)
+    for offset in range(0, rows, WRITE_CHUNK):
+        count = min(WRITE_CHUNK, rows - offset)
+        codes = rng.choice(len(items), count, p=weights / weights.sum()).astype(np.int32)
+        user_ids = rng.integers(1, users + 1, count, dtype=np.int32)
+        writer.append(user_id=user_ids,
+                      item_code=codes,
+                      points=item_points[codes],
+                      region_id=user_ids % REGIONS + 1,
+                      recycled_at=start + rng.integers(0, DAYS * 86400, count))
+
+    user_ids = range(1, users + 1)
+    created_at = start + np.arange(users) * (DAYS * 86400 // users)
+    return writer.publish(items, list(zip(user_ids, (f'user{user_id}' for user_id in user_ids),
+                                          (user_id % REGIONS + 1 for user_id in user_ids),
+                                          created_at.astype(datetime))),
+                          {f'region{number}': number for number in range(1, REGIONS + 1)})
+
+
+def timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return {'best_s': round(min(samples), 3), 'mean_s': round(sum(samples) / len(samples), 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000000)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    snapshot = ColumnarSnapshot(write_snapshot(tempfile.mkdtemp(), args.rows, args.users))
+    results = {'write_s': round(time.perf_counter() - started, 3)}
+
+    month = {'start': datetime(2026, 3, 1), 'end': datetime(2026, 4, 1)}
+    cohort = np.arange(1, args.users + 1, 10, dtype=np.int32)
+    queries = {
+        'community_stats': snapshot.get_community_stats,
+        'community_stats_region': lambda: snapshot.get_community_stats(region_id=3),
+        'community_stats_month': lambda: snapshot.get_community_stats(**month),
+        'category_distribution': snapshot.get_category_distribution,
+        'category_distribution_cohort': lambda: snapshot.get_category_distribution(user_ids=cohort),
+        'monthly_summary': snapshot.get_monthly_summary,
+        'cohort_category_mix': snapshot.get_cohort_category_mix,
+    }
+    for name, query in queries.items():
+        results[name] = timed(query, args.repeat)
+    print(json.dumps({'rows': args.rows, 'users': args.users, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Compare two benchmark JSON reports scenario by scenario.
+
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_per_request')
+
+
+def load(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def compare(before, after):
+    """Yield ``(scenario, metric, before, after, change_percent)`` rows"""
+    for scenario, old in before['results'].items():
+        new = after['results'].get(scenario)
+        if new is None:
+            continue
+        for metric in METRICS:
+            if metric in old and metric in new:
+                change = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0.0
+                yield scenario, metric, old[metric], new[metric], change
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark reports.')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args(argv)
+
+    before, after = load(args.before), load(args.after)
+    print(f"{'scenario':<18}{'metric':<22}{before.get('commit') or 'before':>12}"
+          f"{after.get('commit') or 'after':>12}{'change':>10}")
+    for scenario, metric, old, new, change in compare(before, after):
+        print(f'{scenario:<18}{metric:<22}{old:>12}{new:>12}{change:>+9.1f}%')
+
+
+if __name__ == '__main__':
+    main()
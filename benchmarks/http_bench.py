@@ -0,0 +1,110 @@
+"""Concurrent HTTP load against a running (or spawned) gunicorn server.
+
+    python -m benchmarks.http_bench --url http://127.0.0.1:8000 --concurrency 32
+    DATABASE_URL=sqlite:////tmp/ecocycle_bench.db python -m benchmarks.http_bench --spawn --workers 4
+
+Run ``python -m benchmarks.seed`` against the same DATABASE_URL first to
+benchmark with realistic data volumes.
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks import report, scenarios
+from benchmarks.stats import summarize
+
+
+def send(host, port, method, path, data, timeout):
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        body = urlencode(data) if data else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if data else {}
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def run_scenario(host, port, scenario, requests, concurrency, timeout, seed):
+    def worker(worker_id):
+        rng = scenarios.make_rng(seed + worker_id)
+        latencies, errors = [], 0
+        for _ in range(requests // concurrency):
+            method, path, data = scenario.make_request(rng)
+            started = time.perf_counter()
+            try:
+                status = send(host, port, method, path, data, timeout)
+            except OSError:
+                status = 599
+            latencies.append(time.perf_counter() - started)
+            errors += status >= 400
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for worker_latencies, _ in outcomes for latency in worker_latencies]
+    result = summarize(latencies, elapsed)
+    result['errors'] = sum(errors for _, errors in outcomes)
+    return result
+
+
+def spawn_gunicorn(bind, workers):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', bind, 'ecocycle_app:app'],
+        env=dict(os.environ)
+    )
+    host, port = bind.split(':')
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            send(host, int(port), 'GET', '/api/search?q=pl', None, 1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start within 30 seconds')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Concurrent HTTP benchmark of EcoCycle.')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--spawn', action='store_true', help='Start gunicorn on --url first')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=1000, help='Requests per scenario')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--scenario', action='append', choices=sorted(scenarios.SCENARIOS),
+                        help='Scenario to run (repeatable, default: all)')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    target = urlsplit(args.url)
+    host, port = target.hostname, target.port or 80
+    process = spawn_gunicorn(f'{host}:{port}', args.workers) if args.spawn else None
+
+    try:
+        results = {
+            scenario.name: run_scenario(host, port, scenario, args.requests, args.concurrency,
+                                        args.timeout, seed=42)
+            for scenario in scenarios.select(args.scenario)
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report.write(report.build('http', vars(args), results), args.output)
+
+
+if __name__ == '__main__':
+    main()
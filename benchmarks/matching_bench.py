@@ -0,0 +1,76 @@
+"""Lookup latency of the fuzzy item matcher on a large synthetic catalog.
+
+Builds an :class:`matching.ItemMatcher` over generated names and aliases,
+then times exact, plural, misspelled and unmatched lookups separately.
+
+    python -m benchmarks.matching_bench --names 25000 --aliases 1
+"""
+import argparse
+import json
+import random
+import string
+import time
+
+from benchmarks.stats import summarize
+from matching import ItemMatcher
+
+WORDS = ('plastic', 'glass', 'paper', 'metal', 'aluminum', 'steel', 'bottle', 'can', 'jar', 'bag', 'box',
+         'carton', 'lid', 'tray', 'tube', 'wrapper', 'cup', 'battery', 'cable', 'phone', 'lamp', 'film')
+
+
+def make_catalog(names, aliases, rng):
+    """``names`` unique ``(name, [alias, ...])`` pairs"""
+    catalog = {}
+    while len(catalog) < names:
+        suffix = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 8)))
+        name = f'{rng.choice(WORDS)} {suffix} {rng.choice(WORDS)}'
+        catalog[name] = [f'{suffix} {rng.choice(WORDS)} {n}' for n in range(aliases)]
+    return list(catalog.items())
+
+
+def misspell(text, rng):
+    position = rng.randrange(len(text))
+    return text[:position] + rng.choice(string.ascii_lowercase) + text[position + 1:]
+
+
+def time_lookups(matcher, queries):
+    latencies = []
+    started = time.perf_counter()
+    for query in queries:
+        began = time.perf_counter()
+        matcher.match(query)
+        latencies.append(time.perf_counter() - began)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--names', type=int, default=25000)
+    parser.add_argument('--aliases', type=int, default=1, help='Aliases per name')
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    catalog = make_catalog(args.names, args.aliases, rng)
+
+    started = time.perf_counter()
+    matcher = ItemMatcher(max_age=None)
+    matcher.rebuild(catalog)
+    build_seconds = time.perf_counter() - started
+
+    names = [rng.choice(catalog)[0] for _ in range(args.queries)]
+    results = {
+        'keys': len(matcher),
+        'build_seconds': round(build_seconds, 2),
+        'exact': time_lookups(matcher, names),
+        'plural': time_lookups(matcher, [name + 's' for name in names]),
+        'misspelled': time_lookups(matcher, [misspell(name, rng) for name in names]),
+        'unmatched': time_lookups(matcher, [misspell(misspell(misspell(name, rng), rng), rng) + 'zzz'
+                                            for name in names]),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
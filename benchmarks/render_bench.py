@@ -0,0 +1,95 @@
+"""Template render time per HTML page, with and without fragment caching.
+
+Seeds a scratch database, then requests ``/``, ``/recycle`` and ``/report``
+through the Flask test client and reads the render time from the
+``Server-Timing`` header (the whole response cache is bypassed, so every
+``/report`` renders). A second pass compiles the templates in fresh
+interpreters with an empty and with a warm bytecode cache directory.
+
+    python -m benchmarks.render_bench --requests 500
+"""
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import report
+from benchmarks.stats import summarize
+
+PAGES = {
+    'index': ('GET', '/', None),
+    'recycle': ('POST', '/recycle', {'item': 'plastic bottle'}),
+    'report': ('GET', '/report', None),
+}
+TEMPLATES = ('ecocycle_index.html', 'ecocycle_results.html', 'ecocycle_report.html')
+COMPILE = (
+    'import time, ecocycle_app\n'
+    'started = time.perf_counter()\n'
+    f'for name in {TEMPLATES!r}: ecocycle_app.app.jinja_env.get_template(name)\n'
+    'print(time.perf_counter() - started)'
+)
+TEMPLATE_TIMING = re.compile(r'tpl;dur=([\d.]+)')
+
+
+def render_times(client, backend, method, path, data, requests):
+    samples = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        backend.clear()
+        response = client.open(path, method=method, data=data)
+        samples.append(float(TEMPLATE_TIMING.search(response.headers['Server-Timing']).group(1)) / 1000)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def compile_time(env, repeat, clear=False):
+    """Seconds to load every page template in a fresh interpreter"""
+    samples = []
+    for _ in range(repeat):
+        if clear:
+            shutil.rmtree(env['ECOCYCLE_TEMPLATE_BYTECODE_DIR'], ignore_errors=True)
+        output = subprocess.run([sys.executable, '-c', COMPILE], env=env, check=True,
+                                capture_output=True, text=True).stdout
+        samples.append(float(output))
+    return summarize(samples, sum(samples))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500, help='Renders per page and mode')
+    parser.add_argument('--repeat', type=int, default=10, help='Cold compiles per bytecode mode')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'render_bench.db')}"
+    os.environ['ECOCYCLE_TEMPLATE_BYTECODE_DIR'] = os.path.join(directory, 'bytecode')
+    import response_cache
+    from benchmarks.seed import seed
+    from ecocycle_app import app, initialize_database
+
+    with app.app_context():
+        initialize_database()
+        seed(200, 20000)
+
+    client = app.test_client()
+    backend = response_cache.get_backend(app)
+    results = {}
+    for enabled in (False, True):
+        app.config['FRAGMENT_CACHE_ENABLED'] = enabled
+        mode = 'fragments' if enabled else 'no_fragments'
+        for page, (method, path, data) in PAGES.items():
+            results[f'{page}:{mode}'] = render_times(client, backend, method, path, data, args.requests)
+
+    cold_env = dict(os.environ, ECOCYCLE_TEMPLATE_BYTECODE_DIR=os.path.join(directory, 'cold'))
+    results['compile:empty_bytecode_cache'] = compile_time(cold_env, args.repeat, clear=True)
+    results['compile:warm_bytecode_cache'] = compile_time(dict(os.environ), args.repeat)
+
+    report.write(report.build('render', vars(args), results), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""JSON report envelope so benchmark runs can be compared across commits."""
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build(driver, config, results):
+    return {
+        'driver': driver,
+        'commit': git_revision(),
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'config': config,
+        'results': results,
+    }
+
+
+def write(report, path=None):
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if path:
+        with open(path, 'w') as handle:
+            handle.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
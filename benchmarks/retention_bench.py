@@ -0,0 +1,80 @@
+"""Cost and effect of compacting expired recycling records.
+
+Seeds a scratch SQLite database with records spread over ``--days`` days,
+compacts everything older than ``--retention-days`` one batch at a time,
+and reports per-batch latency, the database size before and after a
+VACUUM, the archive size and the rollup rebuild time before and after.
+
+    python -m benchmarks.retention_bench --records 1000000 --batch-size 5000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks import report
+from benchmarks.stats import summarize
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(path) for name in names)
+
+
+def timed(function):
+    started = time.perf_counter()
+    function()
+    return round(time.perf_counter() - started, 3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--retention-days', type=int, default=365)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, 'retention_bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ['ECOCYCLE_ARCHIVE_DIR'] = archive = os.path.join(directory, 'archive')
+    import retention
+    from benchmarks.seed import seed
+    from ecocycle_app import app, initialize_database
+    from models import db, RecordSummary, RecyclingRecord
+    from rollups import RecyclingRollups
+    from sqlalchemy import text
+
+    with app.app_context():
+        initialize_database()
+        seed(args.users, args.records, days=args.days)
+        results = {'rebuild_before_s': timed(RecyclingRollups.rebuild),
+                   'database_bytes_before': os.path.getsize(database)}
+
+        cutoff = retention.retention_cutoff(args.retention_days)
+        samples = []
+        started = time.perf_counter()
+        while True:
+            batch_started = time.perf_counter()
+            if not retention.compact_batch(cutoff, archive, args.batch_size):
+                break
+            samples.append(time.perf_counter() - batch_started)
+        results['batches'] = summarize(samples, time.perf_counter() - started)
+
+        results['records_left'] = RecyclingRecord.query.count()
+        results['summary_rows'] = RecordSummary.query.count()
+        results['archive_bytes'] = directory_size(archive)
+        results['rebuild_after_s'] = timed(RecyclingRollups.rebuild)
+        db.session.remove()
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+        results['database_bytes_after'] = os.path.getsize(database)
+
+    report.write(report.build('retention', vars(args), results), args.output)
+
+
+if __name__ == '__main__':
+    main()
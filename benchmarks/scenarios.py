@@ -0,0 +1,47 @@
+"""Request mixes exercised by the client and HTTP benchmarks."""
+import random
+
+from benchmarks.seed import weighted_items
+
+SEARCH_PREFIXES = ['pl', 'pla', 'plastic', 'bo', 'bott', 'gla', 'ca', 'bat', 'ele', 'pa', 'foo']
+
+
+class Scenario:
+    """One route to benchmark; ``make_request`` returns (method, path, form data)"""
+
+    def __init__(self, name, make_request):
+        self.name = name
+        self.make_request = make_request
+
+
+def _recycle(rng):
+    names, weights = weighted_items()
+    return 'POST', '/recycle', {'item': rng.choices(names, weights)[0]}
+
+
+def _search(rng):
+    return 'GET', '/api/search?q=' + rng.choice(SEARCH_PREFIXES), None
+
+
+SCENARIOS = {
+    scenario.name: scenario for scenario in [
+        Scenario('index', lambda rng: ('GET', '/', None)),
+        Scenario('recycle', _recycle),
+        Scenario('search', _search),
+        Scenario('report', lambda rng: ('GET', '/report', None)),
+        Scenario('user_stats', lambda rng: ('GET', '/api/user/stats', None)),
+        Scenario('community_stats', lambda rng: ('GET', '/api/community/stats', None)),
+        Scenario('records', lambda rng: ('GET', '/api/recycling/records?per_page=10', None)),
+    ]
+}
+
+
+def select(names=None):
+    """Scenarios by name, or all of them"""
+    if not names:
+        return list(SCENARIOS.values())
+    return [SCENARIOS[name] for name in names]
+
+
+def make_rng(seed):
+    return random.Random(seed)
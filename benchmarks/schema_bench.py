@@ -0,0 +1,150 @@
+"""Query plans and timings for the recycling_records hot queries.
+
+Generates a synthetic SQLite database, then runs the analytics queries the
+way the original schema had to (string joins on item_name, no secondary
+indexes) and again after the upgrade in migrations.py (integer item_id,
+covering indexes), printing ``EXPLAIN QUERY PLAN`` output and timings.
+
+    python -m benchmarks.schema_bench --rows 2000000 --users 5000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from models import RecyclingItem, RecyclingRecord
+
+BEFORE_QUERIES = {
+    'user_totals': 'SELECT SUM(points_earned), COUNT(id) FROM recycling_records WHERE user_id = :user_id',
+    'user_most_recycled': (
+        'SELECT item_name, COUNT(id) AS count FROM recycling_records WHERE user_id = :user_id '
+        'GROUP BY item_name ORDER BY count DESC LIMIT 1'
+    ),
+    'user_weekly': (
+        'SELECT COUNT(id) FROM recycling_records WHERE user_id = :user_id AND recycled_at >= :since'
+    ),
+    'user_categories': (
+        'SELECT i.category, COUNT(r.id) FROM recycling_items i '
+        'JOIN recycling_records r ON r.item_name = i.name WHERE r.user_id = :user_id GROUP BY i.category'
+    ),
+    'popular_items': (
+        'SELECT item_name, COUNT(id) AS count FROM recycling_records '
+        'GROUP BY item_name ORDER BY count DESC LIMIT 5'
+    ),
+}
+
+AFTER_QUERIES = dict(
+    BEFORE_QUERIES,
+    user_most_recycled=(
+        'SELECT item_id, COUNT(id) AS count FROM recycling_records WHERE user_id = :user_id '
+        'GROUP BY item_id ORDER BY count DESC LIMIT 1'
+    ),
+    user_categories=(
+        'SELECT i.category, COUNT(r.id) FROM recycling_records r '
+        'JOIN recycling_items i ON i.id = r.item_id WHERE r.user_id = :user_id GROUP BY i.category'
+    ),
+    popular_items=(
+        'SELECT item_id, COUNT(id) AS count FROM recycling_records '
+        'GROUP BY item_id ORDER BY count DESC LIMIT 5'
+    ),
+)
+
+
+def _ddl(element):
+    return str(element.compile(dialect=sqlite.dialect()))
+
+
+def create_dataset(path, rows, users, items, seed=42):
+    """Create the schema without secondary indexes and fill it with records"""
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=OFF')
+    connection.execute('PRAGMA synchronous=OFF')
+    connection.execute('CREATE TABLE users (id INTEGER PRIMARY KEY)')
+    connection.execute(_ddl(CreateTable(RecyclingItem.__table__)))
+    connection.execute(_ddl(CreateTable(RecyclingRecord.__table__, include_foreign_key_constraints=[])))
+
+    connection.executemany(
+        'INSERT INTO recycling_items (id, name, instruction, points, category) VALUES (?, ?, ?, ?, ?)',
+        [(i, f'item {i}', '', 1 + i % 15, f'category {i % 7}') for i in range(1, items + 1)]
+    )
+
+    rng = random.Random(seed)
+    start = datetime.utcnow() - timedelta(days=365)
+    weights = [1.0 / rank for rank in range(1, items + 1)]
+    batch = []
+    for record_id in range(1, rows + 1):
+        item_id = rng.choices(range(1, items + 1), weights)[0]
+        batch.append((record_id, rng.randint(1, users), item_id, f'item {item_id}', 1 + item_id % 15,
+                      (start + timedelta(seconds=rng.randint(0, 365 * 86400))).isoformat(' ')))
+        if len(batch) >= 50000:
+            _insert_records(connection, batch)
+            batch = []
+    _insert_records(connection, batch)
+    connection.commit()
+    return connection
+
+
+def _insert_records(connection, batch):
+    connection.executemany(
+        'INSERT INTO recycling_records (id, user_id, item_id, item_name, points_earned, recycled_at) '
+        'VALUES (?, ?, ?, ?, ?, ?)', batch
+    )
+
+
+def add_indexes(connection):
+    """Apply the indexes that migrations.py adds to existing databases"""
+    for index in RecyclingRecord.__table__.indexes:
+        connection.execute(_ddl(CreateIndex(index)))
+    connection.execute('ANALYZE')
+    connection.commit()
+
+
+def run_queries(connection, queries, params, repeat):
+    results = {}
+    for name, sql in queries.items():
+        plan = [row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        started = time.perf_counter()
+        for _ in range(repeat):
+            connection.execute(sql, params).fetchall()
+        elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+        results[name] = (elapsed_ms, plan)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--db', help='Keep the generated database at this path')
+    args = parser.parse_args(argv)
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'schema_bench.db')
+    print(f'Generating {args.rows} records for {args.users} users in {path} ...')
+    connection = create_dataset(path, args.rows, args.users, args.items)
+
+    params = {'user_id': 1, 'since': (datetime.utcnow() - timedelta(days=7)).isoformat(' ')}
+    before = run_queries(connection, BEFORE_QUERIES, params, args.repeat)
+    add_indexes(connection)
+    after = run_queries(connection, AFTER_QUERIES, params, args.repeat)
+
+    for name in BEFORE_QUERIES:
+        (before_ms, before_plan), (after_ms, after_plan) = before[name], after[name]
+        print(f'\n{name}: {before_ms:.2f} ms -> {after_ms:.2f} ms')
+        print('  before: ' + ' | '.join(before_plan))
+        print('  after:  ' + ' | '.join(after_plan))
+
+    connection.close()
+    if not args.db:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Synthetic users and recycling records for load testing.
+
+Items come from the default catalog in database_init.py and are drawn with
+ITEM_WEIGHTS, a rough household mix where bottles and paper dominate and
+e-waste is rare.
+
+    DATABASE_URL=sqlite:////tmp/ecocycle_bench.db python -m benchmarks.seed --users 1000 --records 100000
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert
+
+from database_init import RECYCLING_ITEMS
+
+ITEM_WEIGHTS = {
+    'plastic bottle': 30,
+    'paper': 20,
+    'cardboard': 15,
+    'aluminum can': 12,
+    'glass bottle': 8,
+    'plastic bag': 6,
+    'food waste': 5,
+    'battery': 2,
+    'electronics': 2,
+}
+
+CHUNK_SIZE = 10000
+
+
+def weighted_items():
+    """Catalog item names and their draw weights"""
+    names = [item['name'] for item in RECYCLING_ITEMS]
+    return names, [ITEM_WEIGHTS.get(name, 1) for name in names]
+
+
+def seed(users, records, days=90, seed=1234):
+    """Insert ``users`` users and ``records`` records, then rebuild rollups
+
+    Must run inside an application context. Returns the new user ids.
+    """
+    from models import db, User, RecyclingItem, RecyclingRecord
+    from rollups import RecyclingRollups
+
+    rng = random.Random(seed)
+    catalog = {item.name: item for item in RecyclingItem.query.all()}
+    names, weights = weighted_items()
+
+    first_id = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+    user_ids = list(range(first_id, first_id + users))
+    db.session.execute(insert(User), [
+        {'id': user_id, 'username': f'bench_user_{user_id}'} for user_id in user_ids
+    ])
+
+    start = datetime.utcnow() - timedelta(days=days)
+    points = dict.fromkeys(user_ids, 0)
+    batch = []
+    for _ in range(records):
+        item = catalog[rng.choices(names, weights)[0]]
+        user_id = rng.choice(user_ids)
+        points[user_id] += item.points
+        batch.append({
+            'user_id': user_id,
+            'item_id': item.id,
+            'item_name': item.name,
+            'points_earned': item.points,
+            'recycled_at': start + timedelta(seconds=rng.randint(0, days * 86400)),
+        })
+        if len(batch) >= CHUNK_SIZE:
+            db.session.execute(insert(RecyclingRecord), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(RecyclingRecord), batch)
+
+    # No item is worth 50 points, so every threshold crossed is one level
+    for user_id, total in points.items():
+        level = total // 50 + 1
+        db.session.query(User).filter_by(id=user_id).update(
+            {'points': total, 'level': level, 'next_reward': level * 50}
+        )
+    db.session.commit()
+
+    RecyclingRollups.rebuild()
+    return user_ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Seed synthetic EcoCycle data.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args(argv)
+
+    from ecocycle_app import app
+
+    with app.app_context():
+        user_ids = seed(args.users, args.records, args.days, args.seed)
+    print(f'Seeded {len(user_ids)} users and {args.records} records.')
+
+
+if __name__ == '__main__':
+    main()
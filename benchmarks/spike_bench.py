@@ -0,0 +1,119 @@
+"""Search latency during a traffic spike, with and without coalescing and limits.
+
+Seeds a large catalog into a scratch SQLite database, then fires
+``--threads`` concurrent clients at ``/api/search`` through the Flask test
+client while the catalog index is invalidated every ``--invalidate-ms``,
+so each burst finds it stale. Every client has its own address, and the
+``--abusive-share`` of them send without pausing. Runs three modes:
+
+* ``baseline``: every stale lookup reloads the index and nothing is limited;
+* ``coalesced``: threads finding the index stale share one reload;
+* ``coalesced_limited``: coalescing plus the per-client token buckets.
+
+For each mode it reports well-behaved clients' latencies, the SQL
+statements executed and how many requests were answered with 429.
+
+    python -m benchmarks.spike_bench --items 50000 --threads 32 --requests 200
+"""
+import argparse
+import contextlib
+import os
+import random
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from benchmarks import report
+from benchmarks.stats import QueryCounter, summarize
+
+QUERIES = ('item 00', 'item 01', 'alias 02', 'item 1', 'plastic', 'glass')
+
+
+def client_loop(client, requests, address, pause, samples, limited):
+    rng = random.Random(address)
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get(f'/api/search?q={rng.choice(QUERIES)}', environ_base={'REMOTE_ADDR': address})
+        if response.status_code == 429:
+            limited.append(address)
+        elif pause:
+            samples.append(time.perf_counter() - started)
+        time.sleep(pause)
+
+
+def run(app, catalog_index, args):
+    samples, limited = [], []
+    stop = threading.Event()
+
+    def invalidate():
+        while not stop.wait(args.invalidate_ms / 1000):
+            catalog_index.invalidate()
+
+    invalidator = threading.Thread(target=invalidate, daemon=True)
+    threads = []
+    for number in range(args.threads):
+        abusive = number < args.threads * args.abusive_share
+        threads.append(threading.Thread(target=client_loop, args=(
+            app.test_client(), args.requests, f'10.0.{number // 250}.{number % 250}',
+            0 if abusive else args.pause_ms / 1000, samples, limited)))
+
+    started = time.perf_counter()
+    invalidator.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+    summary = summarize(samples, time.perf_counter() - started)
+    summary['rate_limited'] = len(limited)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per client thread')
+    parser.add_argument('--pause-ms', type=float, default=20, help='Think time of well-behaved clients')
+    parser.add_argument('--abusive-share', type=float, default=0.25)
+    parser.add_argument('--invalidate-ms', type=float, default=250)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'spike_bench.db')}"
+    from sqlalchemy import insert
+
+    import rate_limit
+    from catalog_index import catalog_index
+    from ecocycle_app import app, initialize_database
+    from models import db, RecyclingItem
+
+    with app.app_context():
+        initialize_database()
+        db.session.execute(insert(RecyclingItem), [
+            {'name': f'item {number:06d}', 'instruction': 'Sort it.', 'points': 1, 'category': 'Plastic',
+             'aliases': f'["alias {number:06d}"]'}
+            for number in range(args.items)
+        ])
+        db.session.commit()
+        engine = db.engine
+
+    results = {}
+    for mode, coalesce, limit in (('baseline', False, False), ('coalesced', True, False),
+                                  ('coalesced_limited', True, True)):
+        app.config['RATE_LIMIT_ENABLED'] = limit
+        rate_limit.get_backend(app).clear()
+        # Without coalescing every thread that finds the index stale reloads it
+        uncoalesced = patch.object(catalog_index._rebuild_flight, 'do',
+                                   side_effect=lambda key, function: function())
+        with QueryCounter(engine) as counter, contextlib.nullcontext() if coalesce else uncoalesced:
+            results[mode] = run(app, catalog_index, args)
+        results[mode]['sql_statements'] = counter.count
+
+    report.write(report.build('spike', vars(args), results), args.output)
+
+
+if __name__ == '__main__':
+    main()
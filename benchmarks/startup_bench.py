@@ -0,0 +1,59 @@
+"""Worker cold-start time: importing the app and serving its first request.
+
+Each sample runs in a fresh interpreter against an already initialized
+database, the way a newly forked or recycled gunicorn worker would. The
+``eager`` scenario also runs ``initialize_database()``, which is what every
+worker used to pay at import time.
+
+    python -m benchmarks.startup_bench --repeat 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.stats import summarize
+
+SCENARIOS = {
+    'import': 'import ecocycle_app',
+    'first_request': (
+        'import ecocycle_app\n'
+        'assert ecocycle_app.app.test_client().get("/").status_code == 200'
+    ),
+    'eager': (
+        'import ecocycle_app\n'
+        'ecocycle_app.initialize_database()\n'
+        'assert ecocycle_app.app.test_client().get("/").status_code == 200'
+    ),
+}
+
+
+def run_once(code, env):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(directory, 'ecocycle.db')}")
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'ecocycle_app', 'ecocycle', 'init-db'],
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+
+    results = {}
+    for name, code in SCENARIOS.items():
+        samples = [run_once(code, env) for _ in range(args.repeat)]
+        summary = summarize(samples, sum(samples))
+        results[name] = {key: summary[key] for key in ('p50_ms', 'p95_ms', 'mean_ms')}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
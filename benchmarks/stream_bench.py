@@ -0,0 +1,68 @@
+"""Fan-out cost of the live stats stream.
+
+Subscribes ``--subscribers`` clients to a live_stats hub and times how long
+one published award takes to reach all of their buffers, first in-process
+and then through the Unix socket bus from a second hub's publisher. Half
+of the clients never read, so their buffers overflow and exercise the
+snapshot fallback.
+
+    python -m benchmarks.stream_bench --subscribers 1000 5000 --awards 500
+"""
+import argparse
+import tempfile
+import time
+
+import live_stats
+from benchmarks import report
+from benchmarks.stats import summarize
+
+STATS = {'total_users': 0, 'total_recycled_items': 0, 'total_points_earned': 0, 'top_recyclers': []}
+
+
+def award(number):
+    return {'username': f'user{number % 50}', 'points': number, 'level': 'Beginner', 'awarded': 5, 'items': 1}
+
+
+def fan_out(publish, hub, subscribers, awards, timeout=10):
+    clients = [hub.subscribe(lambda: dict(STATS)) for _ in range(subscribers)]
+    readers = clients[::2]
+    samples = []
+    started = time.perf_counter()
+    for number in range(awards):
+        sent = time.perf_counter()
+        publish([award(number)])
+        # The last reader to subscribe is the last one the hub pushes to
+        while not readers[-1].events and time.perf_counter() - sent < timeout:
+            time.sleep(0)
+        samples.append(time.perf_counter() - sent)
+        for reader in readers:
+            reader.drain()
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        hub.unsubscribe(client)
+    return summarize(samples, elapsed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--awards', type=int, default=500)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for count in args.subscribers:
+        hub = live_stats.LiveStatsHub()
+        results[f'local:{count}'] = fan_out(hub.receive, hub, count, args.awards)
+
+        directory = tempfile.mkdtemp()
+        hub = live_stats.LiveStatsHub()
+        live_stats.UnixSocketBus(hub, directory)
+        publisher = live_stats.UnixSocketBus(live_stats.LiveStatsHub(), directory)
+        results[f'unix:{count}'] = fan_out(publisher.publish, hub, count, args.awards)
+
+    report.write(report.build('stream', vars(args), results), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+import json
+import threading
+import time
+from collections import namedtuple
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import db, User, RecyclingItem, Category, Region, RegionItemOverride
+
+CATALOG_TTL = 300
+USER_TTL = 5
+
+
+class ItemSnapshot(namedtuple('ItemSnapshot', 'id name instruction points category tips')):
+    """Immutable catalog entry with ``tips`` already decoded"""
+    __slots__ = ()
+
+    @classmethod
+    def from_model(cls, item):
+        return cls(item.id, item.name, item.instruction, item.points, item.category,
+                   tuple(json.loads(item.tips)) if item.tips else ())
+
+    def with_override(self, override):
+        """This item as a region sees it; NULL override fields keep the base value"""
+        return self._replace(
+            instruction=override.instruction or self.instruction,
+            points=self.points if override.points is None else override.points,
+            tips=self.tips if override.tips is None else tuple(json.loads(override.tips))
+        )
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'instruction': self.instruction,
+            'points': self.points,
+            'category': self.category,
+            'tips': list(self.tips)
+        }
+
+
+class CategorySnapshot(namedtuple('CategorySnapshot', 'id name color description')):
+    __slots__ = ()
+
+    @classmethod
+    def from_model(cls, category):
+        return cls(category.id, category.name, category.color, category.description)
+
+    def to_dict(self):
+        return {'name': self.name, 'color': self.color, 'description': self.description}
+
+
+class RegionSnapshot(namedtuple('RegionSnapshot', 'id code name')):
+    __slots__ = ()
+
+    @classmethod
+    def from_model(cls, region):
+        return cls(region.id, region.code, region.name)
+
+
+class UserSnapshot(namedtuple('UserSnapshot', 'id username points level next_reward region_id')):
+    __slots__ = ()
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(user.id, user.username, user.points, user.level, user.next_reward, user.region_id)
+
+    def to_dict(self):
+        return self._asdict()
+
+
+class TTLCache:
+    """Thread-safe process-wide cache with expiry and hit/miss counters
+
+    ``generation`` changes whenever an entry is loaded or dropped, so
+    anything derived from the cached values can be keyed by it. A load that
+    overlaps an :meth:`invalidate` is returned to its caller but not
+    stored, since it may have read the data from before the change.
+    """
+
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._invalidations = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        invalidations = self._invalidations
+        value = loader()
+        with self._lock:
+            if self._invalidations == invalidations:
+                self._entries[key] = (now + self.ttl, value)
+                self.generation += 1
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when ``key`` is None"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self._invalidations += 1
+            self.generation += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+catalog_cache = TTLCache('catalog', CATALOG_TTL)
+user_cache = TTLCache('users', USER_TTL)
+
+
+def _request_cached(key, loader):
+    """Memoize ``loader()`` for the rest of the current request"""
+    if not has_request_context():
+        return loader()
+    memo = g.setdefault('_ecocycle_cache', {})
+    if key not in memo:
+        memo[key] = loader()
+    return memo[key]
+
+
+def _load_items():
+    return {item.name: ItemSnapshot.from_model(item) for item in RecyclingItem.query.all()}
+
+
+def _load_region_items(region_id):
+    """The base catalog with one region's overrides applied"""
+    by_id = {item.id: item for item in get_items().values()}
+    for override in RegionItemOverride.query.filter_by(region_id=region_id):
+        item = by_id.get(override.item_id)
+        if item is None:
+            continue
+        if override.accepted:
+            by_id[item.id] = item.with_override(override)
+        else:
+            del by_id[item.id]
+    return {item.name: item for item in by_id.values()}
+
+
+def _load_categories():
+    return tuple(CategorySnapshot.from_model(category) for category in Category.query.order_by(Category.id))
+
+
+def _load_regions():
+    return {region.code: RegionSnapshot.from_model(region) for region in Region.query.all()}
+
+
+def get_items(region_id=None):
+    """Catalog items keyed by name, resolved for ``region_id`` when given"""
+    if region_id is None:
+        return _request_cached('items', lambda: catalog_cache.get_or_load('items', _load_items))
+    key = ('items', region_id)
+    return _request_cached(key, lambda: catalog_cache.get_or_load(key, lambda: _load_region_items(region_id)))
+
+
+def get_item(name, region_id=None):
+    return get_items(region_id).get(name)
+
+
+def get_regions():
+    """All regions keyed by code"""
+    return _request_cached('regions', lambda: catalog_cache.get_or_load('regions', _load_regions))
+
+
+def get_categories():
+    return _request_cached('categories', lambda: catalog_cache.get_or_load('categories', _load_categories))
+
+
+def get_user(user_id):
+    """A user's snapshot, or None if the user does not exist"""
+    def load():
+        user = db.session.get(User, user_id)
+        return UserSnapshot.from_model(user) if user else None
+
+    return _request_cached(('user', user_id), lambda: user_cache.get_or_load(user_id, load))
+
+
+def cache_stats():
+    return {cache.name: cache.stats() for cache in (catalog_cache, user_cache)}
+
+
+def _invalidate(target, cache, key=None):
+    # Drop the entry now and again once the transaction commits, so a
+    # concurrent reader cannot re-cache the pre-commit row in between.
+    cache.invalidate(key)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('ecocycle_invalidate', set()).add((cache.name, key))
+
+
+def invalidate_user(user):
+    """Drop a user's cached snapshot after writes that bypass the ORM"""
+    _invalidate(user, user_cache, user.id)
+
+
+@event.listens_for(RecyclingItem, 'after_insert')
+@event.listens_for(RecyclingItem, 'after_update')
+@event.listens_for(RecyclingItem, 'after_delete')
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+@event.listens_for(Region, 'after_insert')
+@event.listens_for(Region, 'after_update')
+@event.listens_for(Region, 'after_delete')
+@event.listens_for(RegionItemOverride, 'after_insert')
+@event.listens_for(RegionItemOverride, 'after_update')
+@event.listens_for(RegionItemOverride, 'after_delete')
+def _invalidate_catalog(mapper, connection, target):
+    _invalidate(target, catalog_cache)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_user(mapper, connection, target):
+    _invalidate(target, user_cache, target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    caches = {cache.name: cache for cache in (catalog_cache, user_cache)}
+    for name, key in session.info.pop('ecocycle_invalidate', ()):
+        caches[name].invalidate(key)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_rolled_back(session, previous_transaction):
+    session.info.pop('ecocycle_invalidate', None)
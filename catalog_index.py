@@ -0,0 +1,177 @@
+import heapq
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+from coalesce import SingleFlight
+from db_routing import use_primary
+from models import db, RecyclingItem
+
+GRAM_SIZE = 3
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_query(text):
+    """Lower-case a search string and collapse runs of whitespace"""
+    return _WHITESPACE.sub(' ', (text or '').strip().lower())
+
+
+class _Snapshot:
+    """Immutable lookup structures for one version of the catalog"""
+
+    def __init__(self, items):
+        # Entry ids follow (length, name) order, so walking any posting list
+        # in ascending id order already yields the shortest names first.
+        entries = sorted({normalize_query(name): category for name, category in items}.items(),
+                         key=lambda entry: (len(entry[0]), entry[0]))
+        self.names = [name for name, _ in entries]
+        self.categories = [category for _, category in entries]
+        self.exact = {name: entry_id for entry_id, name in enumerate(self.names)}
+
+        self.sorted_names = sorted((name, entry_id) for entry_id, name in enumerate(self.names))
+        self.sorted_words = sorted(
+            (word, entry_id)
+            for entry_id, name in enumerate(self.names)
+            for word in set(name.split(' ')[1:])
+        )
+
+        grams = {}
+        for entry_id, name in enumerate(self.names):
+            for gram in self._grams_of(name):
+                grams.setdefault(gram, array('I')).append(entry_id)
+        self.grams = grams
+
+    @staticmethod
+    def _grams_of(name):
+        """All distinct substrings of a name up to GRAM_SIZE characters"""
+        found = set()
+        for size in range(1, GRAM_SIZE + 1):
+            for start in range(len(name) - size + 1):
+                found.add(name[start:start + size])
+        return found
+
+    @staticmethod
+    def _prefix_ids(pairs, prefix, limit):
+        ids = set()
+        for position in range(bisect_left(pairs, (prefix,)), len(pairs)):
+            word, entry_id = pairs[position]
+            if not word.startswith(prefix):
+                break
+            ids.add(entry_id)
+        return heapq.nsmallest(limit, ids)
+
+    def _substring_ids(self, query):
+        if len(query) <= GRAM_SIZE:
+            yield from self.grams.get(query, ())
+            return
+
+        postings = []
+        for start in range(len(query) - GRAM_SIZE + 1):
+            posting = self.grams.get(query[start:start + GRAM_SIZE])
+            if posting is None:
+                return
+            postings.append(posting)
+
+        for entry_id in min(postings, key=len):
+            if query in self.names[entry_id]:
+                yield entry_id
+
+    def search(self, query, limit):
+        """Rank matches as exact, name prefix, word prefix, then substring"""
+        ranked = []
+        seen = set()
+
+        def take(entry_ids):
+            for entry_id in entry_ids:
+                if len(ranked) >= limit:
+                    return
+                if entry_id not in seen:
+                    seen.add(entry_id)
+                    ranked.append(entry_id)
+
+        if query in self.exact:
+            take([self.exact[query]])
+        take(self._prefix_ids(self.sorted_names, query, limit))
+        take(self._prefix_ids(self.sorted_words, query, limit))
+        take(self._substring_ids(query))
+
+        return [{"item": self.names[entry_id], "category": self.categories[entry_id]}
+                for entry_id in ranked]
+
+
+class CatalogIndex:
+    """Process-local prefix and trigram index over ``recycling_items``
+
+    The index is loaded lazily from the database on first use and rebuilt
+    whenever it has been invalidated or is older than ``max_age`` seconds,
+    so autocomplete lookups never issue SQL on the hot path.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._stale = True
+        self._invalidations = 0
+        self._lock = threading.Lock()
+        self._rebuild_flight = SingleFlight()
+
+    def invalidate(self):
+        """Mark the index as out of date; the next lookup rebuilds it"""
+        with self._lock:
+            self._stale = True
+            self._invalidations += 1
+
+    def rebuild(self, items=None):
+        """Rebuild from ``(name, category)`` pairs or from the database"""
+        invalidations = self._invalidations
+        if items is None:
+            # Not the replica, which may not have the change behind the invalidation yet
+            with use_primary():
+                items = db.session.query(RecyclingItem.name, RecyclingItem.category).all()
+        snapshot = _Snapshot(items)
+        with self._lock:
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+            # Stays stale if the catalog changed while the items were being read
+            self._stale = self._invalidations != invalidations
+        return snapshot
+
+    def needs_rebuild(self):
+        """Whether the next lookup would reload the index from the database"""
+        expired = self.max_age is not None and time.monotonic() - self._loaded_at > self.max_age
+        return self._snapshot is None or self._stale or expired
+
+    def refresh(self):
+        """Rebuild from the database if stale; callers arriving together share one reload"""
+        if self.needs_rebuild():
+            return self._rebuild_flight.do('rebuild', self.rebuild)
+        return self._snapshot
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Return up to ``limit`` ranked ``{"item", "category"}`` matches"""
+        query = normalize_query(query)
+        if not query:
+            return []
+        limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+        return self.refresh().search(query, limit)
+
+    def __len__(self):
+        return len(self.refresh().names)
+
+
+catalog_index = CatalogIndex()
+
+
+@event.listens_for(RecyclingItem, 'after_insert')
+@event.listens_for(RecyclingItem, 'after_update')
+@event.listens_for(RecyclingItem, 'after_delete')
+def _invalidate_on_catalog_change(mapper, connection, target):
+    catalog_index.invalidate()
@@ -0,0 +1,365 @@
+"""Import recycling catalogs from JSON, JSON Lines, CSV or YAML files.
+
+Items are streamed from the file, validated, and diffed against
+``recycling_items`` by name. Inserts, updates and deletes are applied in
+bulk batches inside one transaction, so a file with errors changes
+nothing. The catalog caches, search index and matcher are invalidated once
+at the end rather than once per row.
+
+Item fields are ``name``, ``instruction``, ``points``, ``category`` and
+optional ``tips`` and ``aliases`` lists. In CSV files the list columns are
+separated by ``|``. JSON files may be a list of items or an object with
+``items`` and optional ``categories``; they are parsed whole, so prefer
+JSON Lines (``.jsonl``/``.ndjson``) for very large catalogs. YAML needs
+PyYAML, which is optional.
+"""
+import csv
+import json
+import os
+
+from sqlalchemy import delete, insert, select, update
+
+from database_init import DEFAULT_CATALOG_PATH, insert_missing, invalidate_catalog_caches
+from models import db, RecyclingItem, RecyclingRecord, RecordSummary, Category, Region, RegionItemOverride
+from rollups import RecyclingRollups
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover - PyYAML is optional
+    yaml = None
+
+FORMATS = {
+    '.json': 'json',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.csv': 'csv',
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+}
+BATCH_SIZE = 1000
+MAX_ERRORS = 50
+LIST_SEPARATOR = '|'
+
+
+class CatalogError(ValueError):
+    """A catalog file could not be read or failed validation"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__('; '.join(self.errors))
+
+
+def detect_format(path):
+    fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise CatalogError([f"Cannot tell the format of {path}; use one of {', '.join(sorted(FORMATS))}"])
+    return fmt
+
+
+def _read_document(path, fmt):
+    if fmt == 'yaml' and yaml is None:
+        raise CatalogError(['Reading YAML catalogs requires PyYAML (pip install PyYAML)'])
+    with open(path, encoding='utf-8') as handle:
+        try:
+            return json.load(handle) if fmt == 'json' else yaml.safe_load(handle)
+        except (ValueError, getattr(yaml, 'YAMLError', ValueError)) as exc:
+            raise CatalogError([f'{path}: {exc}'])
+
+
+def iter_raw(path, fmt=None):
+    """Yield ``(kind, position, record)`` for every record in a catalog file
+
+    ``kind`` is ``'item'``, or ``'category'`` for entries of a JSON/YAML
+    ``categories`` section; ``position`` locates the record in error messages.
+    """
+    fmt = fmt or detect_format(path)
+    if fmt == 'csv':
+        with open(path, encoding='utf-8', newline='') as handle:
+            for line, row in enumerate(csv.DictReader(handle), 2):
+                for field in ('tips', 'aliases'):
+                    value = row.get(field)
+                    row[field] = [part.strip() for part in value.split(LIST_SEPARATOR) if part.strip()] \
+                        if value else []
+                yield 'item', f'line {line}', row
+    elif fmt == 'jsonl':
+        with open(path, encoding='utf-8') as handle:
+            for line, text in enumerate(handle, 1):
+                if not text.strip():
+                    continue
+                try:
+                    record = json.loads(text)
+                except ValueError as exc:
+                    raise CatalogError([f'line {line}: {exc}'])
+                yield 'item', f'line {line}', record
+    else:
+        document = _read_document(path, fmt)
+        if isinstance(document, dict):
+            for position, record in enumerate(document.get('categories') or [], 1):
+                yield 'category', f'category {position}', record
+            document = document.get('items') or []
+        if not isinstance(document, list):
+            raise CatalogError([f'{path}: expected a list of items or an object with "items"'])
+        for position, record in enumerate(document, 1):
+            yield 'item', f'item {position}', record
+
+
+def _string_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(entry, str) for entry in value):
+        raise ValueError('must be a list of strings')
+    return [entry.strip() for entry in value if entry.strip()]
+
+
+def validate_item(record):
+    """Normalized item dict, or ValueError describing the first problem"""
+    if not isinstance(record, dict):
+        raise ValueError('item must be an object')
+    name = str(record.get('name') or '').strip().lower()
+    instruction = str(record.get('instruction') or '').strip()
+    category = str(record.get('category') or '').strip()
+    if not name:
+        raise ValueError('name is required')
+    if len(name) > 100:
+        raise ValueError(f"name '{name[:20]}...' is longer than 100 characters")
+    if not instruction:
+        raise ValueError(f"'{name}': instruction is required")
+    if not category or len(category) > 50:
+        raise ValueError(f"'{name}': category is required (at most 50 characters)")
+    try:
+        points = int(record.get('points'))
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}': points must be an integer")
+    if points < 0:
+        raise ValueError(f"'{name}': points must not be negative")
+    try:
+        tips = _string_list(record.get('tips'))
+        aliases = _string_list(record.get('aliases'))
+    except ValueError as exc:
+        raise ValueError(f"'{name}': tips and aliases {exc}")
+
+    return {'name': name, 'instruction': instruction, 'points': points, 'category': category,
+            'tips': tips, 'aliases': [alias.lower() for alias in aliases]}
+
+
+def validate_override(record):
+    """Normalized region override; missing fields keep the base item's value"""
+    if not isinstance(record, dict):
+        raise ValueError('override must be an object')
+    name = str(record.get('name') or '').strip().lower()
+    if not name:
+        raise ValueError('name is required')
+    points = record.get('points')
+    if points is not None and points != '':
+        try:
+            points = int(points)
+        except (TypeError, ValueError):
+            raise ValueError(f"'{name}': points must be an integer")
+        if points < 0:
+            raise ValueError(f"'{name}': points must not be negative")
+    else:
+        points = None
+    try:
+        tips = _string_list(record.get('tips'))
+    except ValueError as exc:
+        raise ValueError(f"'{name}': tips {exc}")
+    accepted = record.get('accepted', True)
+    if isinstance(accepted, str):
+        accepted = accepted.strip().lower() not in ('0', 'false', 'no', 'n')
+
+    return {'name': name, 'instruction': str(record.get('instruction') or '').strip() or None,
+            'points': points, 'tips': json.dumps(tips) if tips else None, 'accepted': bool(accepted)}
+
+
+def read_catalog(path=DEFAULT_CATALOG_PATH, fmt=None):
+    """Validated items of a catalog file, raising CatalogError on any problem"""
+    items, errors, seen = [], [], set()
+    for kind, position, record in iter_raw(path, fmt):
+        if kind != 'item':
+            continue
+        try:
+            item = validate_item(record)
+        except ValueError as exc:
+            errors.append(f'{position}: {exc}')
+            continue
+        if item['name'] in seen:
+            errors.append(f"{position}: duplicate item '{item['name']}'")
+        seen.add(item['name'])
+        items.append(item)
+    if errors:
+        raise CatalogError(errors[:MAX_ERRORS])
+    return items
+
+
+def _stored_row(item):
+    return (item['instruction'], item['points'], item['category'],
+            json.dumps(item['tips']), json.dumps(item['aliases']))
+
+
+class CatalogLoader:
+    """Diff a catalog file against ``recycling_items`` and apply it in bulk"""
+
+    def __init__(self, batch_size=BATCH_SIZE, prune=False):
+        self.batch_size = batch_size
+        self.prune = prune
+        self.stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'kept': 0}
+        self._inserts = []
+        self._updates = []
+        self._recategorized = False
+
+    def _flush(self):
+        if self._inserts:
+            db.session.execute(insert(RecyclingItem), self._inserts)
+            self._inserts = []
+        if self._updates:
+            db.session.execute(update(RecyclingItem), self._updates)
+            self._updates = []
+
+    def load(self, path, fmt=None, dry_run=False):
+        """Apply a catalog file; returns counts of inserted/updated/unchanged/deleted/kept items
+
+        With ``prune``, items missing from the file are deleted unless they
+        already have recycling history (those are counted as ``kept``).
+        """
+        current = {
+            name: (item_id, (instruction, points, category, tips, aliases))
+            for item_id, name, instruction, points, category, tips, aliases in db.session.execute(select(
+                RecyclingItem.id, RecyclingItem.name, RecyclingItem.instruction, RecyclingItem.points,
+                RecyclingItem.category, RecyclingItem.tips, RecyclingItem.aliases
+            ))
+        }
+        errors, seen, categories = [], set(), {}
+
+        try:
+            for kind, position, record in iter_raw(path, fmt):
+                if kind == 'category':
+                    if isinstance(record, dict) and record.get('name'):
+                        categories[record['name']] = {key: record.get(key) for key in
+                                                      ('name', 'color', 'description') if record.get(key)}
+                    else:
+                        errors.append(f'{position}: category name is required')
+                    continue
+
+                try:
+                    item = validate_item(record)
+                except ValueError as exc:
+                    errors.append(f'{position}: {exc}')
+                    if len(errors) >= MAX_ERRORS:
+                        break
+                    continue
+                if item['name'] in seen:
+                    errors.append(f"{position}: duplicate item '{item['name']}'")
+                    continue
+                seen.add(item['name'])
+                categories.setdefault(item['category'], {'name': item['category']})
+                if errors:
+                    # Keep validating the rest of the file, but write nothing
+                    continue
+
+                row = _stored_row(item)
+                values = dict(zip(('instruction', 'points', 'category', 'tips', 'aliases'), row))
+                existing = current.get(item['name'])
+                if existing is None:
+                    self._inserts.append(dict(values, name=item['name']))
+                    self.stats['inserted'] += 1
+                elif existing[1] != row:
+                    self._updates.append(dict(values, id=existing[0]))
+                    self._recategorized = self._recategorized or existing[1][2] != values['category']
+                    self.stats['updated'] += 1
+                else:
+                    self.stats['unchanged'] += 1
+
+                if len(self._inserts) + len(self._updates) >= self.batch_size and not dry_run:
+                    self._flush()
+
+            if errors:
+                raise CatalogError(errors)
+
+            stale = [item_id for name, (item_id, _) in current.items() if name not in seen] if self.prune else []
+            if stale:
+                with_history = set()
+                for start in range(0, len(stale), self.batch_size):
+                    batch = stale[start:start + self.batch_size]
+                    for model in (RecyclingRecord, RecordSummary):
+                        with_history.update(db.session.execute(
+                            select(model.item_id).where(model.item_id.in_(batch)).distinct()
+                        ).scalars())
+                self.stats['kept'] = sum(1 for item_id in stale if item_id in with_history)
+                stale = [item_id for item_id in stale if item_id not in with_history]
+                self.stats['deleted'] = len(stale)
+
+            if dry_run:
+                db.session.rollback()
+                return self.stats
+
+            self._flush()
+            for start in range(0, len(stale), self.batch_size):
+                batch = stale[start:start + self.batch_size]
+                db.session.execute(delete(RegionItemOverride).where(RegionItemOverride.item_id.in_(batch)))
+                db.session.execute(delete(RecyclingItem).where(RecyclingItem.id.in_(batch)))
+            insert_missing(Category, 'name', list(categories.values()))
+            if self._recategorized:
+                # Recount the category rollups under the items' new categories
+                RecyclingRollups.rebuild(db.session.connection())
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        invalidate_catalog_caches()
+        return self.stats
+
+
+def load_catalog(path, fmt=None, prune=False, dry_run=False, batch_size=BATCH_SIZE):
+    """Import a catalog file into ``recycling_items``; see :class:`CatalogLoader`"""
+    return CatalogLoader(batch_size=batch_size, prune=prune).load(path, fmt=fmt, dry_run=dry_run)
+
+
+def load_region_overrides(path, region_code, region_name=None, fmt=None):
+    """Replace one region's item overrides with the contents of a file
+
+    Records name a base catalog item and carry any of ``instruction``,
+    ``points``, ``tips`` and ``accepted`` (false: not collected there). The
+    region is created if it does not exist. Returns the number of overrides.
+    """
+    try:
+        region = Region.query.filter_by(code=region_code).first()
+        if region is None:
+            region = Region(code=region_code, name=region_name or region_code)
+            db.session.add(region)
+            db.session.flush()
+
+        item_ids = dict(db.session.execute(select(RecyclingItem.name, RecyclingItem.id)).all())
+        rows, errors, seen = [], [], set()
+        for kind, position, record in iter_raw(path, fmt):
+            if kind != 'item':
+                continue
+            try:
+                override = validate_override(record)
+            except ValueError as exc:
+                errors.append(f'{position}: {exc}')
+                continue
+            name = override.pop('name')
+            item_id = item_ids.get(name)
+            if item_id is None:
+                errors.append(f"{position}: '{name}' is not in the base catalog")
+            elif item_id in seen:
+                errors.append(f"{position}: duplicate item '{name}'")
+            else:
+                seen.add(item_id)
+                rows.append(dict(override, region_id=region.id, item_id=item_id))
+        if errors:
+            raise CatalogError(errors[:MAX_ERRORS])
+
+        db.session.execute(delete(RegionItemOverride).where(RegionItemOverride.region_id == region.id))
+        for start in range(0, len(rows), BATCH_SIZE):
+            db.session.execute(insert(RegionItemOverride), rows[start:start + BATCH_SIZE])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    invalidate_catalog_caches()
+    return len(rows)
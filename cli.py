@@ -0,0 +1,175 @@
+import json
+import os
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from database_init import DatabaseInitializer
+from migrations import run_migrations
+from models import db
+from rollups import RecyclingRollups
+
+ecocycle_cli = AppGroup('ecocycle', help='EcoCycle maintenance commands.')
+
+
+@ecocycle_cli.command('init-db')
+def init_db():
+    """Create tables, apply migrations and load the default catalog."""
+    DatabaseInitializer.init_database()
+    click.echo('Database initialized.')
+
+
+@ecocycle_cli.command('load-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['json', 'jsonl', 'csv', 'yaml']),
+              help='File format; guessed from the extension by default.')
+@click.option('--region', help='Load the file as this region\'s overrides of the base catalog.')
+@click.option('--region-name', help='Display name when --region creates a new region.')
+@click.option('--prune', is_flag=True, help='Delete items missing from the file (unless they have history).')
+@click.option('--dry-run', is_flag=True, help='Validate and report the diff without writing.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per bulk statement.')
+def load_catalog_command(path, fmt, region, region_name, prune, dry_run, batch_size):
+    """Import or update recycling items from a JSON/JSONL/CSV/YAML file."""
+    from catalog_loader import CatalogError, load_catalog, load_region_overrides
+    from response_cache import bump_data_version
+
+    if region and (prune or dry_run):
+        raise click.UsageError('--prune and --dry-run apply to the base catalog only.')
+
+    try:
+        if region:
+            count = load_region_overrides(path, region, region_name, fmt=fmt)
+        else:
+            stats = load_catalog(path, fmt=fmt, prune=prune, dry_run=dry_run, batch_size=batch_size)
+    except CatalogError as exc:
+        for error in exc.errors:
+            click.echo(error, err=True)
+        raise click.ClickException(f'{len(exc.errors)} problem(s) found; nothing was changed.')
+
+    if region:
+        bump_data_version()
+        click.echo(f'Loaded {count} overrides for region {region}.')
+        return
+    if not dry_run:
+        bump_data_version()
+    summary = ', '.join(f'{count} {action}' for action, count in stats.items())
+    click.echo(f"{'Would apply' if dry_run else 'Applied'}: {summary}.")
+
+
+@ecocycle_cli.command('rebuild-rollups')
+def rebuild_rollups():
+    """Recompute the statistics rollup tables from recycling_records."""
+    from response_cache import bump_data_version
+
+    RecyclingRollups.rebuild()
+    bump_data_version()
+    click.echo('Rollup tables rebuilt.')
+
+
+@ecocycle_cli.command('migrate')
+def migrate():
+    """Apply pending schema migrations."""
+    applied = run_migrations()
+    if applied:
+        click.echo('Applied migrations: ' + ', '.join(str(version) for version in applied))
+    else:
+        click.echo('Schema is up to date.')
+
+
+@ecocycle_cli.command('drain-outbox')
+def drain_outbox():
+    """Apply all queued write-behind recycling events."""
+    import write_behind
+
+    applied = write_behind.drain(current_app, write_behind.get_outbox(current_app))
+    click.echo(f'Applied {applied} queued events.')
+
+
+@ecocycle_cli.command('export-records')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default='csv')
+@click.option('--user-id', type=int, help='Only export this user (default: everyone).')
+@click.option('--start', help='Earliest recycled_at, ISO date (inclusive).')
+@click.option('--end', help='Latest recycled_at, ISO date (exclusive).')
+@click.option('--archived', is_flag=True, help='Include records compacted into the retention archive.')
+@click.option('--output', type=click.File('w'), default='-', help='Output file (default: stdout).')
+def export_records_command(fmt, user_id, start, end, archived, output):
+    """Stream recycling records as CSV or NDJSON."""
+    from export import export_records, parse_timestamp
+
+    for chunk in export_records(fmt, archived=archived, user_id=user_id,
+                                start=parse_timestamp(start), end=parse_timestamp(end)):
+        output.write(chunk)
+
+
+@ecocycle_cli.command('compact-records')
+@click.option('--days', type=int, help='Keep this many days of raw records (default: RECORD_RETENTION_DAYS).')
+@click.option('--batch-size', default=5000, show_default=True, help='Records per archive file and transaction.')
+@click.option('--max-batches', type=int, help='Stop after this many batches (default: until done).')
+@click.option('--vacuum', is_flag=True, help='VACUUM a SQLite database afterwards; locks it while it runs.')
+def compact_records(days, batch_size, max_batches, vacuum):
+    """Compact expired recycling records into daily summaries and archive files."""
+    import retention
+    from sqlalchemy import text
+
+    if days is None:
+        days = current_app.config.get('RECORD_RETENTION_DAYS', retention.DEFAULT_RETENTION_DAYS)
+    cutoff = retention.retention_cutoff(days)
+    try:
+        count = retention.compact(cutoff, retention.archive_root(), batch_size, max_batches)
+    except BlockingIOError:
+        raise click.ClickException('Another compaction is already running.')
+    click.echo(f'Compacted {count} records older than {cutoff.date().isoformat()}.')
+
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+        click.echo('Database vacuumed.')
+
+
+def _snapshot_root(path):
+    return path or current_app.config.get('COLUMNAR_SNAPSHOT_DIR') or \
+        os.path.join(current_app.instance_path, 'columnar')
+
+
+@ecocycle_cli.command('snapshot-records')
+@click.option('--output', type=click.Path(file_okay=False),
+              help='Snapshot directory (default: COLUMNAR_SNAPSHOT_DIR or instance/columnar).')
+@click.option('--keep', default=3, show_default=True, help='Snapshots to keep; 0 keeps all.')
+def snapshot_records(output, keep):
+    """Export recycling records into a columnar snapshot for offline reports."""
+    from columnar import ColumnarSnapshot, export_snapshot
+
+    path = export_snapshot(_snapshot_root(output), keep=keep)
+    click.echo(f'Wrote {len(ColumnarSnapshot(path))} records to {path}.')
+
+
+@ecocycle_cli.command('community-report')
+@click.option('--snapshot', 'root', type=click.Path(file_okay=False),
+              help='Snapshot directory (default: COLUMNAR_SNAPSHOT_DIR or instance/columnar).')
+@click.option('--region', help='Region code to report on (default: everyone).')
+@click.option('--start', help='Earliest recycled_at, ISO date (inclusive).')
+@click.option('--end', help='Latest recycled_at, ISO date (exclusive).')
+def community_report(root, region, start, end):
+    """Print community, category, monthly and cohort stats from the latest snapshot as JSON."""
+    from columnar import ColumnarSnapshot
+    from export import parse_timestamp
+
+    try:
+        snapshot = ColumnarSnapshot.latest(_snapshot_root(root))
+    except FileNotFoundError:
+        raise click.ClickException('No snapshot found; run `flask ecocycle snapshot-records` first.')
+    region_id = None
+    if region:
+        region_id = snapshot.regions.get(region)
+        if region_id is None:
+            raise click.ClickException(f'Unknown region {region}.')
+
+    window = {'region_id': region_id, 'start': parse_timestamp(start), 'end': parse_timestamp(end)}
+    click.echo(json.dumps({
+        'snapshot': snapshot.manifest,
+        'community': snapshot.get_community_stats(**window),
+        'categories': snapshot.get_category_distribution(**window),
+        'monthly': snapshot.get_monthly_summary(**window),
+        'cohorts': snapshot.get_cohort_category_mix(**window),
+    }, indent=2))
@@ -0,0 +1,62 @@
+"""Request coalescing: one computation per key for concurrent callers.
+
+When many requests ask for the same thing at once (a popular search during
+a spike, or every worker thread finding the catalog index stale), the
+first caller computes the result and the others wait for it instead of
+repeating the work. Nothing is cached once the call finishes; the next
+caller starts a fresh computation.
+"""
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, function, *args, **kwargs):
+        """Run ``function(*args, **kwargs)`` once for concurrent callers of ``key``
+
+        The first caller runs it; the others wait and get its result, or
+        its exception re-raised.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        return {'calls': self.calls, 'shared': self.shared}
@@ -0,0 +1,372 @@
+"""Columnar snapshots of ``recycling_records`` for offline community reports.
+
+``flask ecocycle snapshot-records`` streams the records (from the replica
+when one is configured), including those compacted into record summaries
+by retention.py, into a directory of ``.npy`` files:
+
+* one entry per record in ``user_id``, ``item_code``, ``points``,
+  ``region_id`` (0 for none) and ``recycled_at``, where ``item_code``
+  indexes the dictionary-encoded item table in ``items.json``;
+* one entry per user in ``users_id``, ``users_region_id`` and
+  ``users_created_at``, with the usernames in ``users.json``.
+
+:class:`ColumnarSnapshot` memory-maps those columns read-only and answers
+the community report queries with vectorized NumPy passes over fixed-size
+chunks of rows, so memory stays bounded however large the snapshot is and
+the database is not touched at all. Needs ``numpy``.
+"""
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, select
+
+from db_routing import use_replica
+from models import db, RecordSummary, RecyclingItem, RecyclingRecord, Region, User
+from retention import archive_root, compaction_lock
+
+SNAPSHOT_VERSION = 1
+LATEST_FILE = 'LATEST'
+FETCH_SIZE = 50000
+CHUNK_ROWS = 1 << 22
+TOP_COUNT = 5
+
+RECORD_COLUMNS = {
+    'user_id': np.int32,
+    'item_code': np.int32,
+    'points': np.int32,
+    'region_id': np.int32,
+    'recycled_at': 'datetime64[s]',
+}
+
+
+def _write_atomic(path, text):
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(handle, 'w') as tmp:
+        tmp.write(text)
+    os.replace(tmp_path, path)
+
+
+class ItemDictionary:
+    """Dictionary encoding of item ids and names into dense ``item_code`` values
+
+    Codes follow the catalog order; names of records without an item id
+    that are not in the catalog get codes of their own, with no category.
+    """
+
+    def __init__(self, catalog):
+        self.entries = [{'id': item_id, 'name': name, 'category': category}
+                        for item_id, name, category in catalog]
+        self._by_name = {entry['name']: code for code, entry in enumerate(self.entries)}
+        self._by_id = np.full(max((item_id for item_id, _, _ in catalog), default=0) + 1, -1, np.int32)
+        for code, entry in enumerate(self.entries):
+            self._by_id[entry['id']] = code
+
+    def _code_for_name(self, name):
+        code = self._by_name.get(name)
+        if code is None:
+            code = self._by_name[name] = len(self.entries)
+            self.entries.append({'id': None, 'name': name, 'category': None})
+        return code
+
+    def encode(self, item_ids, names):
+        ids = np.fromiter((item_id or 0 for item_id in item_ids), np.int64, len(item_ids))
+        codes = np.full(len(ids), -1, np.int32)
+        known = ids < len(self._by_id)
+        codes[known] = self._by_id[ids[known]]
+        for position in np.flatnonzero(codes < 0):
+            codes[position] = self._code_for_name(names[position])
+        return codes
+
+
+class SnapshotWriter:
+    """Fills the record columns of a new snapshot, then publishes it atomically
+
+    Columns are preallocated for ``capacity`` rows; the manifest records how
+    many were written and readers ignore the rest.
+    """
+
+    def __init__(self, root, capacity):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.capacity = capacity
+        self.rows = 0
+        self.directory = tempfile.mkdtemp(prefix='.snapshot-', dir=root)
+        self._columns = {
+            name: np.lib.format.open_memmap(os.path.join(self.directory, f'{name}.npy'), mode='w+',
+                                            dtype=dtype, shape=(capacity,))
+            for name, dtype in RECORD_COLUMNS.items()
+        }
+
+    def append(self, **columns):
+        end = self.rows + len(columns['user_id'])
+        if end > self.capacity:
+            raise ValueError(f'Snapshot capacity of {self.capacity} rows exceeded')
+        for name, column in self._columns.items():
+            column[self.rows:end] = columns[name]
+        self.rows = end
+
+    def publish(self, items, users, regions, name=None):
+        """Write the item and user tables plus the manifest; returns the snapshot path"""
+        for column in self._columns.values():
+            column.flush()
+        self._columns = {}
+
+        user_ids, usernames, user_regions, created_at = zip(*users) if users else ((), (), (), ())
+        np.save(os.path.join(self.directory, 'users_id.npy'), np.array(user_ids, np.int32))
+        np.save(os.path.join(self.directory, 'users_region_id.npy'),
+                np.array([region_id or 0 for region_id in user_regions], np.int32))
+        np.save(os.path.join(self.directory, 'users_created_at.npy'), np.array(created_at, 'datetime64[s]'))
+        with open(os.path.join(self.directory, 'users.json'), 'w') as handle:
+            json.dump(list(usernames), handle)
+        with open(os.path.join(self.directory, 'items.json'), 'w') as handle:
+            json.dump(items, handle)
+        with open(os.path.join(self.directory, 'manifest.json'), 'w') as handle:
+            json.dump({
+                'version': SNAPSHOT_VERSION,
+                'created_at': datetime.utcnow().isoformat(),
+                'rows': self.rows,
+                'regions': regions,
+            }, handle)
+
+        name = name or datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        path = os.path.join(self.root, name)
+        os.replace(self.directory, path)
+        _write_atomic(os.path.join(self.root, LATEST_FILE), name)
+        return path
+
+    def discard(self):
+        self._columns = {}
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def prune_snapshots(root, keep):
+    """Delete all but the ``keep`` newest snapshots under ``root``"""
+    names = sorted(name for name in os.listdir(root)
+                   if not name.startswith('.') and os.path.isdir(os.path.join(root, name)))
+    for name in names[:-keep] if keep else []:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def expand_summaries(items, rows):
+    """Record columns for ``(user_id, item_id, item_name, items, points, region_id, day)`` summaries
+
+    Each summary of compacted records becomes ``items`` records at midnight
+    of its day, sharing its points, so every total comes out the same.
+    """
+    user_ids, item_ids, names, counts, points, region_ids, days = zip(*rows)
+    counts = np.array(counts, np.int64)
+    base, remainder = np.divmod(np.array(points, np.int64), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return {
+        'user_id': np.repeat(np.array(user_ids, np.int32), counts),
+        'item_code': np.repeat(items.encode(item_ids, names), counts),
+        'points': np.repeat(base, counts) + (offsets < np.repeat(remainder, counts)),
+        'region_id': np.repeat(np.array([region_id or 0 for region_id in region_ids], np.int32), counts),
+        'recycled_at': np.repeat(np.array(days, 'datetime64[D]').astype('datetime64[s]'), counts),
+    }
+
+
+def export_snapshot(root, keep=3, fetch_size=FETCH_SIZE):
+    """Stream ``recycling_records`` and compacted record summaries into a new snapshot under ``root``
+
+    Reads go to the replica when one is configured. Records inserted while
+    the export runs are left for the next snapshot; compaction waits for it
+    to finish. Returns the new path.
+    """
+    table = RecyclingRecord.__table__
+    summaries = RecordSummary.__table__
+    with compaction_lock(archive_root(), blocking=True), use_replica():
+        max_id = db.session.scalar(select(func.max(table.c.id))) or 0
+        capacity = db.session.scalar(select(func.count()).select_from(table).where(table.c.id <= max_id)) + \
+            (db.session.scalar(select(func.sum(summaries.c['items']))) or 0)
+        items = ItemDictionary(db.session.execute(
+            select(RecyclingItem.id, RecyclingItem.name, RecyclingItem.category).order_by(RecyclingItem.id)
+        ).all())
+        users = db.session.execute(
+            select(User.id, User.username, User.region_id, User.created_at).order_by(User.id)
+        ).all()
+        regions = dict(db.session.execute(select(Region.code, Region.id)).all())
+
+        writer = SnapshotWriter(root, capacity)
+        try:
+            query = select(table.c.user_id, table.c.item_id, table.c.item_name, table.c.points_earned,
+                           table.c.region_id, table.c.recycled_at) \
+                .where(table.c.id <= max_id).order_by(table.c.id)
+            result = db.session.execute(query.execution_options(stream_results=True, yield_per=fetch_size))
+            for rows in result.partitions():
+                user_ids, item_ids, names, points, region_ids, recycled_at = zip(*rows)
+                writer.append(user_id=user_ids,
+                              item_code=items.encode(item_ids, names),
+                              points=points,
+                              region_id=[region_id or 0 for region_id in region_ids],
+                              recycled_at=np.array(recycled_at, 'datetime64[s]'))
+
+            query = select(summaries.c.user_id, summaries.c.item_id, summaries.c.item_name, summaries.c['items'],
+                           summaries.c.points, summaries.c.region_id, summaries.c.day).order_by(summaries.c.id)
+            result = db.session.execute(query.execution_options(stream_results=True, yield_per=fetch_size))
+            for rows in result.partitions():
+                writer.append(**expand_summaries(items, rows))
+            path = writer.publish(items.entries, users, regions)
+        except BaseException:
+            writer.discard()
+            raise
+
+    prune_snapshots(root, keep)
+    return path
+
+
+def _top(values, count):
+    """Indexes of the ``count`` largest positive values, largest first"""
+    candidates = np.flatnonzero(values > 0)
+    if len(candidates) > count:
+        candidates = candidates[np.argpartition(-values[candidates], count - 1)[:count]]
+    return candidates[np.lexsort((candidates, -values[candidates]))]
+
+
+class ColumnarSnapshot:
+    """A published snapshot, memory-mapped read-only
+
+    The query methods take the same ``region_id``/``user_id`` arguments as
+    :class:`analytics.RecyclingAnalytics`, plus ``start``/``end`` datetimes
+    and ``user_ids`` (a cohort) to narrow the records scanned.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json')) as handle:
+            self.manifest = json.load(handle)
+        rows = self.manifest['rows']
+        self.columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')[:rows]
+                        for name in RECORD_COLUMNS}
+        self.regions = self.manifest['regions']
+
+        with open(os.path.join(path, 'items.json')) as handle:
+            self.items = json.load(handle)
+        self.categories = sorted({item['category'] for item in self.items if item['category']})
+        # Items without a category map to one extra slot that results leave out
+        category_codes = {name: code for code, name in enumerate(self.categories)}
+        self.item_category = np.array([category_codes.get(item['category'], len(self.categories))
+                                       for item in self.items], np.int32)
+
+        self.user_ids = np.load(os.path.join(path, 'users_id.npy'))
+        self.user_regions = np.load(os.path.join(path, 'users_region_id.npy'))
+        self.user_created_at = np.load(os.path.join(path, 'users_created_at.npy'))
+        with open(os.path.join(path, 'users.json')) as handle:
+            self.usernames = json.load(handle)
+        self.max_user_id = int(max(self.user_ids.max(initial=0), self.columns['user_id'].max(initial=0)))
+
+    @classmethod
+    def latest(cls, root):
+        """The snapshot most recently published under ``root``"""
+        with open(os.path.join(root, LATEST_FILE)) as handle:
+            return cls(os.path.join(root, handle.read().strip()))
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def _chunks(self, user_id=None, user_ids=None, region_id=None, start=None, end=None):
+        """Yield ``(window, mask)`` per chunk; ``mask`` is None when every row matches"""
+        columns = self.columns
+        for offset in range(0, len(self), CHUNK_ROWS):
+            window = slice(offset, offset + CHUNK_ROWS)
+            conditions = []
+            if user_id is not None:
+                conditions.append(columns['user_id'][window] == user_id)
+            if user_ids is not None:
+                conditions.append(np.isin(columns['user_id'][window], user_ids))
+            if region_id is not None:
+                conditions.append(columns['region_id'][window] == region_id)
+            if start is not None:
+                conditions.append(columns['recycled_at'][window] >= np.datetime64(start, 's'))
+            if end is not None:
+                conditions.append(columns['recycled_at'][window] < np.datetime64(end, 's'))
+            yield window, np.logical_and.reduce(conditions) if conditions else None
+
+    def _column(self, name, window, mask):
+        column = self.columns[name][window]
+        return column if mask is None else column[mask]
+
+    def item_totals(self, with_points=True, **filters):
+        """Record counts and points (None unless ``with_points``) per item code"""
+        counts = np.zeros(len(self.items), np.int64)
+        points = np.zeros(len(self.items), np.int64) if with_points else None
+        for window, mask in self._chunks(**filters):
+            codes = self._column('item_code', window, mask)
+            counts += np.bincount(codes, minlength=len(self.items))
+            if with_points:
+                points += np.bincount(codes, weights=self._column('points', window, mask),
+                                      minlength=len(self.items)).astype(np.int64)
+        return counts, points
+
+    def user_points(self, **filters):
+        """Points per user, indexed by user id"""
+        totals = np.zeros(self.max_user_id + 1, np.int64)
+        for window, mask in self._chunks(**filters):
+            totals += np.bincount(self._column('user_id', window, mask),
+                                  weights=self._column('points', window, mask),
+                                  minlength=len(totals)).astype(np.int64)
+        return totals
+
+    def get_community_stats(self, region_id=None, start=None, end=None):
+        """Same result as RecyclingAnalytics.get_community_stats, from the snapshot"""
+        counts, points = self.item_totals(region_id=region_id, start=start, end=end)
+        members = self.user_ids if region_id is None else self.user_ids[self.user_regions == region_id]
+        member_points = self.user_points(start=start, end=end)[members]
+        usernames = dict(zip(self.user_ids.tolist(), self.usernames))
+
+        return {
+            'total_users': len(members),
+            'total_recycled_items': int(counts.sum()),
+            'total_points_earned': int(points.sum()),
+            'top_recyclers': [{'username': usernames.get(int(members[index])), 'points': int(member_points[index])}
+                              for index in _top(member_points, TOP_COUNT)],
+            'popular_items': [{'item': self.items[code]['name'], 'count': int(counts[code])}
+                              for code in _top(counts, TOP_COUNT)]
+        }
+
+    def get_category_distribution(self, user_id=None, region_id=None, user_ids=None, start=None, end=None):
+        """Same result as RecyclingAnalytics.get_category_distribution, from the snapshot"""
+        counts, _ = self.item_totals(with_points=False, user_id=user_id, region_id=region_id,
+                                     user_ids=user_ids, start=start, end=end)
+        by_category = np.bincount(self.item_category, weights=counts, minlength=len(self.categories) + 1)
+        return {name: int(count) for name, count in zip(self.categories, by_category) if count}
+
+    def get_monthly_summary(self, region_id=None, start=None, end=None):
+        """Items and points per ``YYYY-MM`` month"""
+        months = {}
+        for window, mask in self._chunks(region_id=region_id, start=start, end=end):
+            recycled_at = self._column('recycled_at', window, mask)
+            if not len(recycled_at):
+                continue
+            # Bucket by month edges instead of converting every timestamp to a month
+            edges = np.arange(recycled_at.min().astype('datetime64[M]'),
+                              recycled_at.max().astype('datetime64[M]') + 2).astype('datetime64[s]')
+            buckets = np.searchsorted(edges, recycled_at, side='right') - 1
+            items = np.bincount(buckets, minlength=len(edges) - 1)
+            points = np.bincount(buckets, weights=self._column('points', window, mask), minlength=len(edges) - 1)
+            for bucket in np.flatnonzero(items):
+                total = months.setdefault(str(edges[bucket].astype('datetime64[M]')), [0, 0])
+                total[0] += int(items[bucket])
+                total[1] += int(points[bucket])
+
+        return {month: {'items': items, 'points': points} for month, (items, points) in sorted(months.items())}
+
+    def get_cohort_category_mix(self, region_id=None, start=None, end=None):
+        """Category distribution per signup-month cohort of users"""
+        cohort_names, user_cohorts = np.unique(self.user_created_at.astype('datetime64[M]'), return_inverse=True)
+        cohort_of = np.full(self.max_user_id + 1, len(cohort_names), np.int64)
+        cohort_of[self.user_ids] = user_cohorts
+        width = len(self.categories) + 1
+        cells = np.zeros((len(cohort_names) + 1) * width, np.int64)
+        for window, mask in self._chunks(region_id=region_id, start=start, end=end):
+            cohorts = cohort_of[self._column('user_id', window, mask)]
+            categories = self.item_category[self._column('item_code', window, mask)]
+            cells += np.bincount(cohorts * width + categories, minlength=len(cells))
+
+        grid = cells.reshape(-1, width)
+        return {str(cohort): {name: int(count) for name, count in zip(self.categories, row) if count}
+                for cohort, row in zip(cohort_names, grid) if row[:-1].any()}
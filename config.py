@@ -1,14 +1,82 @@
 # [file name]: config.py
 import os
 
+
+def _flag(name, default):
+    value = os.environ.get(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes')
+
+
+def engine_options(pool_size=None, max_overflow=None):
+    """Connection pool settings, overridable through ECOCYCLE_DB_* variables
+
+    ``pool_size``/``max_overflow`` are only passed when set, so SQLite's
+    in-memory pools (which take neither) keep working.
+    """
+    options = {
+        # Test a connection before use and replace ones the server dropped
+        'pool_pre_ping': _flag('ECOCYCLE_DB_POOL_PRE_PING', True),
+        # Retire connections before server-side idle timeouts kill them
+        'pool_recycle': int(os.environ.get('ECOCYCLE_DB_POOL_RECYCLE', 1800)),
+    }
+    pool_size = os.environ.get('ECOCYCLE_DB_POOL_SIZE', pool_size)
+    max_overflow = os.environ.get('ECOCYCLE_DB_MAX_OVERFLOW', max_overflow)
+    pool_timeout = os.environ.get('ECOCYCLE_DB_POOL_TIMEOUT')
+    if pool_size is not None:
+        options['pool_size'] = int(pool_size)
+    if max_overflow is not None:
+        options['max_overflow'] = int(max_overflow)
+    if pool_timeout is not None:
+        options['pool_timeout'] = int(pool_timeout)
+    return options
+
+
+def database_binds():
+    """Extra engines; ``replica`` serves the read-only analytics queries"""
+    replica_url = os.environ.get('DATABASE_REPLICA_URL')
+    return {'replica': replica_url} if replica_url else {}
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///ecocycle.db')
+    SQLALCHEMY_BINDS = database_binds()
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    WRITE_BEHIND_ENABLED = os.environ.get('ECOCYCLE_WRITE_BEHIND') == '1'
+    # Seconds an applied Idempotency-Key keeps deduplicating retries
+    WRITE_BEHIND_KEY_RETENTION = int(os.environ.get('ECOCYCLE_WRITE_BEHIND_KEY_RETENTION', 24 * 3600))
+    ADMIN_TOKEN = os.environ.get('ECOCYCLE_ADMIN_TOKEN')
+    RESPONSE_CACHE_BACKEND = os.environ.get('ECOCYCLE_RESPONSE_CACHE', 'memory')
+    # Seconds before the memory backend drops everything it cached
+    RESPONSE_CACHE_TTL = int(os.environ.get('ECOCYCLE_RESPONSE_CACHE_TTL', 10))
+    SLOW_REQUEST_MS = int(os.environ.get('ECOCYCLE_SLOW_REQUEST_MS', 500))
+    FRAGMENT_CACHE_TTL = int(os.environ.get('ECOCYCLE_FRAGMENT_CACHE_TTL', 30))
+    TEMPLATE_BYTECODE_DIR = os.environ.get('ECOCYCLE_TEMPLATE_BYTECODE_DIR')
+    COLUMNAR_SNAPSHOT_DIR = os.environ.get('ECOCYCLE_SNAPSHOT_DIR')
+    LIVE_STATS_BUS = os.environ.get('ECOCYCLE_LIVE_STATS_BUS', 'local')
+    LIVE_STATS_BUS_DIR = os.environ.get('ECOCYCLE_LIVE_STATS_DIR')
+    RECORD_RETENTION_DAYS = int(os.environ.get('ECOCYCLE_RETENTION_DAYS', 365))
+    RECORD_ARCHIVE_DIR = os.environ.get('ECOCYCLE_ARCHIVE_DIR')
+    RATE_LIMIT_ENABLED = _flag('ECOCYCLE_RATE_LIMIT', True)
+    RATE_LIMIT_BACKEND = os.environ.get('ECOCYCLE_RATE_LIMIT_BACKEND', 'memory')
+    # Limit name: (tokens per second, burst) per client address
+    RATE_LIMITS = {'search': (10, 30), 'recycle': (2, 20)}
 
 class TestConfig(Config):
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # A file (TEST_DATABASE_URL) for tests that need several connections
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'sqlite:///:memory:')
+    SQLALCHEMY_BINDS = {}
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    RATE_LIMIT_ENABLED = False
 
 class ProductionConfig(Config):
-    pass
\ No newline at end of file
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(pool_size=10, max_overflow=20)
+
+
+CONFIGS = {
+    'development': Config,
+    'testing': TestConfig,
+    'production': ProductionConfig,
+}
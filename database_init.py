@@ -1,110 +1,145 @@
 # [file name]: database_init.py
 import json
-from models import db, RecyclingItem, Category
+import os
+
+from sqlalchemy import bindparam, insert, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import cache
+from catalog_index import catalog_index
+from matching import item_matcher
+from models import db, RecyclingItem, Category, User
+from rollups import RecyclingRollups
+
+# Demo account every request acts as until real authentication exists
+DEFAULT_USER_ID = 1
+DEFAULT_USERNAME = 'demo_user'
+
+# Default catalog, shared with the demo app and the benchmark data generator.
+# Larger catalogs are imported with ``flask ecocycle load-catalog``.
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'catalog.json')
+
+with open(DEFAULT_CATALOG_PATH, encoding='utf-8') as _catalog_file:
+    _default_catalog = json.load(_catalog_file)
+CATEGORIES = _default_catalog['categories']
+RECYCLING_ITEMS = _default_catalog['items']
+
+
+_INSERT_IGNORES = {
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert,
+}
+
+
+def insert_missing(model, key, rows):
+    """Insert the rows whose ``key`` is not stored yet, without a SELECT per row"""
+    if not rows:
+        return
+    table = model.__table__
+    make_insert = _INSERT_IGNORES.get(db.session.get_bind().dialect.name)
+    if make_insert is not None:
+        db.session.execute(make_insert(table).on_conflict_do_nothing(), rows)
+        return
+
+    existing = set(db.session.execute(select(table.c[key])).scalars())
+    rows = [row for row in rows if row[key] not in existing]
+    if rows:
+        db.session.execute(insert(table), rows)
+
+
+def upsert(model, key, rows):
+    """Insert the rows, or update the stored row with the same ``key``, in one statement
+
+    Rows that already match are left alone, so rerunning writes nothing.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    columns = [name for name in rows[0] if name != key]
+    make_insert = _INSERT_IGNORES.get(db.session.get_bind().dialect.name)
+    if make_insert is not None:
+        stmt = make_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key],
+            set_={name: stmt.excluded[name] for name in columns},
+            where=or_(*(table.c[name].is_distinct_from(stmt.excluded[name]) for name in columns))
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    # Portable fallback: one bulk INSERT and one executemany UPDATE
+    existing = set(db.session.execute(select(table.c[key])).scalars())
+    inserts = [row for row in rows if row[key] not in existing]
+    updates = [dict(row, match_key=row[key]) for row in rows if row[key] in existing]
+    if inserts:
+        db.session.execute(insert(table), inserts)
+    if updates:
+        db.session.execute(
+            update(table).where(table.c[key] == bindparam('match_key'))
+            .values({name: bindparam(name) for name in columns}),
+            updates
+        )
+
+
+def invalidate_catalog_caches():
+    """Drop every in-process view of the catalog after a bulk write
+
+    Core inserts bypass the ORM mapper events that normally do this.
+    """
+    cache.catalog_cache.invalidate()
+    catalog_index.invalidate()
+    item_matcher.invalidate()
 
 
 class DatabaseInitializer:
+    @staticmethod
+    def init_database():
+        """Create the schema, apply migrations and load the default data
+
+        Run once per deployment (``flask ecocycle init-db``), not per worker.
+        """
+        from migrations import run_migrations
+
+        db.create_all()
+        run_migrations()
+        DatabaseInitializer.init_data()
+        DatabaseInitializer.init_default_user()
+
     @staticmethod
     def init_data():
         """Initialize the database with default data"""
         DatabaseInitializer.init_categories()
         DatabaseInitializer.init_recycling_items()
+        invalidate_catalog_caches()
 
     @staticmethod
     def init_categories():
-        """Initialize categories"""
-        categories = [
-            {'name': 'Plastic', 'color': '#4a90e2', 'description': 'Plastic materials'},
-            {'name': 'Paper', 'color': '#f39c12', 'description': 'Paper and cardboard'},
-            {'name': 'Glass', 'color': '#2e8b57', 'description': 'Glass containers'},
-            {'name': 'Metal', 'color': '#95a5a6', 'description': 'Metal cans and items'},
-            {'name': 'E-Waste', 'color': '#e74c3c', 'description': 'Electronic waste'},
-            {'name': 'Hazardous', 'color': '#c0392b', 'description': 'Hazardous materials'},
-            {'name': 'Organic', 'color': '#8e44ad', 'description': 'Organic waste'}
-        ]
-
-        for cat_data in categories:
-            if not Category.query.filter_by(name=cat_data['name']).first():
-                category = Category(**cat_data)
-                db.session.add(category)
-
+        """Initialize categories, resetting the default ones to their defaults"""
+        upsert(Category, 'name', [dict(cat_data) for cat_data in CATEGORIES])
         db.session.commit()
 
     @staticmethod
     def init_recycling_items():
-        """Initialize recycling items"""
-        items_data = [
-            {
-                "name": "plastic bottle",
-                "instruction": "Rinse and remove caps. Place in blue recycling bin.",
-                "points": 5,
-                "category": "Plastic",
-                "tips": ["Crush bottles to save space", "Remove labels if possible"]
-            },
-            {
-                "name": "paper",
-                "instruction": "Keep dry and clean. Place in blue recycling bin.",
-                "points": 3,
-                "category": "Paper",
-                "tips": ["Flatten cardboard boxes", "Remove any plastic wrapping"]
-            },
-            {
-                "name": "cardboard",
-                "instruction": "Flatten boxes. Place in blue recycling bin.",
-                "points": 4,
-                "category": "Paper",
-                "tips": ["Break down large boxes", "Remove packing tape"]
-            },
-            {
-                "name": "glass bottle",
-                "instruction": "Rinse thoroughly. Place in green glass recycling bin.",
-                "points": 6,
-                "category": "Glass",
-                "tips": ["Remove metal caps", "Don't break glass - it's harder to recycle"]
-            },
-            {
-                "name": "aluminum can",
-                "instruction": "Rinse and crush if possible. Place in blue recycling bin.",
-                "points": 8,
-                "category": "Metal",
-                "tips": ["Crushing saves space", "Check for local redemption value"]
-            },
-            {
-                "name": "electronics",
-                "instruction": "Take to designated e-waste recycling center. Do not place in regular bins.",
-                "points": 15,
-                "category": "E-Waste",
-                "tips": ["Remove batteries if possible", "Wipe personal data from devices"]
-            },
-            {
-                "name": "battery",
-                "instruction": "Take to special battery recycling drop-off location. Hazardous if disposed improperly.",
-                "points": 10,
-                "category": "Hazardous",
-                "tips": ["Tape terminals of lithium batteries", "Store in cool, dry place until recycling"]
-            },
-            {
-                "name": "plastic bag",
-                "instruction": "Take to grocery store recycling bin. Do not place in curbside recycling.",
-                "points": 2,
-                "category": "Plastic",
-                "tips": ["Reuse when possible", "Collect multiple bags together for recycling"]
-            },
-            {
-                "name": "food waste",
-                "instruction": "Compost if possible. Otherwise dispose in regular trash.",
-                "points": 0,
-                "category": "Organic",
-                "tips": ["Start a compost bin", "Use a countertop compost collector"]
-            }
-        ]
-
-        for item_data in items_data:
-            if not RecyclingItem.query.filter_by(name=item_data['name']).first():
-                # Convert tips list to JSON string
-                tips_json = json.dumps(item_data.pop('tips'))
-                item = RecyclingItem(**item_data)
-                item.tips = tips_json
-                db.session.add(item)
-
-        db.session.commit()
\ No newline at end of file
+        """Initialize recycling items, resetting the default ones to their defaults"""
+        rows = []
+        for item_data in RECYCLING_ITEMS:
+            # Convert tips and aliases lists to JSON strings
+            item_data = dict(item_data)
+            item_data['tips'] = json.dumps(item_data['tips'])
+            item_data['aliases'] = json.dumps(item_data.get('aliases', []))
+            rows.append(item_data)
+
+        stored = dict(db.session.execute(select(RecyclingItem.name, RecyclingItem.category)).all())
+        upsert(RecyclingItem, 'name', rows)
+        db.session.commit()
+        if any(row['name'] in stored and stored[row['name']] != row['category'] for row in rows):
+            # Recount the category rollups under the restored categories
+            RecyclingRollups.rebuild()
+
+    @staticmethod
+    def init_default_user():
+        """Create the demo user if it does not exist"""
+        insert_missing(User, 'id', [{'id': DEFAULT_USER_ID, 'username': DEFAULT_USERNAME}])
+        db.session.commit()
+        cache.user_cache.invalidate(DEFAULT_USER_ID)
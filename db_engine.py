@@ -0,0 +1,55 @@
+import functools
+import random
+import sqlite3
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from models import db
+
+SQLITE_BUSY_TIMEOUT_MS = 5000
+RETRY_ATTEMPTS = 5
+RETRY_BACKOFF = 0.05
+
+
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    """Use WAL and a busy timeout so gunicorn workers queue for the write lock"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+
+def is_lock_error(exc):
+    message = str(getattr(exc, 'orig', exc)).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def retry_on_locked(func=None, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF):
+    """Retry a write transaction that lost the SQLite write lock
+
+    The session is rolled back before each retry, so the wrapped function
+    must build its whole transaction from scratch. Backoff is exponential
+    with jitter.
+    """
+    if func is None:
+        return functools.partial(retry_on_locked, attempts=attempts, backoff=backoff)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(attempts):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                db.session.rollback()
+                if not is_lock_error(exc) or attempt == attempts - 1:
+                    raise
+                time.sleep(backoff * (2 ** attempt) * (1 + random.random()))
+
+    return wrapper
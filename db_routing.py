@@ -0,0 +1,86 @@
+"""Read/write routing between the primary database and a read replica.
+
+The replica is an optional ``SQLALCHEMY_BINDS['replica']`` engine with its
+own connection pool. Code that only reads and tolerates replication lag
+(analytics and trend series) runs under :func:`use_replica` or
+:func:`reads_from_replica`; its SELECTs go to the replica while flushes,
+DML and anything else still go to the primary. Without a replica bind
+everything uses the primary. :func:`use_primary` overrides both, for reads
+whose result outlives the request, such as cached responses.
+"""
+import contextlib
+import contextvars
+import functools
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+REPLICA_BIND_KEY = 'replica'
+
+_prefer_replica = contextvars.ContextVar('ecocycle_prefer_replica', default=False)
+_require_primary = contextvars.ContextVar('ecocycle_require_primary', default=False)
+
+
+@contextlib.contextmanager
+def use_replica():
+    """Send the SELECTs issued inside the block to the read replica"""
+    token = _prefer_replica.set(True)
+    try:
+        yield
+    finally:
+        _prefer_replica.reset(token)
+
+
+@contextlib.contextmanager
+def use_primary():
+    """Keep every read inside the block on the primary, even under use_replica"""
+    token = _require_primary.set(True)
+    try:
+        yield
+    finally:
+        _require_primary.reset(token)
+
+
+def reads_from_replica(func):
+    """Run ``func`` under :func:`use_replica`"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with use_replica():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that routes replica-safe reads to the replica
+
+    Reads stay on the primary while the session has pending changes or an
+    uncommitted transaction that wrote, so a request never reads around
+    its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and _prefer_replica.get() and not _require_primary.get() and isinstance(clause, Select)
+                and not self._flushing and not self.info.get('ecocycle_wrote')
+                and not (self.new or self.dirty or self.deleted)):
+            replica = self._db.engines.get(REPLICA_BIND_KEY)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_flush(session, flush_context):
+    session.info['ecocycle_wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['ecocycle_wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+@event.listens_for(RoutingSession, 'after_rollback')
+def _clear_writes(session):
+    session.info.pop('ecocycle_wrote', None)
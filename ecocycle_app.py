@@ -1,90 +1,101 @@
 # [file name]: ecocycle_app.py
-from flask import Flask, render_template, request, jsonify, session, url_for, redirect
+from flask import Flask, Response, render_template, request, jsonify, session, url_for, redirect, stream_with_context
+import functools
+import hmac
 import random
-from datetime import datetime
+from datetime import date, datetime
 from models import db, RecyclingItem, User, RecyclingRecord, Category
-from database_init import DatabaseInitializer
+from database_init import DatabaseInitializer, DEFAULT_USER_ID, DEFAULT_USERNAME
 from analytics import RecyclingAnalytics
+from timeseries import RecyclingTimeSeries
+from leaderboard import leaderboards, with_usernames
+from response_cache import cached_response
+from catalog_index import catalog_index, normalize_query, DEFAULT_LIMIT
+from coalesce import SingleFlight
+from matching import resolve_item
+from recycling import RecyclingService, MAX_BATCH_SIZE, next_level
+from cli import ecocycle_cli
+from pagination import keyset_page, MAX_PER_PAGE
+import cache
+import fragment_cache
+import instrumentation
+import live_stats
+import rate_limit
+import write_behind
+from export import export_records, parse_timestamp, EXPORT_FORMATS
+from config import CONFIGS
 import os
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///ecocycle.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config.from_object(CONFIGS[os.environ.get('ECOCYCLE_ENV', 'development')])
 
 # Initialize database
 db.init_app(app)
-
-# Default user ID for demo (in real app, use proper authentication)
-DEFAULT_USER_ID = 1
-
+instrumentation.init_app(app)
+fragment_cache.init_app(app)
+app.cli.add_command(ecocycle_cli)
 
 def initialize_database():
-    """Initialize database tables and data"""
+    """Create the schema and default data; same as ``flask ecocycle init-db``
+
+    Not run at import: workers start without schema work, and a deployment
+    initializes the database once before starting them.
+    """
     with app.app_context():
-        db.create_all()
-        DatabaseInitializer.init_data()
-
-        # Create default user if not exists
-        if not User.query.get(DEFAULT_USER_ID):
-            default_user = User(id=DEFAULT_USER_ID, username='demo_user')
-            db.session.add(default_user)
-            db.session.commit()
+        DatabaseInitializer.init_database()
         print("Database initialized successfully!")
 
 
-# Initialize database when app starts
-initialize_database()
-
-
 def get_current_user():
     """Get current user (simplified for demo)"""
-    return User.query.get(DEFAULT_USER_ID)
+    user = db.session.get(User, DEFAULT_USER_ID)
+    if user is None:
+        # The demo user can be missing from a freshly created database
+        user = User(id=DEFAULT_USER_ID, username=DEFAULT_USERNAME)
+        db.session.add(user)
+        db.session.commit()
+    return user
+
+
+def get_current_user_snapshot():
+    """Get a cached read-only snapshot of the current user"""
+    return cache.get_user(DEFAULT_USER_ID) or cache.UserSnapshot.from_model(get_current_user())
+
+
+def current_user_id():
+    """Key for responses that are private to the current user"""
+    return DEFAULT_USER_ID
 
 
 @app.route('/')
 def index():
-    user = get_current_user()
-    categories = Category.query.all()
+    user = get_current_user_snapshot()
+    categories = cache.get_categories()
     return render_template('ecocycle_index.html', user_data=user.to_dict(), categories=categories)
 
 
 @app.route('/recycle', methods=['POST'])
+@rate_limit.rate_limited('recycle')
 def recycle():
     item_name = request.form['item'].lower()
-    user = get_current_user()
 
-    recycling_item = RecyclingItem.query.filter_by(name=item_name).first()
+    if app.config['WRITE_BEHIND_ENABLED']:
+        return recycle_write_behind(item_name)
 
-    if recycling_item:
-        # Create recycling record
-        record = RecyclingRecord(
-            user_id=user.id,
-            item_name=item_name,
-            points_earned=recycling_item.points
-        )
-
-        # Update user points and level
-        user.points += recycling_item.points
-
-        # Check for level up
-        if user.points >= user.next_reward:
-            user.level += 1
-            user.next_reward = user.level * 50
+    user = get_current_user()
 
-        db.session.add(record)
-        db.session.commit()
+    recycling_item = resolve_item(item_name, cache.get_items(user.region_id))
 
-        # Convert tips from JSON string to list
-        import json
-        tips = json.loads(recycling_item.tips) if recycling_item.tips else []
+    if recycling_item:
+        RecyclingService.record_item(user, recycling_item)
 
         return render_template('ecocycle_results.html',
-                               item=item_name,
+                               item=recycling_item.name,
                                instruction=recycling_item.instruction,
                                points=recycling_item.points,
                                category=recycling_item.category,
-                               tips=tips,
+                               tips=recycling_item.tips,
+                               fragment_key=(recycling_item.name, user.region_id),
                                user_data=user.to_dict())
     else:
         return render_template('ecocycle_results.html',
@@ -93,53 +104,212 @@ def recycle():
                                points=0,
                                category="Unknown",
                                tips=["Try searching for similar items", "Contact your local waste management"],
+                               fragment_key=None,
+                               user_data=user.to_dict())
+
+
+def recycle_write_behind(item_name):
+    """Queue the event in the local outbox and answer without touching the database"""
+    event_key = request.headers.get('Idempotency-Key')
+    if event_key and len(event_key) > write_behind.MAX_EVENT_KEY_LENGTH:
+        limit = write_behind.MAX_EVENT_KEY_LENGTH
+        return jsonify({'error': f'Idempotency-Key must be at most {limit} characters'}), 400
+
+    user = get_current_user_snapshot()
+    recycling_item = resolve_item(item_name, cache.get_items(user.region_id))
+
+    if not recycling_item:
+        return render_template('ecocycle_results.html',
+                               item=item_name,
+                               instruction="We're not sure how to recycle this item. Please check with your local recycling facility.",
+                               points=0,
+                               category="Unknown",
+                               tips=["Try searching for similar items", "Contact your local waste management"],
+                               fragment_key=None,
                                user_data=user.to_dict())
 
+    write_behind.enqueue(app, user.id, recycling_item.name, event_key)
+
+    # Show the totals the user will have once the queue is drained
+    points = user.points + recycling_item.points
+    level, next_reward = next_level(points, user.level, user.next_reward)
+    return render_template('ecocycle_results.html',
+                           item=recycling_item.name,
+                           instruction=recycling_item.instruction,
+                           points=recycling_item.points,
+                           category=recycling_item.category,
+                           tips=recycling_item.tips,
+                           fragment_key=(recycling_item.name, user.region_id),
+                           user_data=user._replace(points=points, level=level, next_reward=next_reward).to_dict())
+
+
+@app.route('/api/recycle/batch', methods=['POST'])
+@rate_limit.rate_limited('recycle')
+def api_recycle_batch():
+    """API endpoint recording many recycled items in one transaction"""
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('items')
+
+    if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+        return jsonify({'error': "'items' must be a list of item names"}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} items per batch'}), 413
+
+    user = get_current_user()
+    results = RecyclingService.record_batch(user, items)
+
+    return jsonify({
+        'results': results,
+        'recorded': sum(1 for result in results if result['recognized']),
+        'points_awarded': sum(result['points'] for result in results),
+        'user_data': user.to_dict()
+    })
+
+
+search_flight = SingleFlight()
+
 
 @app.route('/api/search')
+@rate_limit.rate_limited('search')
 def api_search():
-    query = request.args.get('q', '').lower()
-    results = []
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
 
-    if query:
-        items = RecyclingItem.query.filter(RecyclingItem.name.contains(query)).all()
-        results = [{"item": item.name, "category": item.category} for item in items]
+    # Served from the in-memory catalog index, no SQL per keystroke;
+    # identical searches in flight at the same time share one lookup
+    results = search_flight.do((normalize_query(query), limit), catalog_index.search, query, limit=limit)
 
     return jsonify(results)
 
 
+@app.route('/api/cache/stats')
+def api_cache_stats():
+    """API endpoint exposing cache hit/miss counters and search coalescing"""
+    return jsonify(dict(cache.cache_stats(), search_flight=search_flight.stats()))
+
+
+@app.route('/metrics')
+def metrics():
+    """Request, SQL and cache metrics in Prometheus text format"""
+    return Response(instrumentation.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
 # New API endpoints for data collection and reporting
 @app.route('/api/user/stats')
+@cached_response(user_key=current_user_id)
 def api_user_stats():
     """API endpoint for user statistics"""
-    user = get_current_user()
+    user = get_current_user_snapshot()
     stats = RecyclingAnalytics.get_user_stats(user.id)
     return jsonify(stats)
 
 
 @app.route('/api/community/stats')
+@cached_response()
 def api_community_stats():
-    """API endpoint for community statistics"""
-    stats = RecyclingAnalytics.get_community_stats()
+    """API endpoint for community statistics, optionally for one ``region`` code"""
+    region_id = None
+    if request.args.get('region'):
+        region = cache.get_regions().get(request.args['region'])
+        if region is None:
+            return jsonify({'error': 'Unknown region'}), 404
+        region_id = region.id
+    stats = RecyclingAnalytics.get_community_stats(region_id)
     return jsonify(stats)
 
 
+@app.route('/api/community/stream')
+def api_community_stream():
+    """Server-Sent Events: a community stats snapshot, then one event per award"""
+    return live_stats.stream_response(app)
+
+
+@app.route('/api/stats/timeseries')
+def api_stats_timeseries():
+    """API endpoint for chart-ready recycling trends
+
+    ``scope`` is ``user`` (default) or ``community``; ``granularity`` is
+    day/week/month; ``by`` optionally splits by category (or item, for the
+    community); ``metric`` is items or points; ``start``/``end`` are dates.
+    """
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        user_id = None if request.args.get('scope') == 'community' else get_current_user_snapshot().id
+        series = RecyclingTimeSeries.get_series(
+            user_id=user_id,
+            granularity=request.args.get('granularity', 'day'),
+            start=date.fromisoformat(start) if start else None,
+            end=date.fromisoformat(end) if end else None,
+            by=request.args.get('by'),
+            metric=request.args.get('metric', 'items')
+        )
+    except (ValueError, OverflowError) as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    return jsonify(series)
+
+
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    """API endpoint for the top of the all-time, weekly or monthly leaderboard"""
+    period = request.args.get('period', 'all')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    try:
+        board = leaderboards.get(period)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    return jsonify({'period': period, 'entries': with_usernames(board.top(limit))})
+
+
+@app.route('/api/leaderboard/me')
+def api_leaderboard_me():
+    """API endpoint for the current user's rank and neighbors"""
+    period = request.args.get('period', 'all')
+    radius = max(0, min(request.args.get('radius', 2, type=int), 25))
+    try:
+        board = leaderboards.get(period)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    user = get_current_user_snapshot()
+    position = board.rank(user.id) or {'rank': None, 'points': 0}
+    return jsonify(dict(position, period=period, user_id=user.id,
+                        neighbors=with_usernames(board.around(user.id, radius))))
+
+
 @app.route('/api/recycling/records')
 def api_recycling_records():
-    """API endpoint for recycling records with pagination"""
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-
-    user = get_current_user()
-    records = RecyclingRecord.query.filter_by(user_id=user.id) \
-        .order_by(RecyclingRecord.recycled_at.desc()) \
+    """API endpoint for recycling records with pagination
+
+    Passing ``cursor`` (empty for the first page) switches to keyset
+    pagination: no COUNT(*) unless ``include_total=1`` and no OFFSET.
+    """
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', 10, type=int), MAX_PER_PAGE))
+
+    user = get_current_user_snapshot()
+    query = RecyclingRecord.query.filter_by(user_id=user.id)
+
+    if 'cursor' in request.args:
+        try:
+            rows, next_cursor = keyset_page(query, RecyclingRecord, request.args['cursor'], per_page)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+        result = {
+            'records': [serialize_record(record) for record in rows],
+            'next_cursor': next_cursor
+        }
+        if request.args.get('include_total', type=int):
+            result['total'] = query.count()
+        return jsonify(result)
+
+    records = query.order_by(RecyclingRecord.recycled_at.desc()) \
         .paginate(page=page, per_page=per_page, error_out=False)
 
-    records_data = [{
-        'item_name': record.item_name,
-        'points_earned': record.points_earned,
-        'recycled_at': record.recycled_at.isoformat()
-    } for record in records.items]
+    records_data = [serialize_record(record) for record in records.items]
 
     return jsonify({
         'records': records_data,
@@ -149,13 +319,63 @@ def api_recycling_records():
     })
 
 
+@app.route('/api/recycling/records/export')
+def api_recycling_records_export():
+    """Stream recycling records as CSV or NDJSON
+
+    Exports the current user's records; ``scope=all`` exports everyone's and
+    requires the ``X-Admin-Token`` header, optionally narrowed to one
+    ``region`` code. ``start``/``end`` filter on ``recycled_at`` (ISO dates,
+    end exclusive). ``archived=1`` also includes records compacted into the
+    retention archive.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+
+    try:
+        start = parse_timestamp(request.args.get('start'))
+        end = parse_timestamp(request.args.get('end'))
+    except ValueError:
+        return jsonify({'error': 'start and end must be ISO dates'}), 400
+
+    if request.args.get('scope') == 'all':
+        token = app.config.get('ADMIN_TOKEN')
+        if not token or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+            return jsonify({'error': 'Admin token required'}), 403
+        user_id = None
+    else:
+        user_id = get_current_user_snapshot().id
+
+    region_id = None
+    if request.args.get('region'):
+        region = cache.get_regions().get(request.args['region'])
+        if region is None:
+            return jsonify({'error': 'Unknown region'}), 404
+        region_id = region.id
+
+    chunks = export_records(fmt, archived=request.args.get('archived') == '1',
+                            user_id=user_id, start=start, end=end, region_id=region_id)
+    return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename=recycling_records.{fmt}'})
+
+
+def serialize_record(record):
+    return {
+        'item_name': record.item_name,
+        'points_earned': record.points_earned,
+        'recycled_at': record.recycled_at.isoformat()
+    }
+
+
 @app.route('/report')
+@cached_response(user_key=current_user_id)
 def report():
     """Reporting dashboard"""
-    user = get_current_user()
+    user = get_current_user_snapshot()
     user_stats = RecyclingAnalytics.get_user_stats(user.id)
-    community_stats = RecyclingAnalytics.get_community_stats()
     category_dist = RecyclingAnalytics.get_category_distribution(user.id)
+    weekly_trend = RecyclingTimeSeries.get_series(user_id=user.id, granularity='week')
 
     # 获取用户最近回收记录
     recent_records = RecyclingRecord.query.filter_by(user_id=user.id) \
@@ -165,8 +385,12 @@ def report():
     return render_template('ecocycle_report.html',
                            user_data=user.to_dict(),
                            user_stats=user_stats,
-                           community_stats=community_stats,
+                           region_id=user.region_id,
+                           # Only queried when the cached community block is stale
+                           load_community_stats=functools.partial(RecyclingAnalytics.get_community_stats,
+                                                                  user.region_id),
                            category_dist=category_dist,
+                           weekly_trend=weekly_trend,
                            recent_records=recent_records)
 
 
@@ -2,64 +2,14 @@ from flask import Flask, render_template, request, jsonify
 import random
 from datetime import datetime
 
+from catalog_loader import read_catalog
+
 app = Flask(__name__)
 
-# 扩展的回收物品数据库
+# 回收物品数据库，与主应用共用 data/catalog.json
 RECYCLING_GUIDE = {
-    "plastic bottle": {
-        "instruction": "Rinse and remove caps. Place in blue recycling bin.",
-        "points": 5,
-        "category": "Plastic",
-        "tips": ["Crush bottles to save space", "Remove labels if possible"]
-    },
-    "paper": {
-        "instruction": "Keep dry and clean. Place in blue recycling bin.",
-        "points": 3,
-        "category": "Paper",
-        "tips": ["Flatten cardboard boxes", "Remove any plastic wrapping"]
-    },
-    "cardboard": {
-        "instruction": "Flatten boxes. Place in blue recycling bin.",
-        "points": 4,
-        "category": "Paper",
-        "tips": ["Break down large boxes", "Remove packing tape"]
-    },
-    "glass bottle": {
-        "instruction": "Rinse thoroughly. Place in green glass recycling bin.",
-        "points": 6,
-        "category": "Glass",
-        "tips": ["Remove metal caps", "Don't break glass - it's harder to recycle"]
-    },
-    "aluminum can": {
-        "instruction": "Rinse and crush if possible. Place in blue recycling bin.",
-        "points": 8,
-        "category": "Metal",
-        "tips": ["Crushing saves space", "Check for local redemption value"]
-    },
-    "electronics": {
-        "instruction": "Take to designated e-waste recycling center. Do not place in regular bins.",
-        "points": 15,
-        "category": "E-Waste",
-        "tips": ["Remove batteries if possible", "Wipe personal data from devices"]
-    },
-    "battery": {
-        "instruction": "Take to special battery recycling drop-off location. Hazardous if disposed improperly.",
-        "points": 10,
-        "category": "Hazardous",
-        "tips": ["Tape terminals of lithium batteries", "Store in cool, dry place until recycling"]
-    },
-    "plastic bag": {
-        "instruction": "Take to grocery store recycling bin. Do not place in curbside recycling.",
-        "points": 2,
-        "category": "Plastic",
-        "tips": ["Reuse when possible", "Collect multiple bags together for recycling"]
-    },
-    "food waste": {
-        "instruction": "Compost if possible. Otherwise dispose in regular trash.",
-        "points": 0,
-        "category": "Organic",
-        "tips": ["Start a compost bin", "Use a countertop compost collector"]
-    }
+    item['name']: {key: item[key] for key in ('instruction', 'points', 'category', 'tips')}
+    for item in read_catalog()
 }
 
 # 用户数据模拟（在真实应用中会使用数据库）
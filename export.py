@@ -0,0 +1,81 @@
+import csv
+import io
+import itertools
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+
+from models import db, RecyclingRecord
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_COLUMNS = ('id', 'user_id', 'item_id', 'item_name', 'points_earned', 'recycled_at')
+CHUNK_SIZE = 1000
+
+
+def parse_timestamp(value):
+    """Parse an optional ISO date/datetime filter, raising ValueError if malformed"""
+    return datetime.fromisoformat(value) if value else None
+
+
+def iter_record_rows(user_id=None, start=None, end=None, region_id=None, chunk_size=CHUNK_SIZE):
+    """Stream matching records as plain row tuples, ``chunk_size`` at a time
+
+    Uses a server-side cursor where the driver supports one, so memory stays
+    flat no matter how many rows match.
+    """
+    table = RecyclingRecord.__table__
+    query = select(*(table.c[name] for name in EXPORT_COLUMNS)).order_by(table.c.id)
+    if user_id is not None:
+        query = query.where(table.c.user_id == user_id)
+    if region_id is not None:
+        query = query.where(table.c.region_id == region_id)
+    if start is not None:
+        query = query.where(table.c.recycled_at >= start)
+    if end is not None:
+        query = query.where(table.c.recycled_at < end)
+
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+    for partition in result.partitions():
+        yield partition
+
+
+def _format_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def iter_csv(partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in partitions:
+        writer.writerows([_format_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(partitions):
+    for rows in partitions:
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, map(_format_value, row))), separators=(',', ':')) + '\n'
+            for row in rows
+        )
+
+
+def export_records(fmt, archived=False, **filters):
+    """Yield text chunks of the export in ``fmt`` ('csv' or 'ndjson')
+
+    With ``archived``, records compacted into the retention archive come
+    first, followed by the live ones.
+    """
+    partitions = iter_record_rows(**filters)
+    if archived:
+        from retention import archive_root, iter_archived_rows
+        partitions = itertools.chain(iter_archived_rows(archive_root(), **filters), partitions)
+    return iter_csv(partitions) if fmt == 'csv' else iter_ndjson(partitions)
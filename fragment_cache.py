@@ -0,0 +1,127 @@
+"""Cached template fragments and a persistent Jinja bytecode cache.
+
+Templates wrap their data-driven blocks in a call block::
+
+    {% call cached_fragment('categories') %}...{% endcall %}
+
+The body renders once per name, key and version and is then served from a
+per-process LRU. ``source`` picks the version: ``catalog`` follows the
+catalog snapshot in cache.py, ``data`` the statistics version that
+response_cache bumps on every award. A ``key`` of None renders uncached.
+Entries also expire after ``FRAGMENT_CACHE_TTL`` seconds: both versions
+are per process unless the response cache uses its shared backend, and a
+worker that never sees an award must still refresh its community block.
+
+Compiled template bytecode goes to ``TEMPLATE_BYTECODE_DIR`` (by default
+under the instance folder), so restarted workers skip recompiling the
+large pages. The directory is created on the first compile, not when the
+app is imported.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+import cache
+import response_cache
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL = 30
+
+VERSION_SOURCES = {
+    'catalog': lambda: cache.catalog_cache.generation,
+    'data': lambda: response_cache.get_backend().version()[0],
+}
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered fragments with expiry and hit/miss counters"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        html = Markup(render())
+        with self._lock:
+            self._entries[key] = (now + self.ttl, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+def get_store(app=None):
+    """The fragment cache of ``app``, created on first use"""
+    app = app or current_app._get_current_object()
+    store = app.extensions.get('ecocycle_fragments')
+    if store is None:
+        store = FragmentCache(app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+                              app.config.get('FRAGMENT_CACHE_TTL', DEFAULT_TTL))
+        app.extensions['ecocycle_fragments'] = store
+    return store
+
+
+def cached_fragment(name, key=(), source='catalog', caller=None):
+    """Render the enclosing ``{% call %}`` body once per key and version"""
+    if key is None or not current_app.config['FRAGMENT_CACHE_ENABLED']:
+        return Markup(caller())
+    version = VERSION_SOURCES[source]()
+    return get_store().get_or_render((name, tuple(key), source, version), caller)
+
+
+class LazyBytecodeCache(FileSystemBytecodeCache):
+    """Bytecode cache that creates its directory on the first write
+
+    If the directory cannot be created, templates are compiled in memory
+    only.
+    """
+
+    def __init__(self, directory, logger):
+        super().__init__(directory)
+        self.logger = logger
+        self._writable = None
+
+    def dump_bytecode(self, bucket):
+        if self._writable is None:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self._writable = True
+            except OSError:
+                self.logger.warning('Template bytecode cache disabled: cannot create %s', self.directory)
+                self._writable = False
+        if self._writable:
+            super().dump_bytecode(bucket)
+
+
+def init_app(app):
+    """Register ``cached_fragment`` and the bytecode cache on ``app``"""
+    app.config.setdefault('FRAGMENT_CACHE_ENABLED', True)
+
+    app.add_template_global(cached_fragment)
+    directory = app.config.get('TEMPLATE_BYTECODE_DIR') or os.path.join(app.instance_path, 'jinja_bytecode')
+    app.jinja_env.bytecode_cache = LazyBytecodeCache(directory, app.logger)
@@ -0,0 +1,243 @@
+"""Per-request SQL, template and latency instrumentation.
+
+Every request collects its statement count, database time, template render
+time and slowest statements from SQLAlchemy engine events and Flask's
+template signals. The totals are sent back in a ``Server-Timing`` header,
+aggregated into process-wide counters and histograms rendered by
+``/metrics`` in Prometheus text format, and logged when the request takes
+longer than ``SLOW_REQUEST_MS``.
+
+Metrics are per process: with several gunicorn workers each one reports
+its own series, which Prometheus sums across scrape targets.
+"""
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import cache
+
+DEFAULT_SLOW_REQUEST_MS = 500
+SLOWEST_STATEMENTS = 3
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class RequestMetrics:
+    """What one request spent on SQL and templates"""
+
+    __slots__ = ('started', 'queries', 'db_time', 'template_time', 'slowest', '_render_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.slowest = []
+        self._render_started = []
+
+    def add_query(self, statement, duration):
+        self.queries += 1
+        self.db_time += duration
+        entry = (duration, self.queries, statement)
+        if len(self.slowest) < SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, entry)
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def slowest_statements(self):
+        """``(seconds, statement)`` pairs, slowest first"""
+        return [(duration, statement) for duration, _, statement in sorted(self.slowest, reverse=True)]
+
+    def server_timing(self, total):
+        return (f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries", '
+                f'tpl;dur={self.template_time * 1000:.2f}, '
+                f'total;dur={total * 1000:.2f}')
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels.items())
+
+
+class MetricsRegistry:
+    """Process-wide request counters and histograms keyed by endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.slow_requests = defaultdict(int)
+            self.durations = defaultdict(lambda: _Histogram(DURATION_BUCKETS))
+            self.queries = defaultdict(lambda: _Histogram(QUERY_BUCKETS))
+            self.db_seconds = defaultdict(float)
+            self.template_seconds = defaultdict(float)
+
+    def observe(self, endpoint, method, status, duration, metrics, slow):
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            if slow:
+                self.slow_requests[endpoint] += 1
+            self.durations[endpoint].observe(duration)
+            self.queries[endpoint].observe(metrics.queries)
+            self.db_seconds[endpoint] += metrics.db_time
+            self.template_seconds[endpoint] += metrics.template_time
+
+    @staticmethod
+    def _histogram_lines(name, histograms):
+        for endpoint, histogram in sorted(histograms.items()):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                yield f'{name}_bucket{{{_labels(endpoint=endpoint, le=bound)}}} {count}'
+            yield f'{name}_bucket{{{_labels(endpoint=endpoint, le="+Inf")}}} {histogram.count}'
+            yield f'{name}_sum{{{_labels(endpoint=endpoint)}}} {histogram.sum}'
+            yield f'{name}_count{{{_labels(endpoint=endpoint)}}} {histogram.count}'
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines += ['# HELP ecocycle_requests_total HTTP requests handled.',
+                      '# TYPE ecocycle_requests_total counter']
+            lines += [f'ecocycle_requests_total{{{_labels(endpoint=endpoint, method=method, status=status)}}} {count}'
+                      for (endpoint, method, status), count in sorted(self.requests.items())]
+
+            lines += ['# HELP ecocycle_slow_requests_total Requests slower than the slow request threshold.',
+                      '# TYPE ecocycle_slow_requests_total counter']
+            lines += [f'ecocycle_slow_requests_total{{{_labels(endpoint=endpoint)}}} {count}'
+                      for endpoint, count in sorted(self.slow_requests.items())]
+
+            lines += ['# HELP ecocycle_request_duration_seconds Request latency.',
+                      '# TYPE ecocycle_request_duration_seconds histogram']
+            lines += self._histogram_lines('ecocycle_request_duration_seconds', self.durations)
+
+            lines += ['# HELP ecocycle_request_queries SQL statements issued per request.',
+                      '# TYPE ecocycle_request_queries histogram']
+            lines += self._histogram_lines('ecocycle_request_queries', self.queries)
+
+            lines += ['# HELP ecocycle_db_seconds_total Time spent executing SQL.',
+                      '# TYPE ecocycle_db_seconds_total counter']
+            lines += [f'ecocycle_db_seconds_total{{{_labels(endpoint=endpoint)}}} {seconds}'
+                      for endpoint, seconds in sorted(self.db_seconds.items())]
+
+            lines += ['# HELP ecocycle_template_seconds_total Time spent rendering templates.',
+                      '# TYPE ecocycle_template_seconds_total counter']
+            lines += [f'ecocycle_template_seconds_total{{{_labels(endpoint=endpoint)}}} {seconds}'
+                      for endpoint, seconds in sorted(self.template_seconds.items())]
+
+        stats = cache.cache_stats()
+        for field in ('hits', 'misses'):
+            lines += [f'# HELP ecocycle_cache_{field}_total In-process cache {field}.',
+                      f'# TYPE ecocycle_cache_{field}_total counter']
+            lines += [f'ecocycle_cache_{field}_total{{{_labels(cache=name)}}} {values[field]}'
+                      for name, values in sorted(stats.items())]
+        lines += ['# HELP ecocycle_cache_entries Entries held by each in-process cache.',
+                  '# TYPE ecocycle_cache_entries gauge']
+        lines += [f'ecocycle_cache_entries{{{_labels(cache=name)}}} {values["size"]}'
+                  for name, values in sorted(stats.items())]
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def current_metrics():
+    """The running request's metrics, or None outside an instrumented request"""
+    return g.get('_ecocycle_metrics') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('ecocycle_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    started = connection.info['ecocycle_query_started'].pop()
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add_query(statement, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _discard_failed_query(exception_context):
+    started = exception_context.connection is not None and \
+        exception_context.connection.info.get('ecocycle_query_started')
+    if started:
+        started.pop()
+
+
+def _template_started(sender, template, context, **extra):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics._render_started.append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    metrics = current_metrics()
+    if metrics is not None and metrics._render_started:
+        metrics.template_time += time.perf_counter() - metrics._render_started.pop()
+
+
+def init_app(app):
+    """Instrument every request handled by ``app``"""
+    app.config.setdefault('SLOW_REQUEST_MS', DEFAULT_SLOW_REQUEST_MS)
+    app.config.setdefault('SERVER_TIMING_ENABLED', True)
+
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.before_request
+    def _start_metrics():
+        g._ecocycle_metrics = RequestMetrics()
+
+    @app.after_request
+    def _add_server_timing(response):
+        metrics = current_metrics()
+        if metrics is not None:
+            g._ecocycle_status = response.status_code
+            if app.config['SERVER_TIMING_ENABLED']:
+                response.headers['Server-Timing'] = metrics.server_timing(time.perf_counter() - metrics.started)
+        return response
+
+    @app.teardown_request
+    def _record_metrics(exc):
+        metrics = g.pop('_ecocycle_metrics', None)
+        if metrics is None:
+            return
+        duration = time.perf_counter() - metrics.started
+        status = 500 if exc is not None else g.pop('_ecocycle_status', 500)
+        endpoint = request.endpoint or 'unmatched'
+        slow = duration * 1000 >= app.config['SLOW_REQUEST_MS']
+        registry.observe(endpoint, request.method, status, duration, metrics, slow)
+
+        if slow:
+            slowest = '; '.join(f'{seconds * 1000:.1f} ms {" ".join(statement.split())[:200]}'
+                                for seconds, statement in metrics.slowest_statements())
+            app.logger.warning('Slow request %s %s: %.1f ms, %d queries (%.1f ms DB), %.1f ms templates. '
+                               'Slowest statements: %s', request.method, request.full_path.rstrip('?'),
+                               duration * 1000, metrics.queries, metrics.db_time * 1000,
+                               metrics.template_time * 1000, slowest or 'none')
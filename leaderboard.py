@@ -0,0 +1,174 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from coalesce import SingleFlight
+from models import db, User, UserDailyCount
+from recycling import points_awarded
+from timeseries import next_period, period_start
+
+PERIODS = ('all', 'week', 'month')
+REFRESH_SECONDS = 60
+
+
+class Leaderboard:
+    """Users ranked by points in a sorted list of ``(-points, user_id)`` keys
+
+    Rank lookups are a bisect; updates move one key. Ties share a rank
+    (standard competition ranking: 1, 2, 2, 4).
+    """
+
+    def __init__(self, scores=()):
+        self._lock = threading.Lock()
+        self._points = dict(scores)
+        self._keys = sorted((-points, user_id) for user_id, points in self._points.items())
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def set_points(self, user_id, points):
+        with self._lock:
+            old = self._points.get(user_id)
+            if old == points:
+                return
+            if old is not None:
+                del self._keys[bisect_left(self._keys, (-old, user_id))]
+            self._points[user_id] = points
+            insort(self._keys, (-points, user_id))
+
+    def add_points(self, user_id, points):
+        with self._lock:
+            total = self._points.get(user_id, 0) + points
+        self.set_points(user_id, total)
+
+    def _rank_of(self, points):
+        # Users ahead of this score, plus one
+        return bisect_left(self._keys, (-points,)) + 1
+
+    def _entries(self, keys):
+        return [{'rank': self._rank_of(-negative_points), 'user_id': user_id, 'points': -negative_points}
+                for negative_points, user_id in keys]
+
+    def top(self, n):
+        with self._lock:
+            return self._entries(self._keys[:n])
+
+    def rank(self, user_id):
+        """The user's rank and points, or None if the user is not on the board"""
+        with self._lock:
+            points = self._points.get(user_id)
+            return None if points is None else {'rank': self._rank_of(points), 'points': points}
+
+    def around(self, user_id, radius=2):
+        """Entries from ``radius`` places above the user to ``radius`` below"""
+        with self._lock:
+            points = self._points.get(user_id)
+            if points is None:
+                return []
+            position = bisect_left(self._keys, (-points, user_id))
+            return self._entries(self._keys[max(0, position - radius):position + radius + 1])
+
+
+def period_bounds(period, today):
+    """Inclusive first and last day of the current week or month"""
+    start = period_start(today, period)
+    return start, next_period(start, period) - timedelta(days=1)
+
+
+def _load_scores(period, today):
+    if period == 'all':
+        return [(user_id, points or 0) for user_id, points in db.session.query(User.id, User.points)]
+    start, end = period_bounds(period, today)
+    return db.session.query(UserDailyCount.user_id, func.sum(UserDailyCount.points)) \
+        .filter(UserDailyCount.day >= start, UserDailyCount.day <= end) \
+        .group_by(UserDailyCount.user_id).all()
+
+
+class LeaderboardRegistry:
+    """Process-wide leaderboards for all time and the current week/month
+
+    Boards are built from ``users.points`` (all time) or the per-day rollup
+    buckets (periods), kept current by this process's ``points_awarded``
+    signals, and rebuilt every ``refresh_seconds`` to pick up awards made by
+    other workers. Concurrent requests finding a board stale share one
+    rebuild, and awards recorded while it loads are applied to the new board.
+    """
+
+    def __init__(self, refresh_seconds=REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._boards = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._rebuild_flight = SingleFlight()
+
+    @staticmethod
+    def _key(period, today):
+        return period, None if period == 'all' else period_start(today, period)
+
+    def get(self, period='all', today=None):
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+        today = today or datetime.utcnow().date()
+        key = self._key(period, today)
+        board = self._boards.get(key)
+        if board is None or time.monotonic() - board.built_at > self.refresh_seconds:
+            board = self._rebuild_flight.do(key, self._rebuild, key, today)
+        return board
+
+    def _rebuild(self, key, today):
+        with self._lock:
+            self._pending[key] = []
+        try:
+            board = Leaderboard(_load_scores(key[0], today))
+        except BaseException:
+            with self._lock:
+                self._pending.pop(key, None)
+            raise
+        with self._lock:
+            # A period award committed just as the load started can be
+            # counted twice here; the next rebuild corrects it
+            for award in self._pending.pop(key):
+                self._apply(key, board, award)
+            # Drop boards for periods that have ended
+            self._boards = {k: v for k, v in self._boards.items() if k == self._key(k[0], today)}
+            self._boards[key] = board
+        return board
+
+    def invalidate(self):
+        with self._lock:
+            self._boards = {}
+
+    @staticmethod
+    def _apply(key, board, award):
+        period, start = key
+        if period == 'all':
+            board.set_points(award['user_id'], award['points'])
+        elif period_start(award['recycled_at'].date(), period) == start:
+            board.add_points(award['user_id'], award['awarded'])
+
+    def record_awards(self, awards):
+        with self._lock:
+            for award in awards:
+                for key, board in self._boards.items():
+                    self._apply(key, board, award)
+                for pending in self._pending.values():
+                    pending.append(award)
+
+
+leaderboards = LeaderboardRegistry()
+
+
+@points_awarded.connect
+def _update_leaderboards(sender, awards):
+    leaderboards.record_awards(awards)
+
+
+def with_usernames(entries):
+    """Attach usernames to leaderboard entries with a single IN query"""
+    names = dict(db.session.query(User.id, User.username)
+                 .filter(User.id.in_([entry['user_id'] for entry in entries])).all()) if entries else {}
+    return [dict(entry, username=names.get(entry['user_id'])) for entry in entries]
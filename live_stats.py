@@ -0,0 +1,326 @@
+"""Server-Sent Events stream of live community stats.
+
+Every committed award (the ``points_awarded`` signal) is published on a bus
+as a small JSON message. A process with stream subscribers keeps the
+community totals and top recyclers in memory, seeded from
+RecyclingAnalytics when its first subscriber connects, applies each
+message to them and fans one ``award`` event out to all its subscribers.
+Subscriber buffers are bounded: a client that falls behind has its backlog
+replaced by a single ``snapshot`` event of the current state, so a slow
+reader never holds memory or delays the others.
+
+Two buses are available through ``LIVE_STATS_BUS``:
+
+* ``local`` (default): delivery within the process, right for one worker.
+* ``unix``: Unix datagram sockets in ``LIVE_STATS_BUS_DIR``, a stand-in for
+  a pub/sub server that reaches every worker on the host. Only workers
+  with subscribers bind a socket, so publishing costs a directory listing
+  when nobody is watching.
+
+Idle streams cost nothing but a periodic keep-alive comment: nothing is
+polled or recomputed until an award happens. Each Flask stream holds a
+worker thread, so serve many of them from threaded workers or asgi.py.
+"""
+import contextlib
+import json
+import logging
+import os
+import socket
+import threading
+from collections import deque
+
+from flask import Response, current_app, has_app_context
+
+from analytics import RecyclingAnalytics
+from coalesce import SingleFlight
+from recycling import points_awarded
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 64
+DEFAULT_KEEPALIVE = 15
+TOP_COUNT = 5
+# Keeps each datagram well below the default socket buffer size
+AWARDS_PER_MESSAGE = 200
+STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def format_event(event, data, event_id=None):
+    """One SSE event"""
+    lines = [] if event_id is None else [f'id: {event_id}']
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscriber:
+    """One stream client: a bounded event buffer and a wake-up callback
+
+    ``notify`` is called whenever events are added; by default it wakes a
+    thread blocked in :meth:`wait`.
+    """
+
+    def __init__(self, max_events, notify=None):
+        self.max_events = max_events
+        self.events = deque()
+        self.dropped = 0
+        self._wakeup = threading.Event()
+        self.notify = notify or self._wakeup.set
+
+    def push(self, event, snapshot):
+        if len(self.events) >= self.max_events:
+            # The client can no longer apply deltas in order; resend the state
+            self.dropped += len(self.events)
+            self.events.clear()
+            event = snapshot()
+        self.events.append(event)
+        self.notify()
+
+    def drain(self):
+        self._wakeup.clear()
+        events = []
+        while True:
+            try:
+                events.append(self.events.popleft())
+            except IndexError:
+                return events
+
+    def wait(self, timeout):
+        """Block until events arrive or ``timeout`` passes, then drain"""
+        self._wakeup.wait(timeout)
+        return self.drain()
+
+
+class LiveStatsHub:
+    """Per-process fan-out of award events to stream subscribers
+
+    The in-memory state only exists while somebody is subscribed.
+    ``on_active``/``on_idle`` run when the first subscriber arrives and the
+    last one leaves, so a bus can start and stop listening.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.on_active = None
+        self.on_idle = None
+        self._subscribers = set()
+        self._state = None
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._load_flight = SingleFlight()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, load_stats, notify=None):
+        """Add a subscriber whose first event is a snapshot
+
+        ``load_stats`` returns community stats in the shape of
+        RecyclingAnalytics.get_community_stats; it only runs while the hub
+        is idle, outside the lock so awards keep flowing to existing
+        subscribers, and once for subscribers arriving together.
+        """
+        stats = None
+        while True:
+            with self._lock:
+                if self._state is None and stats is not None:
+                    self._state = {
+                        'total_users': stats['total_users'],
+                        'total_recycled_items': stats['total_recycled_items'],
+                        'total_points_earned': stats['total_points_earned'],
+                        'top_recyclers': list(stats['top_recyclers']),
+                    }
+                if self._state is not None:
+                    subscriber = Subscriber(self.buffer_size, notify)
+                    subscriber.push(self._snapshot(), self._snapshot)
+                    first = not self._subscribers
+                    self._subscribers.add(subscriber)
+                    break
+            stats = self._load_flight.do('stats', load_stats)
+        if first and self.on_active:
+            self.on_active()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber not in self._subscribers:
+                return
+            self._subscribers.discard(subscriber)
+            idle = not self._subscribers
+            if idle:
+                self._state = None
+        if idle and self.on_idle:
+            self.on_idle()
+
+    def receive(self, awards):
+        """Apply published awards and fan the resulting events out"""
+        with self._lock:
+            if self._state is None:
+                return
+            for award in awards:
+                event = self._apply(award)
+                for subscriber in self._subscribers:
+                    subscriber.push(event, self._snapshot)
+
+    def _snapshot(self):
+        return format_event('snapshot', self._state, self._sequence)
+
+    def _apply(self, award):
+        state = self._state
+        state['total_recycled_items'] += award['items']
+        state['total_points_earned'] += award['awarded']
+
+        # Points only grow, so a top list updated from the awards stays exact
+        top = state['top_recyclers']
+        before = [(entry['username'], entry['points']) for entry in top]
+        top = [entry for entry in top if entry['username'] != award['username']]
+        top.append({'username': award['username'], 'points': award['points']})
+        top.sort(key=lambda entry: -entry['points'])
+        state['top_recyclers'] = top = top[:TOP_COUNT]
+
+        data = {
+            'user': {key: award[key] for key in ('username', 'points', 'level')},
+            'delta': {'items': award['items'], 'points': award['awarded']},
+            'totals': {key: state[key] for key in ('total_recycled_items', 'total_points_earned')},
+        }
+        if [(entry['username'], entry['points']) for entry in top] != before:
+            data['leaderboard'] = top
+        self._sequence += 1
+        return format_event('award', data, self._sequence)
+
+
+class LocalBus:
+    """Delivers awards to this process's hub only"""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, awards):
+        self.hub.receive(awards)
+
+
+class UnixSocketBus:
+    """Delivers awards to the hub of every process sharing ``directory``
+
+    A process binds a datagram socket in the directory while its hub has
+    subscribers. Publishing never blocks: a full receiver loses the message
+    and a socket left behind by a dead worker is removed.
+    """
+
+    def __init__(self, hub, directory):
+        self.hub = hub
+        self.directory = directory
+        self.path = os.path.join(directory, f'{os.getpid()}-{id(self):x}.sock')
+        self._socket = None
+        self._thread = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        hub.on_active = self.start
+        hub.on_idle = self.stop
+
+    def publish(self, awards):
+        targets = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                   if name.endswith('.sock')]
+        if not targets:
+            return
+        payloads = [json.dumps(awards[start:start + AWARDS_PER_MESSAGE]).encode()
+                    for start in range(0, len(awards), AWARDS_PER_MESSAGE)]
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.setblocking(False)
+            for target in targets:
+                for payload in payloads:
+                    try:
+                        sender.sendto(payload, target)
+                    except (ConnectionRefusedError, FileNotFoundError):
+                        with contextlib.suppress(OSError):
+                            os.unlink(target)
+                        break
+                    except OSError as exc:
+                        logger.warning('Live stats message to %s dropped: %s', target, exc)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            listener.bind(self.path)
+            self._socket = listener
+            self._thread = threading.Thread(target=self._listen, args=(listener,),
+                                            name='ecocycle-live-stats', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if self._thread is None:
+                return
+            thread, listener = self._thread, self._socket
+            self._thread = self._socket = None
+            # An empty datagram wakes the listener so it can exit
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as waker:
+                with contextlib.suppress(OSError):
+                    waker.sendto(b'', self.path)
+            with contextlib.suppress(OSError):
+                os.unlink(self.path)
+            thread.join(timeout=5)
+            listener.close()
+
+    def _listen(self, listener):
+        while True:
+            payload = listener.recv(1 << 20)
+            if not payload:
+                return
+            try:
+                self.hub.receive(json.loads(payload))
+            except Exception:
+                logger.exception('Bad live stats message')
+
+
+def get_hub(app=None):
+    """The live stats hub of ``app``, with its bus, created on first use"""
+    app = app or current_app._get_current_object()
+    hub = app.extensions.get('ecocycle_live_stats')
+    if hub is None:
+        hub = LiveStatsHub(app.config.get('LIVE_STATS_BUFFER', DEFAULT_BUFFER_SIZE))
+        if app.config.get('LIVE_STATS_BUS', 'local') == 'unix':
+            directory = app.config.get('LIVE_STATS_BUS_DIR') or os.path.join(app.instance_path, 'live_stats')
+            hub.bus = UnixSocketBus(hub, directory)
+        else:
+            hub.bus = LocalBus(hub)
+        app.extensions['ecocycle_live_stats'] = hub
+    return hub
+
+
+def subscribe(app, notify=None):
+    """Subscribe to ``app``'s hub, seeding it from the database if idle"""
+    def load_stats():
+        with app.app_context():
+            return RecyclingAnalytics.get_community_stats()
+
+    return get_hub(app).subscribe(load_stats, notify)
+
+
+def stream_response(app):
+    """Flask response streaming events until the client disconnects"""
+    hub = get_hub(app)
+    subscriber = subscribe(app)
+    keepalive = app.config.get('LIVE_STATS_KEEPALIVE', DEFAULT_KEEPALIVE)
+
+    def generate():
+        try:
+            while True:
+                events = subscriber.wait(keepalive)
+                # A comment line keeps proxies from closing an idle stream
+                yield ''.join(events) if events else ': keepalive\n\n'
+        finally:
+            hub.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers=STREAM_HEADERS)
+
+
+@points_awarded.connect
+def _publish_awards(sender, awards):
+    if has_app_context():
+        get_hub().bus.publish([
+            {key: award[key] for key in ('username', 'points', 'level', 'awarded', 'items')}
+            for award in awards
+        ])
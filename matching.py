@@ -0,0 +1,262 @@
+"""Fuzzy resolution of free-text item names against the recycling catalog.
+
+Names and aliases are normalized (accents, punctuation, regional spellings,
+plurals) into match keys. Exact key hits are a dictionary lookup; anything
+else goes through a symmetric deletion index over the catalog's words, so a
+misspelling within ``MAX_DISTANCE`` edits is found by probing a few dozen
+precomputed deletes per word and intersecting the keys that use them,
+instead of scanning the catalog.
+"""
+import json
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import namedtuple
+
+from sqlalchemy import event
+
+from models import db, RecyclingItem
+
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+MIN_CONFIDENCE = 0.75
+
+# Word-level spellings folded onto the catalog's vocabulary
+SYNONYMS = {
+    'aluminium': 'aluminum',
+    'alu': 'aluminum',
+    'tyre': 'tire',
+    'colour': 'color',
+    'grey': 'gray',
+}
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+class Match(namedtuple('Match', 'item confidence matched distance')):
+    """Best catalog match: canonical item name, 0..1 confidence, and the
+    name or alias key it was found through"""
+    __slots__ = ()
+
+
+def singularize(word):
+    """Strip common English plural endings"""
+    if len(word) <= 3 or word.endswith(('ss', 'us', 'is')):
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith(('sses', 'ches', 'shes', 'xes', 'zes')):
+        return word[:-2]
+    if word.endswith('s'):
+        return word[:-1]
+    return word
+
+
+def match_key(text):
+    """Normalized, synonym-folded, singularized form of a name"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    words = _NON_ALNUM.sub(' ', text).split()
+    return ' '.join(singularize(SYNONYMS.get(word, word)) for word in words)
+
+
+def max_distance_for(key):
+    """Edits tolerated for a query key; short words get less slack"""
+    if len(key) <= 3:
+        return 0
+    if len(key) <= 5:
+        return 1
+    return MAX_DISTANCE
+
+
+def deletes(word, max_distance):
+    """``word`` plus every string reachable by deleting up to ``max_distance`` characters"""
+    found = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {variant[:position] + variant[position + 1:]
+                    for variant in frontier for position in range(len(variant))}
+        found |= frontier
+    return found
+
+
+def bounded_distance(a, b, max_distance):
+    """Optimal string alignment distance, or None once it exceeds ``max_distance``"""
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                value = min(value, before_previous[j - 2] + 1)
+            current[j] = value
+        if min(current) > max_distance:
+            return None
+        before_previous, previous = previous, current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+class _Snapshot:
+    """Match keys plus a word-level deletion index for one catalog version"""
+
+    def __init__(self, items):
+        # Names are added before any alias, so on equal distance the lower
+        # key id (a real item name) wins.
+        entries = [(name, name) for name, _ in items]
+        entries += [(alias, name) for name, aliases in items for alias in aliases]
+
+        self.keys = []
+        self.items = []
+        self.exact = {}
+        for text, name in entries:
+            key = match_key(text)
+            if key and key not in self.exact:
+                self.exact[key] = len(self.keys)
+                self.keys.append(key)
+                self.items.append(name)
+
+        # Keys are found through their words: every distinct word's prefix
+        # deletes point at the word, and every word at the keys using it.
+        self.postings = {}
+        for key_id, key in enumerate(self.keys):
+            for word in set(key.split(' ')):
+                self.postings.setdefault(word, array('I')).append(key_id)
+        self.words = list(self.postings)
+        self.deletes = {}
+        for word_id, word in enumerate(self.words):
+            for variant in deletes(word[:PREFIX_LENGTH], MAX_DISTANCE):
+                self.deletes.setdefault(variant, array('I')).append(word_id)
+
+    def _near_words(self, word, max_distance):
+        """Catalog words sharing a prefix delete with ``word``
+
+        This over-approximates the words within ``max_distance`` edits; the
+        whole key is verified once the candidates have been intersected.
+        """
+        if not max_distance:
+            return [word] if word in self.postings else []
+        word_ids = set()
+        for variant in deletes(word[:PREFIX_LENGTH], max_distance):
+            word_ids.update(self.deletes.get(variant, ()))
+        return [self.words[word_id] for word_id in word_ids
+                if abs(len(self.words[word_id]) - len(word)) <= max_distance]
+
+    def match(self, key):
+        key_id = self.exact.get(key)
+        if key_id is not None:
+            return Match(self.items[key_id], 1.0, self.keys[key_id], 0)
+
+        max_distance = max_distance_for(key)
+        if not max_distance:
+            return None
+
+        # Only keys with a near match for every query word are verified.
+        # The rarest word seeds the candidates; the others just filter them.
+        near = []
+        for word in set(key.split(' ')):
+            words = self._near_words(word, max(1, min(max_distance, max_distance_for(word))))
+            if not words:
+                return None
+            near.append((sum(len(self.postings[near_word]) for near_word in words), words))
+        near.sort(key=lambda entry: entry[0])
+
+        candidates = set()
+        for near_word in near[0][1]:
+            candidates.update(self.postings[near_word])
+        for _, words in near[1:]:
+            words = set(words)
+            candidates = [key_id for key_id in candidates if not words.isdisjoint(self.keys[key_id].split(' '))]
+
+        best = None
+        for key_id in candidates:
+            distance = bounded_distance(key, self.keys[key_id], max_distance)
+            if distance is not None and (best is None or (distance, key_id) < best):
+                best = (distance, key_id)
+        if best is None:
+            return None
+
+        distance, key_id = best
+        matched = self.keys[key_id]
+        confidence = round(1 - distance / max(len(key), len(matched)), 3)
+        return Match(self.items[key_id], confidence, matched, distance)
+
+
+class ItemMatcher:
+    """Process-local fuzzy matcher over catalog names and aliases
+
+    Built lazily from the database and rebuilt after invalidation or once
+    older than ``max_age`` seconds, like the autocomplete index.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._stale = True
+        self._invalidations = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Mark the matcher as out of date; the next lookup rebuilds it"""
+        with self._lock:
+            self._stale = True
+            self._invalidations += 1
+
+    def rebuild(self, items=None):
+        """Rebuild from ``(name, aliases)`` pairs or from the database"""
+        invalidations = self._invalidations
+        if items is None:
+            items = [(name, json.loads(aliases) if aliases else [])
+                     for name, aliases in db.session.query(RecyclingItem.name, RecyclingItem.aliases)]
+        snapshot = _Snapshot(items)
+        with self._lock:
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+            # Stays stale if the catalog changed while the items were being read
+            self._stale = self._invalidations != invalidations
+        return snapshot
+
+    def _current(self):
+        snapshot = self._snapshot
+        expired = self.max_age is not None and time.monotonic() - self._loaded_at > self.max_age
+        if snapshot is None or self._stale or expired:
+            snapshot = self.rebuild()
+        return snapshot
+
+    def match(self, text, min_confidence=0.0):
+        """Best :class:`Match` for ``text``, or None below ``min_confidence``"""
+        key = match_key(text)
+        if not key:
+            return None
+        found = self._current().match(key)
+        if found is None or found.confidence < min_confidence:
+            return None
+        return found
+
+    def __len__(self):
+        return len(self._current().keys)
+
+
+item_matcher = ItemMatcher()
+
+
+def resolve_item(name, catalog):
+    """Catalog snapshot for a submitted name, falling back to a confident fuzzy match"""
+    item = catalog.get(name)
+    if item is None:
+        found = item_matcher.match(name, MIN_CONFIDENCE)
+        if found is not None:
+            item = catalog.get(found.item)
+    return item
+
+
+@event.listens_for(RecyclingItem, 'after_insert')
+@event.listens_for(RecyclingItem, 'after_update')
+@event.listens_for(RecyclingItem, 'after_delete')
+def _invalidate_on_catalog_change(mapper, connection, target):
+    item_matcher.invalidate()
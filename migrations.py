@@ -0,0 +1,128 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import inspect, insert, select, text
+
+from database_init import RECYCLING_ITEMS
+from rollups import ROLLUP_MODELS, RecyclingRollups
+from models import (db, SchemaMigration, Region, RegionItemOverride, RegionItemTotals,
+                    RegionCategoryCount, RecordSummary, RecordArchive)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register an idempotent schema upgrade step"""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+
+@migration(1, 'Add recycling_records.item_id and backfill it from item_name')
+def add_record_item_id(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('recycling_records')}
+    if 'item_id' not in columns:
+        connection.execute(text(
+            'ALTER TABLE recycling_records ADD COLUMN item_id INTEGER REFERENCES recycling_items (id)'
+        ))
+
+    connection.execute(text(
+        'UPDATE recycling_records SET item_id = ('
+        'SELECT recycling_items.id FROM recycling_items '
+        'WHERE recycling_items.name = recycling_records.item_name'
+        ') WHERE item_id IS NULL'
+    ))
+
+
+def create_indexes(connection, table, indexes):
+    """Create ``(name, columns)`` indexes as they were defined at one schema version
+
+    Spelled out per migration rather than read from the models, whose
+    indexes may cover columns that only a later migration adds.
+    """
+    for name, columns in indexes:
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+
+@migration(2, 'Add covering indexes for recycling_records analytics')
+def add_record_indexes(connection):
+    create_indexes(connection, 'recycling_records', (
+        ('ix_recycling_records_user_recycled_at', ('user_id', 'recycled_at')),
+        ('ix_recycling_records_user_item', ('user_id', 'item_id', 'points_earned')),
+        ('ix_recycling_records_item', ('item_id', 'points_earned')),
+        ('ix_recycling_records_recycled_at', ('recycled_at',)),
+    ))
+
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('ANALYZE recycling_records'))
+
+
+@migration(3, 'Index users.points for the leaderboard')
+def add_user_points_index(connection):
+    create_indexes(connection, 'users', (('ix_users_points', ('points',)),))
+
+
+@migration(4, 'Add recycling_items.aliases and fill in the default catalog aliases')
+def add_item_aliases(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('recycling_items')}
+    if 'aliases' not in columns:
+        connection.execute(text('ALTER TABLE recycling_items ADD COLUMN aliases TEXT'))
+
+    connection.execute(
+        text('UPDATE recycling_items SET aliases = :aliases WHERE name = :name AND aliases IS NULL'),
+        [{'name': item['name'], 'aliases': json.dumps(item.get('aliases', []))} for item in RECYCLING_ITEMS]
+    )
+
+
+@migration(5, 'Add regions, per-region overrides and rollups, and region_id on users and records')
+def add_regions(connection):
+    for model in (Region, RegionItemOverride, RegionItemTotals, RegionCategoryCount):
+        model.__table__.create(connection, checkfirst=True)
+
+    for table in ('users', 'recycling_records'):
+        columns = {column['name'] for column in inspect(connection).get_columns(table)}
+        if 'region_id' not in columns:
+            connection.execute(text(f'ALTER TABLE {table} ADD COLUMN region_id INTEGER REFERENCES regions (id)'))
+
+    create_indexes(connection, 'users', (('ix_users_region_points', ('region_id', 'points')),))
+    create_indexes(connection, 'recycling_records', (
+        ('ix_recycling_records_region_recycled_at', ('region_id', 'recycled_at')),
+    ))
+
+
+@migration(6, 'Add record_summaries and record_archives for record retention')
+def add_record_retention(connection):
+    for model in (RecordSummary, RecordArchive):
+        model.__table__.create(connection, checkfirst=True)
+
+
+@migration(7, 'Backfill the statistics rollups from existing records')
+def backfill_rollups(connection):
+    for model in ROLLUP_MODELS:
+        model.__table__.create(connection, checkfirst=True)
+    RecyclingRollups.rebuild(connection)
+
+
+def run_migrations():
+    """Apply pending migrations in version order, one transaction each
+
+    Returns the list of versions that were applied.
+    """
+    table = SchemaMigration.__table__
+    with db.engine.begin() as connection:
+        table.create(connection, checkfirst=True)
+        applied = set(connection.execute(select(table.c.version)).scalars())
+
+    newly_applied = []
+    for version, description, upgrade in sorted(MIGRATIONS, key=lambda entry: entry[0]):
+        if version in applied:
+            continue
+        with db.engine.begin() as connection:
+            upgrade(connection)
+            connection.execute(insert(table).values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+        newly_applied.append(version)
+
+    return newly_applied
@@ -1,7 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 
-db = SQLAlchemy()
+from db_routing import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class RecyclingItem(db.Model):
@@ -13,6 +15,7 @@ class RecyclingItem(db.Model):
     points = db.Column(db.Integer, nullable=False)
     category = db.Column(db.String(50), nullable=False)
     tips = db.Column(db.Text)  # Store as JSON string
+    aliases = db.Column(db.Text)  # JSON list of alternative names
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
@@ -31,11 +34,17 @@ class User(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    points = db.Column(db.Integer, default=0)
+    points = db.Column(db.Integer, default=0, index=True)
     level = db.Column(db.Integer, default=1)
     next_reward = db.Column(db.Integer, default=50)
+    region_id = db.Column(db.Integer, db.ForeignKey('regions.id'))  # None: base catalog only
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Per-region leaderboards
+        db.Index('ix_users_region_points', 'region_id', 'points'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -51,13 +60,79 @@ class RecyclingRecord(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('recycling_items.id'))
     item_name = db.Column(db.String(100), nullable=False)
     points_earned = db.Column(db.Integer, nullable=False)
     recycled_at = db.Column(db.DateTime, default=datetime.utcnow)
+    region_id = db.Column(db.Integer, db.ForeignKey('regions.id'))
 
     # Define relationship
     user = db.relationship('User', backref=db.backref('records', lazy=True))
 
+    # Kept in sync with migrations.py, which adds them to existing databases
+    __table_args__ = (
+        # Serves per-user history ordered by time (keyset pagination, recent records)
+        db.Index('ix_recycling_records_user_recycled_at', 'user_id', 'recycled_at'),
+        # Covering indexes for the per-user and per-item aggregates
+        db.Index('ix_recycling_records_user_item', 'user_id', 'item_id', 'points_earned'),
+        db.Index('ix_recycling_records_item', 'item_id', 'points_earned'),
+        db.Index('ix_recycling_records_recycled_at', 'recycled_at'),
+        # Keeps a region's scans (exports, rebuilds) inside its own slice
+        db.Index('ix_recycling_records_region_recycled_at', 'region_id', 'recycled_at'),
+    )
+
+
+# Records compacted by retention.py: additive per-user per-day per-item totals,
+# with the raw rows moved to the archive files listed in record_archives.
+# A key can appear in several rows when its records were compacted in different batches.
+class RecordSummary(db.Model):
+    __tablename__ = 'record_summaries'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('recycling_items.id'))
+    item_name = db.Column(db.String(100), nullable=False)
+    region_id = db.Column(db.Integer, db.ForeignKey('regions.id'))
+    items = db.Column(db.Integer, nullable=False)
+    points = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_record_summaries_user_day', 'user_id', 'day'),
+    )
+
+
+class RecordArchive(db.Model):
+    """A gzip NDJSON file of compacted records, relative to the archive directory"""
+    __tablename__ = 'record_archives'
+
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(255), unique=True, nullable=False)
+    rows = db.Column(db.Integer, nullable=False)
+    first_record_id = db.Column(db.Integer, nullable=False)
+    last_record_id = db.Column(db.Integer, nullable=False)
+    min_user_id = db.Column(db.Integer, nullable=False)
+    max_user_id = db.Column(db.Integer, nullable=False)
+    first_recycled_at = db.Column(db.DateTime, nullable=False, index=True)
+    last_recycled_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# Idempotency keys of write-behind events already applied (see write_behind.py)
+class ProcessedEvent(db.Model):
+    __tablename__ = 'processed_events'
+
+    event_key = db.Column(db.String(64), primary_key=True)
+    processed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 
 class Category(db.Model):
     __tablename__ = 'categories'
@@ -72,4 +147,131 @@ class Category(db.Model):
             'name': self.name,
             'color': self.color,
             'description': self.description
-        }
\ No newline at end of file
+        }
+
+class Region(db.Model):
+    """A municipality whose catalog overrides the shared base catalog"""
+    __tablename__ = 'regions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(50), unique=True, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+
+    def to_dict(self):
+        return {'code': self.code, 'name': self.name}
+
+
+class RegionItemOverride(db.Model):
+    """Per-region changes to a base catalog item; NULL fields keep the base value"""
+    __tablename__ = 'region_item_overrides'
+
+    region_id = db.Column(db.Integer, db.ForeignKey('regions.id'), primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('recycling_items.id'), primary_key=True)
+    instruction = db.Column(db.Text)
+    points = db.Column(db.Integer)
+    tips = db.Column(db.Text)  # Store as JSON string
+    accepted = db.Column(db.Boolean, nullable=False, default=True)  # False: not collected in this region
+
+
+# Materialized rollups maintained incrementally by the recycle write path
+# (see rollups.py); they can always be rebuilt from recycling_records.
+class UserTotals(db.Model):
+    __tablename__ = 'user_totals'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    total_items = db.Column(db.Integer, nullable=False, default=0)
+    total_points = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+
+class UserItemCount(db.Model):
+    __tablename__ = 'user_item_counts'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('recycling_items.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_user_item_counts_user_count', 'user_id', 'count'),
+    )
+
+
+class ItemTotals(db.Model):
+    __tablename__ = 'item_totals'
+
+    item_id = db.Column(db.Integer, db.ForeignKey('recycling_items.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    points = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserCategoryCount(db.Model):
+    __tablename__ = 'user_category_counts'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CategoryCount(db.Model):
+    __tablename__ = 'category_counts'
+
+    category = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserDailyCount(db.Model):
+    __tablename__ = 'user_daily_counts'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    items = db.Column(db.Integer, nullable=False, default=0)
+    points = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserCategoryDailyCount(db.Model):
+    __tablename__ = 'user_category_daily_counts'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    items = db.Column(db.Integer, nullable=False, default=0)
+    points = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ItemDailyCount(db.Model):
+    __tablename__ = 'item_daily_counts'
+
+    item_id = db.Column(db.Integer, db.ForeignKey('recycling_items.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    items = db.Column(db.Integer, nullable=False, default=0)
+    points = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CategoryDailyCount(db.Model):
+    __tablename__ = 'category_daily_counts'
+
+    category = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    items = db.Column(db.Integer, nullable=False, default=0)
+    points = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Region-scoped rollups, so a municipality's dashboard reads only its own rows
+class RegionItemTotals(db.Model):
+    __tablename__ = 'region_item_totals'
+
+    region_id = db.Column(db.Integer, db.ForeignKey('regions.id'), primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('recycling_items.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    points = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_region_item_totals_region_count', 'region_id', 'count'),
+    )
+
+
+class RegionCategoryCount(db.Model):
+    __tablename__ = 'region_category_counts'
+
+    region_id = db.Column(db.Integer, db.ForeignKey('regions.id'), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,57 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+MAX_PER_PAGE = 100
+
+
+def encode_cursor(recycled_at, record_id):
+    """Encode a ``(recycled_at, id)`` position as an opaque URL-safe token"""
+    payload = json.dumps([recycled_at.isoformat(), record_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor token, raising ValueError if it was tampered with"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        recycled_at, record_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(recycled_at), int(record_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as exc:
+        raise ValueError('Invalid cursor') from exc
+
+
+def keyset_filter(query, model, cursor, per_page):
+    """Restrict ``query`` to the page after ``cursor``, newest first
+
+    Works on ORM queries and Core ``select()`` statements alike; fetch the
+    rows and pass them to :func:`split_page`.
+    """
+    if cursor:
+        recycled_at, record_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            model.recycled_at < recycled_at,
+            and_(model.recycled_at == recycled_at, model.id < record_id)
+        ))
+    return query.order_by(model.recycled_at.desc(), model.id.desc()).limit(per_page + 1)
+
+
+def split_page(rows, per_page):
+    """Trim the look-ahead row and return ``(rows, next_cursor)``"""
+    if len(rows) <= per_page:
+        return rows, None
+
+    rows = rows[:per_page]
+    return rows, encode_cursor(rows[-1].recycled_at, rows[-1].id)
+
+
+def keyset_page(query, model, cursor, per_page):
+    """Fetch the page after ``cursor`` ordered newest first
+
+    Seeks on ``(recycled_at, id)`` instead of using OFFSET, so every page
+    costs the same index range scan no matter how deep the client is.
+    Returns ``(rows, next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    return split_page(keyset_filter(query, model, cursor, per_page).all(), per_page)
@@ -0,0 +1,173 @@
+"""Per-client token bucket rate limiting for the search and recycle endpoints.
+
+Each client (by remote address) has one bucket per limit name in the
+``RATE_LIMITS`` setting (defaults in config.py), holding up to ``burst``
+tokens and refilled at ``rate`` tokens per second. A request takes one
+token; without one it gets a 429 with ``Retry-After``. Every response of a limited view carries
+``X-RateLimit-Limit``, ``X-RateLimit-Remaining`` and ``X-RateLimit-Reset``
+(seconds until the bucket is full again). Behind a reverse proxy, wrap
+the WSGI app in werkzeug's ProxyFix so the address is the client's.
+
+Two backends are available through ``RATE_LIMIT_BACKEND``:
+
+* ``memory`` (default): per-process buckets, right for a single worker.
+* ``sqlite``: buckets in a file shared by every gunicorn worker on the host
+  (``RATE_LIMIT_PATH``), so a client's limit does not grow with the number
+  of workers.
+"""
+import functools
+import itertools
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app, jsonify, request
+
+DEFAULT_MAX_KEYS = 100000
+# The SQLite backend drops buckets that have refilled every this many takes
+PRUNE_INTERVAL = 1000
+
+Decision = namedtuple('Decision', 'allowed limit remaining retry_after reset_after')
+
+
+def refill(tokens, updated_at, now, rate, burst, cost=1):
+    """Apply a take to a bucket: ``(decision, tokens_left)``"""
+    tokens = min(burst, tokens + (now - updated_at) * rate)
+    allowed = tokens >= cost
+    if allowed:
+        tokens -= cost
+    retry_after = 0.0 if allowed else (cost - tokens) / rate
+    return Decision(allowed, burst, int(tokens), retry_after, (burst - tokens) / rate), tokens
+
+
+class MemoryBackend:
+    """Per-process buckets; the least recently used are forgotten past ``max_keys``"""
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            decision, tokens = refill(tokens, updated_at, now, rate, burst)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # A forgotten bucket comes back full, which only errs towards allowing
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return decision
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBackend:
+    """Buckets shared through a local SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # next() on a count is atomic, unlike += on an int shared by threads
+        self._takes = itertools.count(1)
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets ('
+                               'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, '
+                               'full_at REAL NOT NULL)')
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, rate, burst, now=None):
+        now = time.time() if now is None else now
+        connection = self._connect()
+        # IMMEDIATE takes the write lock up front so concurrent takes serialize
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+            decision, tokens = refill(*(row or (burst, now)), now, rate, burst)
+            connection.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)',
+                               (key, tokens, now, now + decision.reset_after))
+            if next(self._takes) % PRUNE_INTERVAL == 0:
+                connection.execute('DELETE FROM buckets WHERE full_at < ?', (now,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return decision
+
+    def clear(self):
+        self._connect().execute('DELETE FROM buckets')
+
+
+def get_backend(app=None):
+    """The rate limit backend configured for ``app``, created on first use"""
+    app = app or current_app._get_current_object()
+    backend = app.extensions.get('ecocycle_rate_limit')
+    if backend is None:
+        if app.config.get('RATE_LIMIT_BACKEND', 'memory') == 'sqlite':
+            path = app.config.get('RATE_LIMIT_PATH') or os.path.join(app.instance_path, 'rate_limits.db')
+            backend = SQLiteBackend(path)
+        else:
+            backend = MemoryBackend(app.config.get('RATE_LIMIT_MAX_KEYS', DEFAULT_MAX_KEYS))
+        app.extensions['ecocycle_rate_limit'] = backend
+    return backend
+
+
+def limit_headers(decision):
+    """Response headers telling a client where it stands and when to retry"""
+    headers = {
+        'X-RateLimit-Limit': str(decision.limit),
+        'X-RateLimit-Remaining': str(decision.remaining),
+        'X-RateLimit-Reset': str(math.ceil(decision.reset_after)),
+    }
+    if not decision.allowed:
+        headers['Retry-After'] = str(math.ceil(decision.retry_after))
+    return headers
+
+
+def check(app, name, client):
+    """Take a token from ``client``'s ``name`` bucket; None when limiting is off"""
+    if not app.config.get('RATE_LIMIT_ENABLED', True):
+        return None
+    rate, burst = app.config['RATE_LIMITS'][name]
+    return get_backend(app).take(f'{name}:{client}', rate, burst)
+
+
+def limited_body(decision):
+    return {'error': 'Too many requests', 'retry_after': math.ceil(decision.retry_after)}
+
+
+def rate_limited(name):
+    """Apply the ``name`` limit from ``RATE_LIMITS`` to a view, per client address"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            app = current_app._get_current_object()
+            decision = check(app, name, request.remote_addr)
+            if decision is None:
+                return view(*args, **kwargs)
+            if decision.allowed:
+                response = app.make_response(view(*args, **kwargs))
+            else:
+                response = jsonify(limited_body(decision))
+                response.status_code = 429
+            response.headers.update(limit_headers(decision))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,272 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+from blinker import Namespace
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from cache import get_items, invalidate_user
+from db_engine import retry_on_locked
+from matching import resolve_item
+from models import db, User, RecyclingRecord, ProcessedEvent
+from rollups import RecyclingRollups
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 1000
+
+_signals = Namespace()
+
+# Sent after every committed award with ``awards``: one dict per user with
+# user_id, username, points, level, next_reward, awarded, items, recycled_at
+points_awarded = _signals.signal('points-awarded')
+
+
+def next_level(points, level, next_reward):
+    """Apply the level-up rule after an award, returning ``(level, next_reward)``"""
+    if points >= next_reward:
+        level += 1
+        return level, level * 50
+    return level, next_reward
+
+
+def _user_state(statement, user_id):
+    """Execute an UPDATE on users and return the row's new points/level/next_reward"""
+    users = User.__table__
+    state_columns = (users.c.points, users.c.level, users.c.next_reward)
+
+    if db.session.get_bind().dialect.update_returning:
+        return db.session.execute(statement.returning(*state_columns)).one()
+
+    # The UPDATE holds the row lock, so this read sees exactly our write
+    db.session.execute(statement)
+    return db.session.execute(select(*state_columns).where(users.c.id == user_id)).one()
+
+
+def _award_summary(user, awarded, items, recycled_at):
+    # Built before commit: the ORM user is expired (and would reload) afterwards
+    return {
+        'user_id': user.id,
+        'username': user.username,
+        'points': user.points,
+        'level': user.level,
+        'next_reward': user.next_reward,
+        'awarded': awarded,
+        'items': items,
+        'recycled_at': recycled_at
+    }
+
+
+def _sync_user(user, points, level, next_reward):
+    """Copy database-side values onto the ORM user without dirtying it
+
+    Core UPDATEs skip the User mapper events, so the cached snapshot is
+    dropped here instead.
+    """
+    set_committed_value(user, 'points', points)
+    set_committed_value(user, 'level', level)
+    set_committed_value(user, 'next_reward', next_reward)
+    invalidate_user(user)
+
+
+class RecyclingService:
+    """Write path shared by the single-item and batch recycle endpoints
+
+    Points and levels are changed with UPDATE statements evaluated by the
+    database, never read-modify-write in Python, so concurrent submissions
+    from several gunicorn workers cannot lose updates or skip level-ups.
+    """
+
+    @staticmethod
+    def award_points(user, points):
+        """Atomically add points to a user and apply at most one level-up"""
+        users = User.__table__
+        new_points = users.c.points + points
+        levels_up = new_points >= users.c.next_reward
+
+        statement = update(users).where(users.c.id == user.id).values(
+            points=new_points,
+            level=case((levels_up, users.c.level + 1), else_=users.c.level),
+            next_reward=case((levels_up, (users.c.level + 1) * 50), else_=users.c.next_reward)
+        )
+        _sync_user(user, *_user_state(statement, user.id))
+
+    @staticmethod
+    def award_points_sequence(user, awards):
+        """Apply several awards in order, returning a level-up flag per award
+
+        The first UPDATE adds the total and takes the user's row (SQLite:
+        database) write lock, so replaying the per-item level rule from the
+        returned values and writing the result cannot race another writer.
+        """
+        users = User.__table__
+        total = sum(awards)
+        statement = update(users).where(users.c.id == user.id).values(points=users.c.points + total)
+        points, stored_level, stored_next_reward = _user_state(statement, user.id)
+
+        level, next_reward = stored_level, stored_next_reward
+        running_points = points - total
+        level_ups = []
+        for award in awards:
+            running_points += award
+            previous_level = level
+            level, next_reward = next_level(running_points, level, next_reward)
+            level_ups.append(level > previous_level)
+
+        if (level, next_reward) != (stored_level, stored_next_reward):
+            db.session.execute(update(users).where(users.c.id == user.id)
+                               .values(level=level, next_reward=next_reward))
+        _sync_user(user, points, level, next_reward)
+        return level_ups
+
+    @staticmethod
+    @retry_on_locked
+    def record_item(user, recycling_item):
+        """Record one recycled item and commit"""
+        recycled_at = datetime.utcnow()
+        record = RecyclingRecord(
+            user_id=user.id,
+            item_id=recycling_item.id,
+            item_name=recycling_item.name,
+            points_earned=recycling_item.points,
+            recycled_at=recycled_at,
+            region_id=user.region_id
+        )
+
+        # Update the user first so the write lock is taken up front
+        RecyclingService.award_points(user, recycling_item.points)
+
+        db.session.add(record)
+        RecyclingRollups.record(user.id, recycling_item, recycling_item.points, recycled_at, user.region_id)
+        awards = [_award_summary(user, recycling_item.points, 1, recycled_at)]
+        db.session.commit()
+
+        points_awarded.send(RecyclingService, awards=awards)
+        return record
+
+    @staticmethod
+    @retry_on_locked
+    def record_batch(user, item_names):
+        """Record many items with one bulk insert and one commit
+
+        Items are resolved against the user's cached regional catalog,
+        falling back to fuzzy matching for misspelled or aliased names.
+        Returns a result dict per submitted name, in submission order.
+        """
+        names = [name.strip().lower() for name in item_names]
+        catalog = get_items(user.region_id)
+
+        resolved = [resolve_item(name, catalog) for name in names]
+
+        recycled_at = datetime.utcnow()
+        recognized = [item for item in resolved if item is not None]
+        level_ups = iter(RecyclingService.award_points_sequence(user, [item.points for item in recognized])
+                         if recognized else [])
+
+        results = []
+        for name, item in zip(names, resolved):
+            if item is None:
+                results.append({'item': name, 'recognized': False, 'points': 0, 'category': 'Unknown'})
+            else:
+                results.append({
+                    'item': name,
+                    'matched': item.name,
+                    'recognized': True,
+                    'points': item.points,
+                    'category': item.category,
+                    'level_up': next(level_ups)
+                })
+
+        if recognized:
+            db.session.execute(insert(RecyclingRecord), [{
+                'user_id': user.id,
+                'item_id': item.id,
+                'item_name': item.name,
+                'points_earned': item.points,
+                'recycled_at': recycled_at,
+                'region_id': user.region_id
+            } for item in recognized])
+            RecyclingRollups.record_many([
+                (user.id, item.id, item.category, item.points, recycled_at, user.region_id) for item in recognized
+            ])
+            awards = [_award_summary(user, sum(item.points for item in recognized), len(recognized), recycled_at)]
+        else:
+            awards = []
+        db.session.commit()
+
+        if awards:
+            points_awarded.send(RecyclingService, awards=awards)
+        return results
+
+    @staticmethod
+    @retry_on_locked
+    def record_events(events):
+        """Apply queued recycling events exactly once and commit
+
+        ``events`` are dicts with ``event_key``, ``user_id``, ``item_name``
+        and ``recycled_at``. Keys are inserted into processed_events in the
+        same transaction as the awards, so replaying events after a crash,
+        or two drainers racing, never awards points twice. Events for an
+        unknown user or item are logged and dropped without using up their
+        key. Returns the number of events applied.
+        """
+        unique = {event['event_key']: event for event in events}
+        done = set(db.session.execute(
+            select(ProcessedEvent.event_key).where(ProcessedEvent.event_key.in_(list(unique)))
+        ).scalars())
+
+        by_user = defaultdict(list)
+        for key, event in unique.items():
+            if key not in done:
+                by_user[event['user_id']].append(event)
+
+        applicable = []
+        for user_id, user_events in by_user.items():
+            user = db.session.get(User, user_id)
+            catalog = get_items(user.region_id) if user is not None else {}
+            entries = []
+            for event in user_events:
+                if event['item_name'] in catalog:
+                    entries.append((event, catalog[event['item_name']]))
+                else:
+                    logger.warning('Dropping queued recycling event %s: unknown %s', event['event_key'],
+                                   f'user {user_id}' if user is None else f"item {event['item_name']!r}")
+            if entries:
+                applicable.append((user, entries))
+        if not applicable:
+            return 0
+
+        # Claim the keys first: a concurrent drainer fails here and retries
+        processed_at = datetime.utcnow()
+        db.session.execute(insert(ProcessedEvent), [
+            {'event_key': event['event_key'], 'processed_at': processed_at}
+            for _, entries in applicable for event, _ in entries
+        ])
+
+        rows = []
+        rollup_events = []
+        awards = []
+        for user, entries in applicable:
+            user_id = user.id
+            RecyclingService.award_points_sequence(user, [item.points for _, item in entries])
+            awards.append(_award_summary(user, sum(item.points for _, item in entries), len(entries),
+                                         max(event['recycled_at'] for event, _ in entries)))
+            for event, item in entries:
+                rows.append({
+                    'user_id': user_id,
+                    'item_id': item.id,
+                    'item_name': item.name,
+                    'points_earned': item.points,
+                    'recycled_at': event['recycled_at'],
+                    'region_id': user.region_id
+                })
+                rollup_events.append((user_id, item.id, item.category, item.points, event['recycled_at'],
+                                      user.region_id))
+
+        db.session.execute(insert(RecyclingRecord), rows)
+        RecyclingRollups.record_many(rollup_events)
+        db.session.commit()
+
+        points_awarded.send(RecyclingService, awards=awards)
+        return len(rows)
@@ -0,0 +1,256 @@
+"""Versioned HTTP response cache for the stats and report endpoints.
+
+Cached responses are keyed by endpoint, user and query string, and tagged
+with a global data version that the recycle write path bumps (via the
+``points_awarded`` signal) whenever statistics change. Responses carry an
+ETag derived from the key and version, plus Last-Modified, so clients
+polling an unchanged dashboard get a 304 without the view running at all.
+Views run with their reads on the primary: a lagging replica would
+otherwise store pre-award statistics under the version the award bumped.
+
+Two backends are available through ``RESPONSE_CACHE_BACKEND``:
+
+* ``memory`` (default): a per-process LRU, right for a single worker. Its
+  version starts from a random per-process epoch, so two workers (or a
+  restarted one) never hand out the same ETag for different data, and it
+  rolls over every ``RESPONSE_CACHE_TTL`` seconds, bounding how long a
+  worker that did not handle an award serves the old statistics.
+* ``sqlite``: a file shared by every gunicorn worker on the host
+  (``RESPONSE_CACHE_PATH``), so one worker's bump invalidates all of them.
+
+The async routes in asgi.py use the same backend, keys and ETags through
+:func:`cache_key`, :func:`make_etag`, :func:`is_not_modified` and
+:func:`cache_headers`.
+"""
+import functools
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import Response, current_app, has_app_context, request
+from werkzeug.http import parse_date, parse_etags
+
+from db_routing import use_primary
+from recycling import points_awarded
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MEMORY_TTL = 10
+
+
+class CachedResponse:
+    __slots__ = ('version', 'body', 'mimetype')
+
+    def __init__(self, version, body, mimetype):
+        self.version = version
+        self.body = body
+        self.mimetype = mimetype
+
+
+class LRUBackend:
+    """In-process LRU of rendered responses plus a local data version
+
+    Versions are ``'<epoch>.<counter>'`` strings; a ``ttl`` (seconds, None
+    for never) bumps the version once it is that old.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_MEMORY_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._epoch = secrets.token_hex(4)
+        self._counter = 1
+        self._entries = OrderedDict()
+        self._version = (f'{self._epoch}.1', time.time())
+        self._lock = threading.Lock()
+
+    def version(self):
+        """``(version, updated_at epoch seconds)``"""
+        if self.ttl and time.time() - self._version[1] >= self.ttl:
+            self.bump_version()
+        return self._version
+
+    def bump_version(self):
+        with self._lock:
+            self._counter += 1
+            self._version = (f'{self._epoch}.{self._counter}', time.time())
+            self._entries.clear()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """Response cache and data version shared through a local SQLite file"""
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS data_version ('
+                               'id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL, '
+                               'updated_at REAL NOT NULL)')
+            connection.execute('INSERT OR IGNORE INTO data_version VALUES (1, 1, ?)', (time.time(),))
+            connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                               'key TEXT PRIMARY KEY, version INTEGER NOT NULL, '
+                               'mimetype TEXT NOT NULL, body BLOB NOT NULL, used_at REAL NOT NULL)')
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def version(self):
+        return self._connect().execute('SELECT version, updated_at FROM data_version').fetchone()
+
+    def bump_version(self):
+        with self._connect() as connection:
+            connection.execute('UPDATE data_version SET version = version + 1, updated_at = ?', (time.time(),))
+            connection.execute('DELETE FROM responses WHERE version < (SELECT version FROM data_version)')
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT version, body, mimetype FROM responses WHERE key = ?', (key,)
+        ).fetchone()
+        return CachedResponse(*row) if row else None
+
+    def set(self, key, entry):
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                               (key, entry.version, entry.mimetype, entry.body, time.time()))
+            connection.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses '
+                               'ORDER BY used_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM responses')
+
+
+def get_backend(app=None):
+    """The response cache backend configured for ``app``, created on first use"""
+    app = app or current_app._get_current_object()
+    backend = app.extensions.get('ecocycle_response_cache')
+    if backend is None:
+        max_entries = app.config.get('RESPONSE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+        if app.config.get('RESPONSE_CACHE_BACKEND', 'memory') == 'sqlite':
+            path = app.config.get('RESPONSE_CACHE_PATH') or os.path.join(app.instance_path, 'response_cache.db')
+            backend = SQLiteBackend(path, max_entries)
+        else:
+            backend = LRUBackend(max_entries, app.config.get('RESPONSE_CACHE_TTL', DEFAULT_MEMORY_TTL))
+            if int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+                app.logger.warning('Response cache is per worker; set ECOCYCLE_RESPONSE_CACHE=sqlite to share '
+                                   'invalidations between the %s workers', os.environ['WEB_CONCURRENCY'])
+        app.extensions['ecocycle_response_cache'] = backend
+    return backend
+
+
+def bump_data_version(app=None):
+    """Invalidate every cached response after statistics changed"""
+    get_backend(app).bump_version()
+
+
+@points_awarded.connect
+def _bump_on_award(sender, awards):
+    if has_app_context():
+        bump_data_version()
+
+
+def cache_key(endpoint, owner, query_string):
+    return f'{endpoint}:{owner}:{query_string}'
+
+
+def make_etag(key, version):
+    return hashlib.sha1(f'{key}:{version}'.encode()).hexdigest()[:20]
+
+
+def cache_headers(etag, updated_at, private):
+    """ETag, Last-Modified and Cache-Control of a cached response, for non-Flask servers"""
+    response = _cache_headers(Response(), etag, updated_at, private)
+    return {name: response.headers[name] for name in ('ETag', 'Last-Modified', 'Cache-Control')}
+
+
+def is_not_modified(headers, etag, updated_at):
+    """Whether a request with these headers already holds the ``etag`` response
+
+    Same rules as werkzeug's ``make_conditional``: If-None-Match wins over
+    If-Modified-Since.
+    """
+    if headers.get('If-None-Match'):
+        return parse_etags(headers['If-None-Match']).contains_weak(etag)
+    since = parse_date(headers.get('If-Modified-Since'))
+    return since is not None and int(updated_at) <= since.timestamp()
+
+
+def _cache_headers(response, etag, updated_at, private):
+    response.set_etag(etag)
+    response.last_modified = datetime.fromtimestamp(updated_at, timezone.utc)
+    # Clients may keep a copy but must revalidate it on every use
+    response.cache_control.no_cache = True
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    return response
+
+
+def cached_response(user_key=None):
+    """Serve a view from the response cache with ETag/304 support
+
+    ``user_key`` returns the id a response is private to; leave it out for
+    responses shared by every user.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            backend = get_backend()
+            version, updated_at = backend.version()
+            owner = user_key() if user_key else ''
+            key = cache_key(request.endpoint, owner, request.query_string.decode())
+            etag = make_etag(key, version)
+            private = user_key is not None
+
+            # Conditional requests for an unchanged version skip the view entirely
+            probe = _cache_headers(Response(status=200), etag, updated_at, private)
+            probe.make_conditional(request)
+            if probe.status_code == 304:
+                return probe
+
+            entry = backend.get(key)
+            if entry is not None and entry.version == version:
+                response = Response(entry.body, mimetype=entry.mimetype)
+            else:
+                with use_primary():
+                    response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                backend.set(key, CachedResponse(version, response.get_data(), response.mimetype))
+
+            return _cache_headers(response, etag, updated_at, private)
+        return wrapper
+    return decorator
@@ -0,0 +1,190 @@
+"""Retention for ``recycling_records``: daily summaries plus archive files.
+
+Records older than the retention window are compacted in bounded batches.
+Each batch reads up to ``batch_size`` of the oldest expired records,
+writes them to a gzip NDJSON file under the archive directory (fsynced
+before anything is deleted), then in one short transaction deletes them,
+adds their per-user per-day per-item totals to ``record_summaries`` and
+registers the file in ``record_archives``. A crash between the two steps
+leaves an unregistered file, which the next run removes; its records are
+still in the table and are archived again.
+
+The rollup tables already count compacted records and are left alone, and
+RecyclingRollups.rebuild reads the summaries alongside the raw table, so
+``User.points`` and every analytics result stay the same. Compacted rows
+remain queryable through :func:`iter_archived_rows` (``flask ecocycle
+export-records --archived``).
+"""
+import contextlib
+import fcntl
+import gzip
+import json
+import os
+import tempfile
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, insert, select
+
+from export import EXPORT_COLUMNS, _format_value
+from models import db, RecordArchive, RecordSummary, RecyclingRecord
+
+ARCHIVE_COLUMNS = EXPORT_COLUMNS + ('region_id',)
+ARCHIVE_SUFFIX = '.ndjson.gz'
+LOCK_FILE = '.compaction.lock'
+DEFAULT_RETENTION_DAYS = 365
+DEFAULT_BATCH_SIZE = 5000
+
+
+def archive_root(app=None):
+    """The archive directory: RECORD_ARCHIVE_DIR or instance/archive"""
+    app = app or current_app
+    return app.config.get('RECORD_ARCHIVE_DIR') or os.path.join(app.instance_path, 'archive')
+
+
+def retention_cutoff(days, now=None):
+    """Midnight ``days`` days ago; records before it are expired"""
+    today = (now or datetime.utcnow()).date()
+    return datetime.combine(today - timedelta(days=days), time())
+
+
+@contextlib.contextmanager
+def compaction_lock(root, blocking=False):
+    """Exclusive lock on ``root`` for one compaction (or snapshot) at a time
+
+    Raises BlockingIOError when ``blocking`` is False and the lock is held.
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, LOCK_FILE), 'w') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def remove_orphans(root):
+    """Delete archive files no ``record_archives`` row refers to"""
+    registered = set(db.session.scalars(select(RecordArchive.path)))
+    removed = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.relpath(os.path.join(directory, name), root)
+            if (name.endswith(ARCHIVE_SUFFIX) or name.startswith('.tmp')) and path not in registered:
+                os.unlink(os.path.join(root, path))
+                removed += 1
+    return removed
+
+
+def _write_archive(root, rows):
+    """Durably write ``rows`` to a new archive file, returning its relative path"""
+    first, last = rows[0], rows[-1]
+    path = os.path.join(first.recycled_at.strftime('%Y-%m'),
+                        f'records-{first.id:012d}-{last.id:012d}{ARCHIVE_SUFFIX}')
+    directory = os.path.join(root, os.path.dirname(path))
+    os.makedirs(directory, exist_ok=True)
+
+    handle, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+    with os.fdopen(handle, 'wb') as raw, gzip.open(raw, 'wt') as archive:
+        for row in rows:
+            archive.write(json.dumps(dict(zip(ARCHIVE_COLUMNS, map(_format_value, row))),
+                                     separators=(',', ':')) + '\n')
+        archive.flush()
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, os.path.join(root, path))
+    return path
+
+
+def compact_batch(cutoff, root, batch_size=DEFAULT_BATCH_SIZE):
+    """Compact up to ``batch_size`` records older than ``cutoff``; returns the count"""
+    table = RecyclingRecord.__table__
+    expired = table.c.recycled_at < cutoff
+    rows = db.session.execute(
+        select(*(table.c[name] for name in ARCHIVE_COLUMNS)).where(expired).order_by(table.c.id).limit(batch_size)
+    ).all()
+    # End the read before the slow file write so it never blocks writers
+    db.session.commit()
+    if not rows:
+        return 0
+
+    path = _write_archive(root, rows)
+
+    summaries = defaultdict(lambda: [0, 0])
+    for row in rows:
+        totals = summaries[(row.user_id, row.recycled_at.date(), row.item_id, row.item_name, row.region_id)]
+        totals[0] += 1
+        totals[1] += row.points_earned
+
+    # Records are never updated and new ones get higher ids, so this range
+    # holds exactly the rows that were archived
+    deleted = db.session.execute(
+        delete(table).where(expired, table.c.id >= rows[0].id, table.c.id <= rows[-1].id)
+    ).rowcount
+    if deleted != len(rows):
+        db.session.rollback()
+        raise RuntimeError(f'Expected to compact {len(rows)} records but matched {deleted}')
+    db.session.execute(insert(RecordSummary.__table__), [
+        {'user_id': user_id, 'day': day, 'item_id': item_id, 'item_name': item_name, 'region_id': region_id,
+         'items': items, 'points': points}
+        for (user_id, day, item_id, item_name, region_id), (items, points) in summaries.items()
+    ])
+    user_ids = [row.user_id for row in rows]
+    db.session.add(RecordArchive(
+        path=path, rows=len(rows),
+        first_record_id=rows[0].id, last_record_id=rows[-1].id,
+        min_user_id=min(user_ids), max_user_id=max(user_ids),
+        first_recycled_at=min(row.recycled_at for row in rows),
+        last_recycled_at=max(row.recycled_at for row in rows),
+    ))
+    db.session.commit()
+    return len(rows)
+
+
+def compact(cutoff, root, batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """Compact every record older than ``cutoff``, one short transaction per batch
+
+    Stops after ``max_batches`` batches when given. Returns the number of
+    records compacted. Raises BlockingIOError if another run holds the lock.
+    """
+    with compaction_lock(root):
+        remove_orphans(root)
+        total = batches = 0
+        while max_batches is None or batches < max_batches:
+            count = compact_batch(cutoff, root, batch_size)
+            if not count:
+                break
+            total += count
+            batches += 1
+        return total
+
+
+def iter_archived_rows(root, user_id=None, start=None, end=None, region_id=None):
+    """Stream archived records in ``EXPORT_COLUMNS`` order, one list per file
+
+    Takes the same filters as export.iter_record_rows; files whose user
+    and time ranges cannot match are skipped without being opened.
+    """
+    query = select(RecordArchive.path).order_by(RecordArchive.first_record_id)
+    if user_id is not None:
+        query = query.where(RecordArchive.min_user_id <= user_id, RecordArchive.max_user_id >= user_id)
+    if start is not None:
+        query = query.where(RecordArchive.last_recycled_at >= start)
+    if end is not None:
+        query = query.where(RecordArchive.first_recycled_at < end)
+
+    for path in db.session.scalars(query).all():
+        rows = []
+        with gzip.open(os.path.join(root, path), 'rt') as archive:
+            for line in archive:
+                record = json.loads(line)
+                record['recycled_at'] = recycled_at = datetime.fromisoformat(record['recycled_at'])
+                if (user_id is not None and record['user_id'] != user_id) or \
+                        (region_id is not None and record['region_id'] != region_id) or \
+                        (start is not None and recycled_at < start) or \
+                        (end is not None and recycled_at >= end):
+                    continue
+                rows.append(tuple(record[name] for name in EXPORT_COLUMNS))
+        if rows:
+            yield rows
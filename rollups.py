@@ -0,0 +1,221 @@
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import Date, and_, cast, delete, func, insert, literal, select, union_all, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import (db, RecyclingRecord, RecordSummary, RecyclingItem, UserTotals, UserItemCount, ItemTotals,
+                    UserCategoryCount, CategoryCount, UserDailyCount, UserCategoryDailyCount,
+                    ItemDailyCount, CategoryDailyCount, RegionItemTotals, RegionCategoryCount)
+
+ROLLUP_MODELS = (UserTotals, UserItemCount, ItemTotals, UserCategoryCount, CategoryCount, UserDailyCount,
+                 UserCategoryDailyCount, ItemDailyCount, CategoryDailyCount, RegionItemTotals, RegionCategoryCount)
+
+_UPSERT_INSERTS = {
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert,
+}
+
+
+def _dialect_name():
+    return db.session.get_bind().dialect.name
+
+
+def day_of(column):
+    """SQL expression truncating a timestamp column to its calendar day"""
+    if _dialect_name() == 'sqlite':
+        return func.date(column)
+    return cast(column, Date)
+
+
+def increment(model, key_columns, rows):
+    """Add each row's non-key values onto the stored counters, inserting missing rows"""
+    if not rows:
+        return
+
+    table = model.__table__
+    delta_columns = [name for name in rows[0] if name not in key_columns]
+    make_insert = _UPSERT_INSERTS.get(_dialect_name())
+
+    if make_insert is not None:
+        stmt = make_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={name: table.c[name] + stmt.excluded[name] for name in delta_columns}
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    # Portable fallback for dialects without INSERT ... ON CONFLICT
+    for row in rows:
+        match = and_(*(table.c[name] == row[name] for name in key_columns))
+        result = db.session.execute(
+            update(table).where(match).values({name: table.c[name] + row[name] for name in delta_columns})
+        )
+        if result.rowcount == 0:
+            db.session.execute(insert(table).values(**row))
+
+
+class RecyclingRollups:
+    @staticmethod
+    def record(user_id, item, points, recycled_at=None, region_id=None):
+        """Apply a single recycling event to the rollups"""
+        RecyclingRollups.record_many([(user_id, item.id, item.category, points, recycled_at, region_id)])
+
+    @staticmethod
+    def record_many(events):
+        """Apply ``(user_id, item_id, category, points, recycled_at, region_id)`` events
+
+        ``region_id`` may be None for users outside any region; those events
+        only count towards the global rollups.
+
+        Runs inside the caller's transaction so the rollups commit (or roll
+        back) together with the raw recycling records.
+        """
+        user_totals = defaultdict(lambda: [0, 0])
+        user_items = defaultdict(int)
+        item_totals = defaultdict(lambda: [0, 0])
+        user_categories = defaultdict(int)
+        categories = defaultdict(int)
+        user_days = defaultdict(lambda: [0, 0])
+        user_category_days = defaultdict(lambda: [0, 0])
+        item_days = defaultdict(lambda: [0, 0])
+        category_days = defaultdict(lambda: [0, 0])
+        region_items = defaultdict(lambda: [0, 0])
+        region_categories = defaultdict(int)
+
+        for user_id, item_id, category, points, recycled_at, region_id in events:
+            day = (recycled_at or datetime.utcnow()).date()
+            user_totals[user_id][0] += 1
+            user_totals[user_id][1] += points
+            user_items[(user_id, item_id)] += 1
+            item_totals[item_id][0] += 1
+            item_totals[item_id][1] += points
+            user_categories[(user_id, category)] += 1
+            categories[category] += 1
+            for buckets, key in ((user_days, (user_id, day)),
+                                 (user_category_days, (user_id, category, day)),
+                                 (item_days, (item_id, day)),
+                                 (category_days, (category, day))):
+                buckets[key][0] += 1
+                buckets[key][1] += points
+            if region_id is not None:
+                region_items[(region_id, item_id)][0] += 1
+                region_items[(region_id, item_id)][1] += points
+                region_categories[(region_id, category)] += 1
+
+        increment(UserTotals, ('user_id',), [
+            {'user_id': user_id, 'total_items': items, 'total_points': points}
+            for user_id, (items, points) in user_totals.items()
+        ])
+        increment(UserItemCount, ('user_id', 'item_id'), [
+            {'user_id': user_id, 'item_id': item_id, 'count': count}
+            for (user_id, item_id), count in user_items.items()
+        ])
+        increment(ItemTotals, ('item_id',), [
+            {'item_id': item_id, 'count': count, 'points': points}
+            for item_id, (count, points) in item_totals.items()
+        ])
+        increment(UserCategoryCount, ('user_id', 'category'), [
+            {'user_id': user_id, 'category': category, 'count': count}
+            for (user_id, category), count in user_categories.items()
+        ])
+        increment(CategoryCount, ('category',), [
+            {'category': category, 'count': count}
+            for category, count in categories.items()
+        ])
+        increment(UserDailyCount, ('user_id', 'day'), [
+            {'user_id': user_id, 'day': day, 'items': items, 'points': points}
+            for (user_id, day), (items, points) in user_days.items()
+        ])
+        increment(UserCategoryDailyCount, ('user_id', 'category', 'day'), [
+            {'user_id': user_id, 'category': category, 'day': day, 'items': items, 'points': points}
+            for (user_id, category, day), (items, points) in user_category_days.items()
+        ])
+        increment(ItemDailyCount, ('item_id', 'day'), [
+            {'item_id': item_id, 'day': day, 'items': items, 'points': points}
+            for (item_id, day), (items, points) in item_days.items()
+        ])
+        increment(CategoryDailyCount, ('category', 'day'), [
+            {'category': category, 'day': day, 'items': items, 'points': points}
+            for (category, day), (items, points) in category_days.items()
+        ])
+        increment(RegionItemTotals, ('region_id', 'item_id'), [
+            {'region_id': region_id, 'item_id': item_id, 'count': count, 'points': points}
+            for (region_id, item_id), (count, points) in region_items.items()
+        ])
+        increment(RegionCategoryCount, ('region_id', 'category'), [
+            {'region_id': region_id, 'category': category, 'count': count}
+            for (region_id, category), count in region_categories.items()
+        ])
+
+    @staticmethod
+    def rebuild(connection=None):
+        """Recompute every rollup table from the recycling records and record summaries
+
+        Category rollups use each item's current category, the same one
+        :meth:`record_many` is given, so whatever changes an item's category
+        rebuilds afterwards (the catalog loader does). With ``connection``
+        the rebuild runs in the caller's transaction; otherwise on the
+        session, which is committed.
+        """
+        executor = db.session if connection is None else connection
+        for model in ROLLUP_MODELS:
+            executor.execute(delete(model.__table__))
+
+        # Raw records plus the summaries of compacted ones (see retention.py)
+        records = RecyclingRecord.__table__
+        summaries = RecordSummary.__table__
+        facts = union_all(
+            select(records.c.user_id, records.c.item_id, records.c.region_id,
+                   day_of(records.c.recycled_at).label('day'),
+                   literal(1).label('items'), records.c.points_earned.label('points')),
+            select(summaries.c.user_id, summaries.c.item_id, summaries.c.region_id,
+                   day_of(summaries.c.day).label('day'), summaries.c['items'], summaries.c.points),
+        ).subquery('facts')
+        items = RecyclingItem.__table__
+        joined = facts.join(items, facts.c.item_id == items.c.id)
+        count, points = func.sum(facts.c['items']), func.sum(facts.c.points)
+
+        statements = [
+            (UserTotals, ['user_id', 'total_items', 'total_points'],
+             select(facts.c.user_id, count, points).group_by(facts.c.user_id)),
+            (UserItemCount, ['user_id', 'item_id', 'count'],
+             select(facts.c.user_id, facts.c.item_id, count)
+             .where(facts.c.item_id.isnot(None)).group_by(facts.c.user_id, facts.c.item_id)),
+            (ItemTotals, ['item_id', 'count', 'points'],
+             select(facts.c.item_id, count, points)
+             .where(facts.c.item_id.isnot(None)).group_by(facts.c.item_id)),
+            (UserCategoryCount, ['user_id', 'category', 'count'],
+             select(facts.c.user_id, items.c.category, count)
+             .select_from(joined).group_by(facts.c.user_id, items.c.category)),
+            (CategoryCount, ['category', 'count'],
+             select(items.c.category, count)
+             .select_from(joined).group_by(items.c.category)),
+            (UserDailyCount, ['user_id', 'day', 'items', 'points'],
+             select(facts.c.user_id, facts.c.day, count, points)
+             .group_by(facts.c.user_id, facts.c.day)),
+            (UserCategoryDailyCount, ['user_id', 'category', 'day', 'items', 'points'],
+             select(facts.c.user_id, items.c.category, facts.c.day, count, points)
+             .select_from(joined).group_by(facts.c.user_id, items.c.category, facts.c.day)),
+            (ItemDailyCount, ['item_id', 'day', 'items', 'points'],
+             select(facts.c.item_id, facts.c.day, count, points)
+             .where(facts.c.item_id.isnot(None)).group_by(facts.c.item_id, facts.c.day)),
+            (CategoryDailyCount, ['category', 'day', 'items', 'points'],
+             select(items.c.category, facts.c.day, count, points)
+             .select_from(joined).group_by(items.c.category, facts.c.day)),
+            (RegionItemTotals, ['region_id', 'item_id', 'count', 'points'],
+             select(facts.c.region_id, facts.c.item_id, count, points)
+             .where(facts.c.region_id.isnot(None), facts.c.item_id.isnot(None))
+             .group_by(facts.c.region_id, facts.c.item_id)),
+            (RegionCategoryCount, ['region_id', 'category', 'count'],
+             select(facts.c.region_id, items.c.category, count)
+             .select_from(joined).where(facts.c.region_id.isnot(None))
+             .group_by(facts.c.region_id, items.c.category)),
+        ]
+        for model, columns, query in statements:
+            executor.execute(insert(model.__table__).from_select(columns, query))
+
+        if connection is None:
+            db.session.commit()
@@ -1,6 +1,9 @@
+import os
+
 from ecocycle_app import app, initialize_database
 
 if __name__ == '__main__':
-    # Ensure database is initialized
-    initialize_database()
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Initialize once in the parent process, not again in the reloader's child
+    if not os.environ.get('WERKZEUG_RUN_MAIN'):
+        initialize_database()
+    app.run(debug=True, host='0.0.0.0', port=5000)
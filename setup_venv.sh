@@ -12,6 +12,9 @@ pip install --upgrade pip
 # Install dependencies
 pip install -r requirements.txt
 
+# Async serving mode (uvicorn asgi:app), optional
+# pip install -r requirements-asgi.txt
+
 # Install dev dependencies (if any)
 # pip install pytest pytest-flask coverage
 
@@ -1,21 +1,58 @@
+import os
+import tempfile
 import unittest
+
+# Run the app on TestConfig and a throwaway database file, never instance/ecocycle.db
+os.environ['ECOCYCLE_ENV'] = 'testing'
+os.environ.setdefault('TEST_DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'ecocycle.db')}")
+
 from ecocycle_app import app, db, initialize_database
-from models import User, RecyclingItem, RecyclingRecord
-from database_init import DatabaseInitializer
+from models import User, RecyclingItem, RecyclingRecord, Category, Region, UserTotals, ItemTotals, ProcessedEvent
+from config import TestConfig
+from db_routing import use_primary, use_replica
+from flask import Flask
+from jinja2 import DictLoader, Environment
+from sqlalchemy import inspect, update
+from sqlalchemy.exc import IntegrityError
+from database_init import DatabaseInitializer, RECYCLING_ITEMS
+from catalog_index import CatalogIndex, catalog_index
+from catalog_loader import CatalogError, load_catalog, load_region_overrides
+from matching import ItemMatcher, item_matcher
+from analytics import RecyclingAnalytics
+from migrations import run_migrations
+from recycling import RecyclingService
+from timeseries import RecyclingTimeSeries
+from leaderboard import Leaderboard, LeaderboardRegistry, leaderboards
+import response_cache
+import fragment_cache
+import live_stats
+import rate_limit
+from coalesce import SingleFlight
+import cache
+import database_init
+import db_engine
+import write_behind
 from unittest.mock import patch
+import importlib.util
 import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
 
 
 class EcoCycleTestCase(unittest.TestCase):
     def setUp(self):
         """Set up test environment"""
-        app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['RATE_LIMIT_ENABLED'] = False
         self.app = app.test_client()
 
         with app.app_context():
             db.create_all()
             DatabaseInitializer.init_data()
+        leaderboards.invalidate()
+        response_cache.get_backend(app).clear()
+        fragment_cache.get_store(app).clear()
 
     def tearDown(self):
         """Clean up after tests"""
@@ -36,6 +73,23 @@ class EcoCycleTestCase(unittest.TestCase):
         data = json.loads(response.data)
         self.assertGreater(len(data), 0)
 
+    def test_search_api_limit(self):
+        """Test search API honours the result limit"""
+        response = self.app.get('/api/search?q=a&limit=2')
+        data = json.loads(response.data)
+        self.assertEqual(len(data), 2)
+
+    def test_search_sees_new_items(self):
+        """Test search index is rebuilt after the catalog changes"""
+        with app.app_context():
+            db.session.add(RecyclingItem(name='pizza box', instruction='Remove food.',
+                                         points=2, category='Paper'))
+            db.session.commit()
+
+        response = self.app.get('/api/search?q=pizza')
+        data = json.loads(response.data)
+        self.assertEqual(data, [{'item': 'pizza box', 'category': 'Paper'}])
+
     def test_recycle_item(self):
         """Test recycling an item"""
         with app.app_context():
@@ -52,6 +106,649 @@ class EcoCycleTestCase(unittest.TestCase):
             self.assertIsNotNone(record)
             self.assertEqual(record.item_name, 'plastic bottle')
 
+    def test_recycle_fuzzy_match(self):
+        """Test misspelled, plural and aliased names resolve to catalog items"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+
+            response = self.app.post('/recycle', data={'item': 'Aluminium Cans'})
+            self.assertIn(b'Aluminum Can', response.data)
+            self.app.post('/recycle', data={'item': 'platic bottel'})
+            self.app.post('/recycle', data={'item': 'xylophone'})
+
+            names = [record.item_name for record in RecyclingRecord.query.order_by(RecyclingRecord.id)]
+            self.assertEqual(names, ['aluminum can', 'plastic bottle'])
+
+    def test_request_instrumentation(self):
+        """Test Server-Timing headers, Prometheus metrics and the slow request log"""
+        response = self.app.get('/report')
+        self.assertRegex(response.headers['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries", tpl;dur=')
+
+        with patch.dict(app.config, {'SLOW_REQUEST_MS': 0}), self.assertLogs(app.logger, 'WARNING') as logs:
+            self.app.get('/api/leaderboard')
+        self.assertIn('Slow request GET /api/leaderboard', logs.output[0])
+
+        metrics = self.app.get('/metrics').data.decode()
+        self.assertIn('ecocycle_requests_total{endpoint="report",method="GET",status="200"}', metrics)
+        self.assertIn('ecocycle_slow_requests_total{endpoint="api_leaderboard"}', metrics)
+        self.assertIn('ecocycle_request_queries_bucket{endpoint="report",le="+Inf"}', metrics)
+        self.assertIn('ecocycle_cache_hits_total{cache="catalog"}', metrics)
+
+    def test_rollups_match_rebuild(self):
+        """Test incremental rollups agree with a rebuild from raw records"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+
+            for item in ['plastic bottle', 'plastic bottle', 'battery']:
+                self.app.post('/recycle', data={'item': item})
+
+            user_stats = RecyclingAnalytics.get_user_stats(1)
+            self.assertEqual(user_stats['total_points'], 20)
+            self.assertEqual(user_stats['total_items'], 3)
+            self.assertEqual(user_stats['most_recycled_item'], 'plastic bottle')
+            self.assertEqual(user_stats['weekly_activity'], 3)
+            community_stats = RecyclingAnalytics.get_community_stats()
+            distribution = RecyclingAnalytics.get_category_distribution(1)
+            self.assertEqual(distribution, {'Plastic': 2, 'Hazardous': 1})
+
+            result = app.test_cli_runner().invoke(args=['ecocycle', 'rebuild-rollups'])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(RecyclingAnalytics.get_user_stats(1), user_stats)
+            self.assertEqual(RecyclingAnalytics.get_community_stats(), community_stats)
+            self.assertEqual(RecyclingAnalytics.get_category_distribution(1), distribution)
+
+    def test_recycle_batch(self):
+        """Test batch recycling records every known item in one request"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+
+            items = ['electronics'] * 4 + ['mystery object', 'Battery']
+            response = self.app.post('/api/recycle/batch', json={'items': items})
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+
+            self.assertEqual(data['recorded'], 5)
+            self.assertEqual(data['points_awarded'], 70)
+            self.assertFalse(data['results'][4]['recognized'])
+            self.assertTrue(data['results'][3]['level_up'])
+            self.assertEqual(data['user_data']['level'], 2)
+            self.assertEqual(data['user_data']['next_reward'], 100)
+            self.assertEqual(RecyclingRecord.query.count(), 5)
+            self.assertEqual(RecyclingAnalytics.get_user_stats(1)['total_points'], 70)
+
+            response = self.app.post('/api/recycle/batch', json={'items': 'paper'})
+            self.assertEqual(response.status_code, 400)
+
+    def test_records_cursor_pagination(self):
+        """Test keyset pagination walks every record exactly once"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+            self.app.post('/api/recycle/batch', json={'items': ['paper'] * 5})
+
+            seen = []
+            cursor = ''
+            while cursor is not None:
+                response = self.app.get(f'/api/recycling/records?per_page=2&cursor={cursor}&include_total=1')
+                data = json.loads(response.data)
+                self.assertEqual(data['total'], 5)
+                seen.extend(data['records'])
+                cursor = data['next_cursor']
+
+            self.assertEqual(len(seen), 5)
+            response = self.app.get('/api/recycling/records?cursor=bogus')
+            self.assertEqual(response.status_code, 400)
+
+            # Out-of-range page sizes are clamped instead of failing
+            data = json.loads(self.app.get('/api/recycling/records?per_page=0&cursor=').data)
+            self.assertEqual(len(data['records']), 1)
+            data = json.loads(self.app.get('/api/recycling/records?per_page=-3&page=0').data)
+            self.assertEqual((len(data['records']), data['current_page']), (1, 1))
+
+    @unittest.skipUnless(all(importlib.util.find_spec(name)
+                             for name in ('starlette', 'aiosqlite', 'greenlet', 'httpx')),
+                         'async serving dependencies not installed (requirements-asgi.txt)')
+    def test_async_api_matches_sync(self):
+        """Test the ASGI handlers answer like the Flask routes and forward the rest"""
+        from starlette.testclient import TestClient
+        from asgi import create_asgi_app
+
+        with app.app_context():
+            region = Region(code='springfield', name='Springfield')
+            db.session.add(region)
+            db.session.flush()
+            region_id = region.id
+            db.session.add(User(id=1, username='test_user', region_id=region_id))
+            db.session.commit()
+        self.app.post('/api/recycle/batch', json={'items': ['paper', 'battery', 'battery', 'plastic bottle']})
+        with app.app_context():
+            # Ties in points and counts must be broken the same way by both
+            points = db.session.get(User, 1).points
+            db.session.add_all([User(id=2, username='rival', points=points, region_id=region_id),
+                                User(id=3, username='ally', points=points)])
+            db.session.commit()
+
+        with TestClient(create_asgi_app(app)) as client:
+            for path in ('/api/search?q=bot', '/api/search?q=a&limit=2', '/api/user/stats',
+                         '/api/community/stats', '/api/community/stats?region=springfield',
+                         '/api/recycling/records?per_page=2', '/api/recycling/records?per_page=2&cursor=',
+                         '/api/recycling/records?per_page=0&cursor=', '/api/recycling/records?per_page=-1&page=0',
+                         '/api/recycling/records?page=3&per_page=1'):
+                # Empty the shared response cache so each side computes its own answer
+                response_cache.get_backend(app).clear()
+                async_data = client.get(path).json()
+                response_cache.get_backend(app).clear()
+                self.assertEqual(async_data, json.loads(self.app.get(path).data), path)
+
+            # Both servers share the cache entries, ETags and 304s
+            etag = self.app.get('/api/user/stats').headers['ETag']
+            response = client.get('/api/user/stats')
+            self.assertEqual((response.headers['ETag'], response.headers['Cache-Control']), (etag, 'no-cache, private'))
+            self.assertEqual(client.get('/api/user/stats', headers={'If-None-Match': etag}).status_code, 304)
+            stats = client.get('/api/community/stats').json()
+            self.assertEqual([entry['username'] for entry in stats['top_recyclers']], ['test_user', 'rival', 'ally'])
+            self.assertEqual(client.get('/api/community/stats?region=nowhere').status_code, 404)
+            self.assertEqual(client.get('/api/recycling/records?cursor=bogus').status_code, 400)
+            self.assertEqual(client.get('/').status_code, 200)
+
+    def test_migrations_backfill_item_id(self):
+        """Test schema migrations backfill item_id and are idempotent"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.add(RecyclingRecord(user_id=1, item_name='battery', points_earned=10))
+            db.session.commit()
+
+            run_migrations()
+            self.assertEqual(run_migrations(), [])
+
+            record = RecyclingRecord.query.first()
+            battery = RecyclingItem.query.filter_by(name='battery').first()
+            self.assertEqual(record.item_id, battery.id)
+
+    def test_init_db_command_is_idempotent(self):
+        """Test init-db bulk-loads the defaults and can be rerun safely"""
+        with app.app_context():
+            runner = app.test_cli_runner()
+            for _ in range(2):
+                result = runner.invoke(args=['ecocycle', 'init-db'])
+                self.assertEqual(result.exit_code, 0)
+
+            self.assertEqual(RecyclingItem.query.count(), len(RECYCLING_ITEMS))
+            self.assertEqual(db.session.get(User, 1).username, 'demo_user')
+            self.assertEqual(json.loads(RecyclingItem.query.filter_by(name='battery').one().aliases),
+                             RECYCLING_ITEMS[6]['aliases'])
+
+            # Rerunning restores edited defaults, through the portable path as well
+            for upsert_dialects in ({'sqlite': database_init.sqlite_insert}, {}):
+                db.session.execute(update(RecyclingItem).where(RecyclingItem.name == 'battery')
+                                   .values(points=99, category='Metal'))
+                db.session.commit()
+                with patch.dict(database_init._INSERT_IGNORES, upsert_dialects, clear=True):
+                    self.assertEqual(runner.invoke(args=['ecocycle', 'init-db']).exit_code, 0)
+                battery = RecyclingItem.query.filter_by(name='battery').one()
+                self.assertEqual((battery.points, battery.category), (10, 'Hazardous'))
+                self.assertEqual(RecyclingItem.query.count(), len(RECYCLING_ITEMS))
+
+    def test_load_catalog_applies_diff(self):
+        """Test catalog files are validated, diffed and applied in bulk"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+            self.app.post('/recycle', data={'item': 'paper'})
+            # Pruning goes by the records, not rollups that may not be backfilled yet
+            db.session.query(ItemTotals).delete()
+            db.session.commit()
+            self.assertEqual(len(catalog_index.search('pizza')), 0)
+
+            directory = tempfile.mkdtemp()
+            path = os.path.join(directory, 'catalog.csv')
+            with open(path, 'w', newline='') as handle:
+                handle.write('name,instruction,points,category,tips,aliases\n'
+                             'Battery,Drop off.,12,Hazardous,Tape terminals,aa battery\n'
+                             'pizza box,Remove food.,2,Paper,,greasy box|pizza carton\n')
+
+            stats = load_catalog(path, prune=True)
+            self.assertEqual(stats, {'inserted': 1, 'updated': 1, 'unchanged': 0, 'deleted': 7, 'kept': 1})
+            self.assertEqual(sorted(item.name for item in RecyclingItem.query),
+                             ['battery', 'paper', 'pizza box'])
+            self.assertEqual(cache.get_item('battery').points, 12)
+            self.assertEqual(catalog_index.search('pizza'), [{'item': 'pizza box', 'category': 'Paper'}])
+            self.assertEqual(item_matcher.match('pizza cartons').item, 'pizza box')
+
+            with open(path, 'a') as handle:
+                handle.write('paper,,three,Paper,,\n')
+            with self.assertRaises(CatalogError) as raised:
+                load_catalog(path)
+            self.assertEqual(len(raised.exception.errors), 1)
+            self.assertEqual(RecyclingItem.query.count(), 3)
+
+            with open(path, 'w', newline='') as handle:
+                handle.write('name,instruction,points,category,tips,aliases\n'
+                             'paper,Flatten.,5,Cardboard,,\n')
+            load_catalog(path)
+            self.assertEqual(RecyclingAnalytics.get_category_distribution(1), {'Cardboard': 1})
+
+    def test_region_overrides_and_scoped_stats(self):
+        """Test regional catalogs override the base and scope the community stats"""
+        with app.app_context():
+            path = os.path.join(tempfile.mkdtemp(), 'springfield.json')
+            with open(path, 'w') as handle:
+                json.dump([{'name': 'battery', 'points': 20},
+                           {'name': 'food waste', 'accepted': False}], handle)
+            self.assertEqual(load_region_overrides(path, 'springfield', 'Springfield'), 2)
+
+            region = cache.get_regions()['springfield']
+            db.session.add(User(id=1, username='test_user', region_id=region.id))
+            db.session.add(User(id=2, username='elsewhere'))
+            db.session.commit()
+            self.assertEqual(cache.get_item('battery', region.id).points, 20)
+            self.assertIsNone(cache.get_item('food waste', region.id))
+
+            self.app.post('/recycle', data={'item': 'battery'})
+            self.app.post('/recycle', data={'item': 'food waste'})
+            RecyclingService.record_item(db.session.get(User, 2), cache.get_item('paper'))
+            self.assertEqual(RecyclingRecord.query.filter_by(region_id=region.id).count(), 1)
+
+            response = self.app.get('/api/community/stats?region=springfield')
+            stats = json.loads(response.data)
+            self.assertEqual((stats['total_users'], stats['total_recycled_items'], stats['total_points_earned']),
+                             (1, 1, 20))
+            self.assertEqual(stats['top_recyclers'], [{'username': 'test_user', 'points': 20}])
+            self.assertEqual(RecyclingAnalytics.get_category_distribution(region_id=region.id), {'Hazardous': 1})
+            self.assertEqual(self.app.get('/api/community/stats?region=nowhere').status_code, 404)
+
+            app.test_cli_runner().invoke(args=['ecocycle', 'rebuild-rollups'])
+            self.assertEqual(RecyclingAnalytics.get_community_stats(region.id)['total_points_earned'], 20)
+
+    def test_fragment_cache(self):
+        """Test cached fragments are reused and follow catalog and data versions"""
+        store = fragment_cache.get_store(app)
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+
+        self.app.get('/')
+        hits = store.hits
+        self.assertIn(b'data-category="Plastic"', self.app.get('/').data)
+        self.assertEqual(store.hits, hits + 1)
+
+        with app.app_context():
+            Category.query.filter_by(name='Plastic').one().name = 'Plastics'
+            db.session.commit()
+        self.assertIn(b'data-category="Plastics"', self.app.get('/').data)
+
+        community_points = r'stat-value">{}</div>\s*<div class="stat-label">Community Points'
+        self.assertRegex(self.app.get('/report').get_data(as_text=True), community_points.format(0))
+        self.app.post('/recycle', data={'item': 'battery'})
+        self.assertRegex(self.app.get('/report').get_data(as_text=True), community_points.format(10))
+
+        # Fragments expire even when no award reaches this process
+        misses = store.misses
+        store.get_or_render('expiring', lambda: 'old')
+        with patch('fragment_cache.time.monotonic', return_value=store._entries['expiring'][0]):
+            self.assertEqual(store.get_or_render('expiring', lambda: 'new'), 'new')
+        self.assertEqual(store.misses, misses + 2)
+
+        # Unrecognized items are never cached under a shared key
+        self.assertIn(b'Sofa', self.app.post('/recycle', data={'item': 'sofa'}).data)
+        self.assertIn(b'Piano', self.app.post('/recycle', data={'item': 'piano'}).data)
+
+        # The bytecode directory is only created once a template is compiled
+        directory = os.path.join(tempfile.mkdtemp(), 'bytecode')
+        environment = Environment(loader=DictLoader({'page.html': '{{ 1 + 1 }}'}),
+                                  bytecode_cache=fragment_cache.LazyBytecodeCache(directory, app.logger))
+        self.assertFalse(os.path.exists(directory))
+        self.assertEqual(environment.get_template('page.html').render(), '2')
+        self.assertTrue(os.listdir(directory))
+
+    def test_community_stream(self):
+        """Test the stream opens with a snapshot and pushes one event per award"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+
+        response = self.app.get('/api/community/stream', buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = (chunk.decode() for chunk in response.response)
+        self.assertIn('"total_points_earned":0', next(events))
+
+        self.app.post('/recycle', data={'item': 'battery'})
+        event = next(events)
+        self.assertTrue(event.startswith('id: 1\nevent: award\n'))
+        data = json.loads(event.split('data: ', 1)[1])
+        self.assertEqual(data['delta'], {'items': 1, 'points': 10})
+        self.assertEqual(data['totals']['total_points_earned'], 10)
+        self.assertEqual(data['leaderboard'], [{'username': 'test_user', 'points': 10}])
+
+        response.close()
+        self.assertEqual(len(live_stats.get_hub(app)), 0)
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy not installed')
+    def test_columnar_snapshot_matches_analytics(self):
+        """Test stats computed from a columnar snapshot equal the live analytics"""
+        from columnar import ColumnarSnapshot
+
+        root = tempfile.mkdtemp()
+        with app.app_context():
+            region = Region(code='springfield', name='Springfield')
+            db.session.add(region)
+            db.session.flush()
+            users = [User(id=1, username='test_user'), User(id=2, username='neighbor', region_id=region.id),
+                     User(id=3, username='idle')]
+            db.session.add_all(users)
+            db.session.commit()
+            for user, names in ((users[0], ['battery', 'battery', 'paper', 'paper']), (users[1], ['paper', 'paper', 'glass bottle'])):
+                for name in names:
+                    RecyclingService.record_item(user, cache.get_item(name, user.region_id))
+
+            result = app.test_cli_runner().invoke(args=['ecocycle', 'snapshot-records', '--output', root])
+            self.assertIn('Wrote 7 records', result.output)
+            snapshot = ColumnarSnapshot.latest(root)
+
+            for region_id in (None, region.id):
+                self.assertEqual(snapshot.get_community_stats(region_id),
+                                 RecyclingAnalytics.get_community_stats(region_id))
+            for filters in ({}, {'user_id': 1}, {'region_id': region.id}):
+                self.assertEqual(snapshot.get_category_distribution(**filters),
+                                 RecyclingAnalytics.get_category_distribution(**filters))
+            self.assertEqual(sum(month['items'] for month in snapshot.get_monthly_summary().values()), 7)
+            self.assertEqual(list(snapshot.get_cohort_category_mix().values()),
+                             [RecyclingAnalytics.get_category_distribution()])
+
+            result = app.test_cli_runner().invoke(args=['ecocycle', 'community-report', '--snapshot', root,
+                                                        '--region', 'springfield'])
+            self.assertEqual(json.loads(result.output)['community']['total_users'], 1)
+
+    def test_compaction_keeps_stats(self):
+        """Test compacting old records keeps points, analytics and rebuilds, and archives the rows"""
+        old = datetime.utcnow() - timedelta(days=400)
+        names = ['battery', 'paper', 'battery', 'glass bottle', 'battery']
+        with app.app_context(), patch.dict(app.config, {'RECORD_ARCHIVE_DIR': tempfile.mkdtemp()}):
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+            RecyclingService.record_events([
+                {'event_key': f'event-{number}', 'user_id': 1, 'item_name': name,
+                 'recycled_at': old + timedelta(hours=number * 6) if number < 4 else datetime.utcnow()}
+                for number, name in enumerate(names)
+            ])
+
+            def snapshot():
+                return (db.session.get(User, 1).points,
+                        RecyclingAnalytics.get_user_stats(1),
+                        RecyclingAnalytics.get_community_stats(),
+                        RecyclingAnalytics.get_category_distribution(1),
+                        RecyclingTimeSeries.get_series(1, 'month', old.date(), datetime.utcnow().date()))
+
+            before = snapshot()
+            runner = app.test_cli_runner()
+            result = runner.invoke(args=['ecocycle', 'compact-records', '--days', '30', '--batch-size', '3'])
+            self.assertIn('Compacted 4 records', result.output)
+            self.assertEqual(RecyclingRecord.query.count(), 1)
+            self.assertEqual(snapshot(), before)
+
+            runner.invoke(args=['ecocycle', 'rebuild-rollups'])
+            self.assertEqual(snapshot(), before)
+
+            result = runner.invoke(args=['ecocycle', 'export-records', '--format', 'ndjson', '--archived'])
+            exported = [json.loads(line) for line in result.output.splitlines()]
+            self.assertEqual([record['item_name'] for record in exported], names)
+            self.assertIn('Compacted 0 records', runner.invoke(args=['ecocycle', 'compact-records']).output)
+
+    def test_rate_limit(self):
+        """Test clients past their burst get 429 with back-off headers, per limit"""
+        limits = {'search': (1, 2), 'recycle': (1, 1)}
+        rate_limit.get_backend(app).clear()
+        with patch.dict(app.config, {'RATE_LIMIT_ENABLED': True, 'RATE_LIMITS': limits}):
+            first = self.app.get('/api/search?q=plastic')
+            self.assertEqual(first.headers['X-RateLimit-Limit'], '2')
+            self.assertEqual(first.headers['X-RateLimit-Remaining'], '1')
+            self.app.get('/api/search?q=plastic')
+            limited = self.app.get('/api/search?q=plastic')
+            self.assertEqual(limited.status_code, 429)
+            self.assertEqual(limited.headers['Retry-After'], '1')
+            self.assertEqual(limited.headers['X-RateLimit-Remaining'], '0')
+
+            # Buckets are per limit name and per client address
+            self.assertEqual(self.app.post('/api/recycle/batch', json={'items': []}).status_code, 200)
+            self.assertEqual(self.app.get('/api/search?q=plastic',
+                                          environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code, 200)
+
+    def test_catalog_cache_invalidation(self):
+        """Test cached catalog snapshots are reused and dropped on change"""
+        with app.app_context():
+            item = cache.get_item('battery')
+            self.assertIsInstance(item.tips, tuple)
+            hits = cache.catalog_cache.hits
+            self.assertIs(cache.get_item('battery'), item)
+            self.assertEqual(cache.catalog_cache.hits, hits + 1)
+
+            RecyclingItem.query.filter_by(name='battery').first().points = 11
+            db.session.commit()
+            self.assertEqual(cache.get_item('battery').points, 11)
+
+    def test_concurrent_recycling_keeps_totals(self):
+        """Test many threads recycling for one user lose no points or levels"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+
+        def hammer(rounds=10):
+            client = app.test_client()
+            for _ in range(rounds):
+                client.post('/recycle', data={'item': 'aluminum can'})
+                client.post('/api/recycle/batch', json={'items': ['aluminum can']})
+
+        threads = [threading.Thread(target=hammer) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # A writer that loses the SQLite lock backs off and retries instead of failing
+        with app.app_context():
+            self.assertEqual(db.engine.url.get_backend_name(), 'sqlite')
+            path = db.engine.url.database
+            db.engine.dispose()
+        blocker = sqlite3.connect(path)
+        blocker.execute('BEGIN IMMEDIATE')
+        with patch.object(db_engine, 'SQLITE_BUSY_TIMEOUT_MS', 20), \
+                patch('db_engine.time.sleep', wraps=time.sleep) as backoff:
+            retried = threading.Thread(target=hammer, kwargs={'rounds': 1})
+            retried.start()
+            retried.join(0.1)
+            blocker.rollback()
+            retried.join()
+        blocker.close()
+        self.assertTrue(backoff.called)
+
+        with app.app_context():
+            db.engine.dispose()
+            user = db.session.get(User, 1)
+            self.assertEqual(user.points, 162 * 8)
+            self.assertEqual(user.level, 1296 // 50 + 1)
+            self.assertEqual(user.next_reward, user.level * 50)
+            self.assertEqual(RecyclingRecord.query.count(), 162)
+            self.assertEqual(RecyclingAnalytics.get_user_stats(1)['total_points'], 1296)
+
+    def test_write_behind_replay_is_idempotent(self):
+        """Test queued events are applied once even when replayed"""
+        outbox_path = os.path.join(tempfile.mkdtemp(), 'outbox.db')
+        app.config.update(WRITE_BEHIND_ENABLED=True, WRITE_BEHIND_WORKER=False,
+                          WRITE_BEHIND_PATH=outbox_path)
+        try:
+            with app.app_context():
+                db.session.add(User(id=1, username='test_user'))
+                db.session.commit()
+
+            headers = {'Idempotency-Key': 'scan-1'}
+            self.app.post('/recycle', data={'item': 'battery'}, headers=headers)
+            self.app.post('/recycle', data={'item': 'battery'}, headers=headers)
+            self.app.post('/recycle', data={'item': 'paper'})
+
+            outbox = write_behind.get_outbox(app)
+            self.assertEqual(len(outbox), 2)
+            events = [event for _, event in outbox.fetch()]
+
+            self.assertEqual(write_behind.drain(app, outbox), 2)
+            self.assertEqual(len(outbox), 0)
+
+            with app.app_context():
+                # Simulate a crash between commit and ack: replaying is a no-op
+                self.assertEqual(RecyclingService.record_events(events), 0)
+                self.assertEqual(db.session.get(User, 1).points, 13)
+                self.assertEqual(RecyclingRecord.query.count(), 2)
+
+                # Keys are pruned once old, but not while an older event is still queued
+                later = datetime.utcnow() + timedelta(days=2)
+                outbox.enqueue(1, 'paper', 'scan-2', recycled_at=datetime.utcnow() - timedelta(hours=1))
+                self.assertEqual(write_behind.prune_processed(outbox, now=later), 0)
+                outbox.ack([seq for seq, _ in outbox.fetch()])
+                self.assertEqual(write_behind.prune_processed(outbox, now=later), 2)
+
+                # Unknown items are logged and dropped without using up their key
+                outbox.enqueue(1, 'mystery object', 'scan-3')
+                with self.assertLogs('recycling', 'WARNING'):
+                    self.assertEqual(write_behind.drain(app, outbox), 0)
+                self.assertEqual((len(outbox), ProcessedEvent.query.count()), (0, 0))
+
+                # A batch losing a key race to another drainer is retried without those keys
+                record_events = RecyclingService.record_events
+                raced = []
+
+                def claimed_elsewhere(events):
+                    if not raced:
+                        raced.append(True)
+                        record_events([events[0]])
+                        raise IntegrityError('INSERT INTO processed_events', {}, Exception('UNIQUE'))
+                    return record_events(events)
+
+                outbox.enqueue(1, 'paper', 'scan-4')
+                outbox.enqueue(1, 'battery', 'scan-5')
+                with patch.object(RecyclingService, 'record_events', side_effect=claimed_elsewhere):
+                    self.assertEqual(write_behind.drain(app, outbox), 1)
+                self.assertEqual((len(outbox), ProcessedEvent.query.count()), (0, 2))
+
+            response = self.app.post('/recycle', data={'item': 'paper'}, headers={'Idempotency-Key': 'k' * 65})
+            self.assertEqual(response.status_code, 400)
+        finally:
+            app.config.update(WRITE_BEHIND_ENABLED=False, WRITE_BEHIND_WORKER=True,
+                              WRITE_BEHIND_PATH=None)
+
+    def test_export_records(self):
+        """Test CSV/NDJSON exports stream the user's records"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+            self.app.post('/api/recycle/batch', json={'items': ['paper', 'battery']})
+
+            response = self.app.get('/api/recycling/records/export?format=csv')
+            lines = response.data.decode().splitlines()
+            self.assertEqual(lines[0], 'id,user_id,item_id,item_name,points_earned,recycled_at')
+            self.assertEqual(len(lines), 3)
+
+            response = self.app.get('/api/recycling/records/export?format=ndjson&start=2000-01-01')
+            rows = [json.loads(line) for line in response.data.decode().splitlines()]
+            self.assertEqual([row['item_name'] for row in rows], ['paper', 'battery'])
+
+            response = self.app.get('/api/recycling/records/export?scope=all')
+            self.assertEqual(response.status_code, 403)
+
+            result = app.test_cli_runner().invoke(args=['ecocycle', 'export-records', '--format', 'ndjson'])
+            self.assertEqual(len(result.output.splitlines()), 2)
+
+    def test_timeseries_api(self):
+        """Test trend series are served from daily buckets"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+            self.app.post('/api/recycle/batch', json={'items': ['paper', 'battery', 'paper']})
+
+            response = self.app.get('/api/stats/timeseries?granularity=week')
+            data = json.loads(response.data)
+            self.assertEqual(len(data['labels']), 12)
+            self.assertEqual(data['datasets'][0]['data'][-1], 3)
+
+            response = self.app.get('/api/stats/timeseries?scope=community&by=category&metric=points')
+            data = json.loads(response.data)
+            totals = {dataset['label']: dataset['data'][-1] for dataset in data['datasets']}
+            self.assertEqual(totals, {'Hazardous': 10, 'Paper': 6})
+
+            response = self.app.get('/api/stats/timeseries?granularity=year')
+            self.assertEqual(response.status_code, 400)
+            response = self.app.get('/api/stats/timeseries?start=0001-01-01')
+            self.assertEqual(response.status_code, 400)
+            response = self.app.get('/api/stats/timeseries?granularity=month&start=9999-01-01&end=9999-12-31')
+            self.assertEqual(len(json.loads(response.data)['labels']), 12)
+
+            response = self.app.get('/report')
+            self.assertIn(b'trendChart', response.data)
+
+    def test_leaderboard_api(self):
+        """Test leaderboards follow awards for all time and this week"""
+        with app.app_context():
+            db.session.add_all([User(id=1, username='test_user'), User(id=2, username='rival', points=12)])
+            db.session.commit()
+
+            response = self.app.get('/api/leaderboard?period=week')
+            self.assertEqual(json.loads(response.data)['entries'], [])
+
+            self.app.post('/api/recycle/batch', json={'items': ['electronics']})
+
+            response = self.app.get('/api/leaderboard')
+            entries = json.loads(response.data)['entries']
+            self.assertEqual([(e['username'], e['points'], e['rank']) for e in entries],
+                             [('test_user', 15, 1), ('rival', 12, 2)])
+
+            response = self.app.get('/api/leaderboard?period=week')
+            entries = json.loads(response.data)['entries']
+            self.assertEqual([(e['username'], e['points']) for e in entries], [('test_user', 15)])
+
+            data = json.loads(self.app.get('/api/leaderboard/me?radius=1').data)
+            self.assertEqual(data['rank'], 1)
+            self.assertEqual(len(data['neighbors']), 2)
+
+            self.assertEqual(self.app.get('/api/leaderboard?period=year').status_code, 400)
+            self.assertEqual(len(json.loads(self.app.get('/api/leaderboard?limit=-1').data)['entries']), 1)
+            self.assertEqual(len(json.loads(self.app.get('/api/leaderboard/me?radius=-1').data)['neighbors']), 1)
+
+    def test_stats_etag_and_invalidation(self):
+        """Test stats responses are cached, revalidated and invalidated"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+
+        response = self.app.get('/api/community/stats')
+        etag = response.headers['ETag']
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        self.assertIn('Last-Modified', response.headers)
+
+        with patch('ecocycle_app.RecyclingAnalytics.get_community_stats') as mock_stats:
+            response = self.app.get('/api/community/stats', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            response = self.app.get('/api/community/stats')
+            self.assertEqual(response.status_code, 200)
+            mock_stats.assert_not_called()
+
+        self.app.post('/recycle', data={'item': 'battery'})
+        response = self.app.get('/api/community/stats', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(json.loads(response.data)['total_points_earned'], 10)
+
+    def test_report_shows_awarded_points(self):
+        """Test awards drop the cached user snapshot behind the report page"""
+        with app.app_context():
+            db.session.add(User(id=1, username='test_user'))
+            db.session.commit()
+
+        self.assertIn(b'0 Points', self.app.get('/report').data)
+        self.app.post('/recycle', data={'item': 'battery'})
+        self.app.post('/api/recycle/batch', json={'items': ['battery', 'battery']})
+        self.assertIn(b'30 Points', self.app.get('/report').data)
+
     @patch('ecocycle_app.RecyclingAnalytics.get_user_stats')
     def test_user_stats_api(self, mock_stats):
         """Test user stats API with mock"""
@@ -63,5 +760,333 @@ class EcoCycleTestCase(unittest.TestCase):
         self.assertEqual(data['total_points'], 100)
 
 
+class TTLCacheTestCase(unittest.TestCase):
+    def test_load_overlapping_invalidate_is_not_stored(self):
+        """Test a load that started before an invalidation is not cached"""
+        ttl_cache = cache.TTLCache('test', 60)
+
+        def stale_loader():
+            # A commit invalidates the key while this load is still reading
+            ttl_cache.invalidate('key')
+            return 'old'
+
+        self.assertEqual(ttl_cache.get_or_load('key', stale_loader), 'old')
+        self.assertEqual(ttl_cache.get_or_load('key', lambda: 'new'), 'new')
+        self.assertEqual(ttl_cache.get_or_load('key', lambda: 'newer'), 'new')
+
+
+class CatalogIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = CatalogIndex()
+        self.index.rebuild([
+            ('plastic bottle', 'Plastic'),
+            ('glass bottle', 'Glass'),
+            ('bottle cap', 'Metal'),
+            ('bottle', 'Glass'),
+            ('plastic bag', 'Plastic'),
+        ])
+
+    def test_rebuild_overlapping_invalidate_stays_stale(self):
+        """Test a rebuild that read the catalog before an invalidation is redone"""
+        def items():
+            # The catalog changes while the rebuild is reading it
+            self.index.invalidate()
+            yield ('paper', 'Paper')
+
+        self.index.rebuild(items())
+        self.assertTrue(self.index.needs_rebuild())
+        self.index.rebuild([('paper', 'Paper')])
+        self.assertFalse(self.index.needs_rebuild())
+
+    def test_ranking(self):
+        """Test exact, prefix, word prefix and substring ordering"""
+        results = [r['item'] for r in self.index.search('bottle')]
+        self.assertEqual(results, ['bottle', 'bottle cap', 'glass bottle', 'plastic bottle'])
+
+        results = [r['item'] for r in self.index.search('ttl')]
+        self.assertEqual(results, ['bottle', 'bottle cap', 'glass bottle', 'plastic bottle'])
+
+    def test_substring_and_limit(self):
+        """Test substring matching and result limit"""
+        self.assertEqual(len(self.index.search('a', limit=2)), 2)
+        self.assertEqual(self.index.search('  PLASTIC   bag '),
+                         [{'item': 'plastic bag', 'category': 'Plastic'}])
+        self.assertEqual(self.index.search('xyz'), [])
+
+
+class ItemMatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.matcher = ItemMatcher()
+        self.matcher.rebuild([
+            ('plastic bottle', ['water bottle']),
+            ('battery', []),
+            ('glass bottle', []),
+            ('cardboard', ['box']),
+        ])
+
+    def test_exact_and_normalized(self):
+        """Test normalization, plurals and aliases are exact matches"""
+        self.assertEqual(self.matcher.match('  Plastic-Bottles ').item, 'plastic bottle')
+        self.assertEqual(self.matcher.match('batteries').confidence, 1.0)
+        self.assertEqual(self.matcher.match('Water Bottles').item, 'plastic bottle')
+        self.assertEqual(self.matcher.match('boxes').item, 'cardboard')
+
+    def test_edit_distance(self):
+        """Test misspellings within the edit bound match with lower confidence"""
+        match = self.matcher.match('batery')
+        self.assertEqual((match.item, match.distance), ('battery', 1))
+        self.assertLess(match.confidence, 1.0)
+        self.assertEqual(self.matcher.match('plastik botle').item, 'plastic bottle')
+        self.assertIsNone(self.matcher.match('bx'))
+        self.assertIsNone(self.matcher.match('cardboard', min_confidence=1.1))
+        self.assertIsNone(self.matcher.match('refrigerator'))
+
+
+class ReadReplicaTestCase(unittest.TestCase):
+    def test_reads_route_to_replica(self):
+        """Test analytics read the replica while writes and plain reads use the primary"""
+        directory = tempfile.mkdtemp()
+        replica_app = Flask(__name__)
+        replica_app.config.from_object(TestConfig)
+        replica_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'primary.db')}"
+        replica_app.config['SQLALCHEMY_BINDS'] = {'replica': f"sqlite:///{os.path.join(directory, 'replica.db')}"}
+        db.init_app(replica_app)
+        # init_app registers metadata for the bind on the shared db; later apps have no such bind
+        self.addCleanup(db.metadatas.pop, 'replica', None)
+
+        with replica_app.app_context():
+            db.create_all()
+            db.metadata.create_all(db.engines['replica'])
+            with db.engines['replica'].begin() as connection:
+                connection.execute(UserTotals.__table__.insert(), {'user_id': 1, 'total_points': 42, 'total_items': 3})
+            db.session.add(UserTotals(user_id=1, total_points=7, total_items=1))
+            db.session.commit()
+            db.session.expunge_all()
+
+            self.assertEqual(RecyclingAnalytics.get_user_stats(1)['total_points'], 42)
+            db.session.expunge_all()
+            # Cached responses read the primary so they never store lagging data
+            with use_primary():
+                self.assertEqual(RecyclingAnalytics.get_user_stats(1)['total_points'], 7)
+            db.session.expunge_all()
+            self.assertEqual(db.session.get(UserTotals, 1).total_points, 7)
+
+            with use_replica():
+                db.session.add(User(id=5, username='replica_writer'))
+                # Pending and flushed writes keep reads on the primary
+                self.assertEqual(User.query.filter_by(id=5).count(), 1)
+                db.session.commit()
+            with db.engines['replica'].connect() as connection:
+                self.assertEqual(connection.execute(User.__table__.select()).all(), [])
+
+
+class BaselineMigrationTestCase(unittest.TestCase):
+    BASELINE_SCHEMA = """
+        CREATE TABLE recycling_items (id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, instruction TEXT NOT NULL,
+            points INTEGER NOT NULL, category VARCHAR(50) NOT NULL, tips TEXT, created_at DATETIME,
+            PRIMARY KEY (id), UNIQUE (name));
+        CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR(80) NOT NULL, points INTEGER, level INTEGER,
+            next_reward INTEGER, created_at DATETIME, PRIMARY KEY (id), UNIQUE (username));
+        CREATE TABLE categories (id INTEGER NOT NULL, name VARCHAR(50) NOT NULL, color VARCHAR(7),
+            description TEXT, PRIMARY KEY (id), UNIQUE (name));
+        CREATE TABLE recycling_records (id INTEGER NOT NULL, user_id INTEGER NOT NULL, item_name VARCHAR(100) NOT NULL,
+            points_earned INTEGER NOT NULL, recycled_at DATETIME, PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id));
+        INSERT INTO recycling_items (id, name, instruction, points, category)
+            VALUES (3, 'battery', 'Take to a battery drop-off.', 10, 'Hazardous');
+        INSERT INTO users (id, username, points, level, next_reward) VALUES (1, 'demo_user', 10, 1, 100);
+        INSERT INTO recycling_records (user_id, item_name, points_earned, recycled_at)
+            VALUES (1, 'battery', 10, '2024-01-01 00:00:00');
+    """
+
+    def test_init_database_upgrades_baseline_schema(self):
+        """Test every migration applies to a database created before any of them"""
+        path = os.path.join(tempfile.mkdtemp(), 'baseline.db')
+        with sqlite3.connect(path) as connection:
+            connection.executescript(self.BASELINE_SCHEMA)
+
+        baseline_app = Flask(__name__)
+        baseline_app.config.from_object(TestConfig)
+        baseline_app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+        db.init_app(baseline_app)
+
+        with baseline_app.app_context():
+            DatabaseInitializer.init_database()
+            self.assertEqual(run_migrations(), [])
+
+            inspector = inspect(db.engine)
+            self.assertIn('region_id', {column['name'] for column in inspector.get_columns('recycling_records')})
+            self.assertIn('ix_users_region_points', {index['name'] for index in inspector.get_indexes('users')})
+            self.assertIn('ix_recycling_records_region_recycled_at',
+                          {index['name'] for index in inspector.get_indexes('recycling_records')})
+            self.assertEqual(RecyclingRecord.query.one().item_id, 3)
+            self.assertEqual(db.session.get(UserTotals, 1).total_points, 10)
+            db.session.remove()
+
+
+class ResponseCacheBackendTestCase(unittest.TestCase):
+    def test_version_is_shared_between_backends(self):
+        """Test a bump through one handle invalidates entries seen by another"""
+        path = os.path.join(tempfile.mkdtemp(), 'responses.db')
+        first, second = response_cache.SQLiteBackend(path), response_cache.SQLiteBackend(path)
+
+        version, _ = first.version()
+        first.set('key', response_cache.CachedResponse(version, b'{}', 'application/json'))
+        self.assertEqual(second.get('key').body, b'{}')
+
+        second.bump_version()
+        self.assertEqual(first.version()[0], version + 1)
+        self.assertIsNone(first.get('key'))
+
+    def test_memory_versions_are_per_process_and_expire(self):
+        """Test memory backends never share a version and roll over after their TTL"""
+        first, second = response_cache.LRUBackend(ttl=5), response_cache.LRUBackend(ttl=5)
+        self.assertNotEqual(first.version()[0], second.version()[0])
+
+        version, updated_at = first.version()
+        first.set('key', response_cache.CachedResponse(version, b'{}', 'application/json'))
+        with patch('response_cache.time.time', return_value=updated_at + 5):
+            self.assertNotEqual(first.version()[0], version)
+        self.assertIsNone(first.get('key'))
+
+
+class LiveStatsTestCase(unittest.TestCase):
+    STATS = {'total_users': 1, 'total_recycled_items': 0, 'total_points_earned': 0, 'top_recyclers': []}
+
+    @staticmethod
+    def award(username, points):
+        return {'username': username, 'points': points, 'level': 'Beginner', 'awarded': 5, 'items': 1}
+
+    def test_slow_subscriber_gets_snapshot(self):
+        """Test a full buffer collapses into one snapshot without affecting others"""
+        hub = live_stats.LiveStatsHub(buffer_size=3)
+        slow, fast = hub.subscribe(lambda: self.STATS), hub.subscribe(lambda: self.STATS)
+        fast.drain()
+        for points in range(5, 25, 5):
+            hub.receive([self.award('alice', points)])
+            self.assertEqual(len(fast.drain()), 1)
+
+        events = slow.drain()
+        self.assertEqual(len(events), 2)
+        self.assertIn('event: snapshot', events[0])
+        self.assertIn('"total_points_earned":20', events[-1])
+
+        hub.unsubscribe(slow)
+        hub.unsubscribe(fast)
+        hub.receive([self.award('alice', 30)])
+        self.assertIsNone(hub._state)
+
+    def test_snapshot_loads_outside_the_lock(self):
+        """Test the first subscriber's stats query does not block award delivery"""
+        hub = live_stats.LiveStatsHub()
+
+        def load_stats():
+            self.assertTrue(hub._lock.acquire(blocking=False))
+            hub._lock.release()
+            return self.STATS
+
+        subscriber = hub.subscribe(load_stats)
+        self.assertIn('event: snapshot', subscriber.drain()[0])
+        hub.unsubscribe(subscriber)
+
+    def test_unix_socket_bus_reaches_other_hubs(self):
+        """Test awards published by one process's bus reach subscribers of another"""
+        directory = tempfile.mkdtemp()
+        publisher = live_stats.UnixSocketBus(live_stats.LiveStatsHub(), directory)
+        listener = live_stats.LiveStatsHub()
+        live_stats.UnixSocketBus(listener, directory)
+
+        publisher.publish([self.award('bob', 5)])
+        subscriber = listener.subscribe(lambda: self.STATS)
+        subscriber.drain()
+        publisher.publish([self.award('bob', 10)])
+        events = subscriber.wait(5)
+        self.assertEqual(len(events), 1)
+        self.assertIn('"points":10', events[0])
+
+        listener.unsubscribe(subscriber)
+        self.assertEqual(os.listdir(directory), [])
+
+
+class RateLimitTestCase(unittest.TestCase):
+    def test_sqlite_buckets_are_shared(self):
+        """Test two handles on one file draw from the same bucket and refill over time"""
+        path = os.path.join(tempfile.mkdtemp(), 'rate_limits.db')
+        first, second = rate_limit.SQLiteBackend(path), rate_limit.SQLiteBackend(path)
+
+        self.assertTrue(first.take('client', rate=2, burst=2, now=100).allowed)
+        self.assertTrue(second.take('client', rate=2, burst=2, now=100).allowed)
+        denied = first.take('client', rate=2, burst=2, now=100)
+        self.assertFalse(denied.allowed)
+        self.assertEqual(denied.retry_after, 0.5)
+        self.assertTrue(second.take('client', rate=2, burst=2, now=100.5).allowed)
+
+    def test_single_flight_shares_one_call(self):
+        """Test concurrent calls with one key run once and all get its result"""
+        flight, release, calls = SingleFlight(), threading.Event(), []
+
+        def search():
+            calls.append(1)
+            release.wait(5)
+            return ['plastic bottle']
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('plastic', search)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while flight.shared < 4:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['plastic bottle']] * 5)
+        self.assertEqual(flight.do('plastic', lambda: []), [])
+
+
+class LeaderboardTestCase(unittest.TestCase):
+    def test_ranks_and_neighbors(self):
+        """Test competition ranking, updates and neighbor windows"""
+        board = Leaderboard([(1, 50), (2, 80), (3, 50), (4, 10)])
+        self.assertEqual([e['user_id'] for e in board.top(2)], [2, 1])
+        self.assertEqual(board.rank(3), {'rank': 2, 'points': 50})
+        self.assertEqual(board.rank(4)['rank'], 4)
+
+        board.add_points(4, 75)
+        self.assertEqual(board.rank(4)['rank'], 1)
+        self.assertEqual([e['user_id'] for e in board.around(2, radius=1)], [4, 2, 1])
+        self.assertIsNone(board.rank(99))
+
+    def test_concurrent_refresh_loads_once_and_keeps_awards(self):
+        """Test stale boards are rebuilt once and awards made during the load survive"""
+        registry, loading, release, loads = LeaderboardRegistry(refresh_seconds=0), threading.Event(), \
+            threading.Event(), []
+
+        def load_scores(period, today):
+            loads.append(period)
+            loading.set()
+            release.wait(5)
+            return [(1, 10), (2, 20)]
+
+        boards = []
+        with patch('leaderboard._load_scores', side_effect=load_scores):
+            threads = [threading.Thread(target=lambda: boards.append(registry.get('all'))) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            loading.wait(5)
+            while registry._rebuild_flight.shared < 4:
+                threading.Event().wait(0.01)
+            registry.record_awards([{'user_id': 1, 'points': 40, 'awarded': 30, 'recycled_at': datetime.utcnow()}])
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(loads, ['all'])
+        self.assertEqual(len({id(board) for board in boards}), 1)
+        self.assertEqual(boards[0].rank(1), {'rank': 1, 'points': 40})
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from db_routing import reads_from_replica
+from models import db, RecyclingItem, UserDailyCount, UserCategoryDailyCount, ItemDailyCount, CategoryDailyCount
+
+GRANULARITIES = ('day', 'week', 'month')
+METRICS = ('items', 'points')
+DEFAULT_PERIODS = {'day': 30, 'week': 12, 'month': 12}
+# Longest series a single request may ask for, in buckets
+MAX_PERIODS = 1000
+METRIC_LABELS = {'items': 'Items recycled', 'points': 'Points earned'}
+
+
+def period_start(day, granularity):
+    """First day of the day/week (Monday)/month bucket containing ``day``"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_period(start, granularity):
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def period_count(start, end, granularity):
+    """Number of buckets from the one containing ``start`` to the one containing ``end``"""
+    if granularity == 'month':
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    days = (period_start(end, granularity) - period_start(start, granularity)).days
+    return days // (7 if granularity == 'week' else 1) + 1
+
+
+def default_range(granularity, today=None):
+    """The last DEFAULT_PERIODS buckets up to and including today"""
+    end = today or datetime.utcnow().date()
+    start = period_start(end, granularity)
+    for _ in range(DEFAULT_PERIODS[granularity] - 1):
+        start = period_start(start - timedelta(days=1), granularity)
+    return start, end
+
+
+class RecyclingTimeSeries:
+    """Trend series summed from the per-day rollup buckets
+
+    Cost is proportional to the number of daily buckets in the range, never
+    to the number of raw recycling records.
+    """
+
+    @staticmethod
+    def _bucket_query(user_id, by, metric):
+        if user_id is not None:
+            if by is None:
+                model, group = UserDailyCount, None
+            elif by == 'category':
+                model, group = UserCategoryDailyCount, UserCategoryDailyCount.category
+            else:
+                raise ValueError("Per-user series can only be grouped by 'category'")
+            query = db.session.query(model.day, *([group] if group is not None else []),
+                                     func.sum(getattr(model, metric)))
+            return model, group, query.filter(model.user_id == user_id)
+
+        if by == 'item':
+            query = db.session.query(ItemDailyCount.day, RecyclingItem.name, func.sum(getattr(ItemDailyCount, metric))) \
+                .join(RecyclingItem, RecyclingItem.id == ItemDailyCount.item_id)
+            return ItemDailyCount, RecyclingItem.name, query
+        if by == 'category':
+            group = CategoryDailyCount.category
+        elif by is None:
+            group = None
+        else:
+            raise ValueError("Series can be grouped by 'category' or 'item'")
+        query = db.session.query(CategoryDailyCount.day, *([group] if group is not None else []),
+                                 func.sum(getattr(CategoryDailyCount, metric)))
+        return CategoryDailyCount, group, query
+
+    @staticmethod
+    @reads_from_replica
+    def get_series(user_id=None, granularity='day', start=None, end=None, by=None, metric='items'):
+        """Chart.js-ready ``{'labels': [...], 'datasets': [{'label', 'data'}]}``
+
+        ``user_id`` None means community-wide. ``start``/``end`` are
+        inclusive dates and default to the last few buckets of the chosen
+        granularity. Empty buckets are filled with zeros. Ranges longer
+        than MAX_PERIODS buckets raise ValueError.
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+        if start is None or end is None:
+            default_start, default_end = default_range(granularity)
+            start, end = start or default_start, end or default_end
+        if start > end:
+            raise ValueError('start must not be after end')
+        count = period_count(start, end, granularity)
+        if count > MAX_PERIODS:
+            raise ValueError(f'At most {MAX_PERIODS} {granularity} buckets per series')
+
+        model, group, query = RecyclingTimeSeries._bucket_query(user_id, by, metric)
+        group_columns = [model.day] + ([group] if group is not None else [])
+        rows = query.filter(model.day >= start, model.day <= end).group_by(*group_columns).all()
+
+        # Stepping past the last bucket could overflow date.max
+        periods = [period_start(start, granularity)]
+        while len(periods) < count:
+            periods.append(next_period(periods[-1], granularity))
+        positions = {period: index for index, period in enumerate(periods)}
+
+        series = {}
+        for row in rows:
+            if group is not None:
+                day, label, value = row
+            else:
+                (day, value), label = row, METRIC_LABELS[metric]
+            data = series.setdefault(label, [0] * len(periods))
+            data[positions[period_start(day, granularity)]] += value or 0
+
+        if group is None and not series:
+            series[METRIC_LABELS[metric]] = [0] * len(periods)
+
+        return {
+            'granularity': granularity,
+            'metric': metric,
+            'labels': [period.isoformat() for period in periods],
+            'datasets': [{'label': label, 'data': data} for label, data in sorted(series.items())]
+        }
@@ -0,0 +1,221 @@
+"""Optional write-behind mode for /recycle.
+
+With ``WRITE_BEHIND_ENABLED`` set, /recycle appends the event to a durable
+local SQLite outbox and responds immediately. A background thread drains the
+outbox in batches through ``RecyclingService.record_events``, which applies
+each event's idempotency key exactly once, and only then deletes the drained
+rows. The thread starts with the first event a process queues, not at import,
+so anything left in the outbox after a crash is replayed then, or at once by
+``flask ecocycle drain-outbox``.
+
+Applied keys are kept in ``processed_events`` for ``WRITE_BEHIND_KEY_RETENTION``
+seconds, long enough to absorb client retries, and never pruned while an
+event that could replay them is still queued.
+"""
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+
+from models import db, ProcessedEvent
+from recycling import RecyclingService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_INTERVAL = 0.5
+DEFAULT_KEY_RETENTION = 24 * 3600
+# Seconds between two prunes of processed_events by the drain thread
+PRUNE_INTERVAL = 3600
+MAX_EVENT_KEY_LENGTH = ProcessedEvent.__table__.c.event_key.type.length
+
+
+class RecyclingOutbox:
+    """Append-only queue of recycling events in a local SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS outbox ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'event_key TEXT NOT NULL UNIQUE, '
+                'user_id INTEGER NOT NULL, '
+                'item_name TEXT NOT NULL, '
+                'recycled_at TEXT NOT NULL)'
+            )
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=FULL')
+            self._local.connection = connection
+        return connection
+
+    def enqueue(self, user_id, item_name, event_key=None, recycled_at=None):
+        """Durably append an event; repeated keys are ignored. Returns the key.
+
+        Raises ValueError for keys longer than ``processed_events`` can store,
+        which would otherwise fail every drain of their batch.
+        """
+        if event_key and len(event_key) > MAX_EVENT_KEY_LENGTH:
+            raise ValueError(f'Event keys are at most {MAX_EVENT_KEY_LENGTH} characters')
+        event_key = event_key or uuid.uuid4().hex
+        recycled_at = recycled_at or datetime.utcnow()
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO outbox (event_key, user_id, item_name, recycled_at) VALUES (?, ?, ?, ?)',
+                (event_key, user_id, item_name, recycled_at.isoformat())
+            )
+        return event_key
+
+    def fetch(self, limit=DEFAULT_BATCH_SIZE):
+        """Oldest pending events as ``(seq, event)`` pairs"""
+        rows = self._connect().execute(
+            'SELECT seq, event_key, user_id, item_name, recycled_at FROM outbox ORDER BY seq LIMIT ?',
+            (limit,)
+        ).fetchall()
+        return [(seq, {
+            'event_key': event_key,
+            'user_id': user_id,
+            'item_name': item_name,
+            'recycled_at': datetime.fromisoformat(recycled_at)
+        }) for seq, event_key, user_id, item_name, recycled_at in rows]
+
+    def ack(self, seqs):
+        """Delete events that have been applied to the main database"""
+        with self._connect() as connection:
+            connection.executemany('DELETE FROM outbox WHERE seq = ?', [(seq,) for seq in seqs])
+
+    def oldest(self):
+        """When the oldest pending event was queued, or None if the outbox is empty"""
+        queued_at = self._connect().execute('SELECT MIN(recycled_at) FROM outbox').fetchone()[0]
+        return datetime.fromisoformat(queued_at) if queued_at else None
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+
+def drain(app, outbox, batch_size=DEFAULT_BATCH_SIZE):
+    """Apply every queued event to the main database; returns how many were applied"""
+    applied = 0
+    with app.app_context():
+        retried = False
+        while True:
+            batch = outbox.fetch(batch_size)
+            if not batch:
+                return applied
+            try:
+                applied += RecyclingService.record_events([event for _, event in batch])
+            except IntegrityError:
+                db.session.rollback()
+                if retried:
+                    raise
+                # Another drainer committed some of these keys first. record_events
+                # skips keys already processed, so retrying applies only the rest
+                retried = True
+                continue
+            retried = False
+            outbox.ack([seq for seq, _ in batch])
+
+
+def prune_processed(outbox, retention=DEFAULT_KEY_RETENTION, now=None):
+    """Forget applied keys older than ``retention`` seconds; returns how many
+
+    Keys processed after the oldest queued event was enqueued are kept, so
+    replaying the outbox can never apply an event twice.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=retention)
+    oldest = outbox.oldest()
+    if oldest is not None:
+        cutoff = min(cutoff, oldest)
+    deleted = db.session.execute(delete(ProcessedEvent).where(ProcessedEvent.processed_at < cutoff)).rowcount
+    db.session.commit()
+    return deleted
+
+
+class WriteBehindWorker(threading.Thread):
+    """Daemon thread draining the outbox every ``interval`` seconds"""
+
+    def __init__(self, app, outbox, batch_size=DEFAULT_BATCH_SIZE, interval=DEFAULT_INTERVAL,
+                 key_retention=DEFAULT_KEY_RETENTION):
+        super().__init__(name='ecocycle-write-behind', daemon=True)
+        self.app = app
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.interval = interval
+        self.key_retention = key_retention
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+
+    def run(self):
+        next_prune = time.monotonic()
+        while not self.stopping.is_set():
+            try:
+                drain(self.app, self.outbox, self.batch_size)
+                if time.monotonic() >= next_prune:
+                    with self.app.app_context():
+                        prune_processed(self.outbox, self.key_retention)
+                    next_prune = time.monotonic() + PRUNE_INTERVAL
+            except Exception:
+                logger.exception('Write-behind drain failed; will retry')
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        self.join()
+        # Flush whatever arrived after the last pass
+        drain(self.app, self.outbox, self.batch_size)
+
+
+_lock = threading.Lock()
+_outboxes = {}
+_workers = {}
+
+
+def get_outbox(app):
+    path = app.config.get('WRITE_BEHIND_PATH') or os.path.join(app.instance_path, 'recycling_outbox.db')
+    with _lock:
+        if path not in _outboxes:
+            _outboxes[path] = RecyclingOutbox(path)
+        return _outboxes[path]
+
+
+def enqueue(app, user_id, item_name, event_key=None):
+    """Queue an event and make sure this process has a drain thread"""
+    outbox = get_outbox(app)
+    event_key = outbox.enqueue(user_id, item_name, event_key)
+    if app.config.get('WRITE_BEHIND_WORKER', True):
+        ensure_worker(app, outbox)
+    return event_key
+
+
+def ensure_worker(app, outbox):
+    with _lock:
+        worker = _workers.get(outbox.path)
+        if worker is None or not worker.is_alive():
+            worker = WriteBehindWorker(
+                app, outbox,
+                batch_size=app.config.get('WRITE_BEHIND_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                interval=app.config.get('WRITE_BEHIND_INTERVAL', DEFAULT_INTERVAL),
+                key_retention=app.config.get('WRITE_BEHIND_KEY_RETENTION', DEFAULT_KEY_RETENTION)
+            )
+            worker.start()
+            atexit.register(worker.stop)
+            _workers[outbox.path] = worker
+        return worker